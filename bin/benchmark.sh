@@ -0,0 +1,33 @@
+#!/bin/bash -e
+
+cat << EOF
+
+========================================================================
+Runs the benchmarks in tests/benchmarks.
+
+Usage:
+  ./bin/benchmark.sh --save    Time the benchmarks and save them as the baseline
+  ./bin/benchmark.sh           Time the benchmarks and compare them to the baseline
+
+A benchmark whose fastest round is more than BENCHMARK_THRESHOLD (default 25%)
+slower than the baseline fails the run. Baselines are machine specific
+and are kept in .benchmarks/baseline
+========================================================================
+
+EOF
+
+THRESHOLD=${BENCHMARK_THRESHOLD:-25%}
+STORAGE=.benchmarks/baseline
+ARGS="tests/benchmarks --benchmark-enable --benchmark-only --benchmark-warmup=on --benchmark-storage=$STORAGE"
+
+if [ "$1" == "--save" ]
+then
+  shift
+  python3 -m pytest $ARGS --benchmark-save=baseline "$@"
+elif [ -d "$STORAGE" ]
+then
+  python3 -m pytest $ARGS --benchmark-compare --benchmark-compare-fail=min:$THRESHOLD "$@"
+else
+  echo "No baseline found in $STORAGE. Run './bin/benchmark.sh --save' first."
+  exit 1
+fi
@@ -10,6 +10,11 @@ import datetime
 import os
 
 from demo.demo_telemetry import DemoTelemetry
+from gateway.downlink_cache import DEFAULT_QUOTA, DownlinkCache, http_fetcher
+from gateway.file_catalog import FileCatalog
+from gateway.http_client import download_staged_file, shared_client, upload_downlinked_file
+from gateway.profiler import SamplingProfiler
+from gateway.validation import CommandValidator
 
 logger = logging.getLogger(__name__)
 
@@ -19,10 +24,17 @@ class CommandCancelledError(Exception):
 
 
 class DemoSat:
-    def __init__(self, name="Space Oddity"):
+    def __init__(self, name="Space Oddity", file_catalog_path=None, downlink_cache_path=".downlink_cache",
+                 downlink_cache_quota=DEFAULT_QUOTA, http_client=None):
         self.name = name
         self.telemetry = DemoTelemetry(name=name)
-        self.file_list = []
+        # Files on board, and which of them Major Tom already knows about. See gateway/file_catalog.py
+        self.file_catalog = FileCatalog(path=file_catalog_path, system=name)
+        # Downlinked files by content hash, so repeats are neither re-fetched nor re-uploaded.
+        # See gateway/downlink_cache.py
+        self.downlink_cache = DownlinkCache(downlink_cache_path, quota=downlink_cache_quota)
+        # Pooled, retrying HTTP that runs off the event loop. See gateway/http_client.py
+        self.http = http_client or shared_client()
         self.running_commands = {}
         self.force_cancel = True  # Forces all commands to be cancelled, regardless of run state.
         self.definitions = {
@@ -86,8 +98,17 @@ class DemoSat:
                 "description": "Commands the spacecraft into safemode, shutting down all non-essential systems.",
                 "tags": ["operations", "testing"],
                 "fields": []
+            },
+            "profile": {
+                "display_name": "Profile Gateway",
+                "description": "Samples the Gateway's stacks for the given number of seconds and uploads a flamegraph-compatible collapsed stack file.",
+                "tags": ["diagnostics"],
+                "fields": [
+                    {"name": "duration", "type": "integer", "default": 30}
+                ]
             }
         }
+        self.validator = CommandValidator(self.definitions)
 
     async def cancel_callback(self, id, gateway):
 
@@ -111,6 +132,12 @@ class DemoSat:
                 "message": "Command is not running. Unable to cancel command."
             }]))
 
+    async def report_files(self, gateway):
+        """ Sends Major Tom only the files it hasn't seen yet, a page at a time. """
+        for page in self.file_catalog.pending_pages():
+            await gateway.update_file_list(system=self.name, files=page)
+            self.file_catalog.mark_reported(page)
+
     def check_cancelled(self, id, gateway):
         if self.running_commands[str(id)]["cancel"]:
             # Raise an exception to immediately stop the command operations
@@ -119,6 +146,12 @@ class DemoSat:
             return
 
     async def command_callback(self, command, gateway):
+        # Reject malformed commands (and fill in defaults) before doing anything else
+        errors = self.validator.validate(command)
+        if errors:
+            asyncio.ensure_future(gateway.fail_command(command_id=command.id, errors=errors))
+            return
+
         self.running_commands[str(command.id)] = {"cancel": False}
         try:
             if command.type == "ping":
@@ -164,42 +197,35 @@ class DemoSat:
                 Nominal sends normal data that just varies slightly
                 """
                 self.telemetry.safemode = False
-                if type(command.fields['duration']) != type(int()):
-                    asyncio.ensure_future(gateway.fail_command(
-                        command_id=command.id, errors=[
-                            f"Duration type is invalid. Must be an int. Type: {type(command.fields['duration'])}"
-                        ]))
+                await asyncio.sleep(4)
+                self.check_cancelled(id=command.id, gateway=gateway)
+                if command.fields['mode'] == "ERROR":
+                    asyncio.ensure_future(self.telemetry.generate_telemetry(
+                        duration=command.fields['duration'], gateway=gateway, type="ERROR"))
                 else:
-                    await asyncio.sleep(4)
-                    self.check_cancelled(id=command.id, gateway=gateway)
-                    if command.fields['mode'] == "ERROR":
-                        asyncio.ensure_future(self.telemetry.generate_telemetry(
-                            duration=command.fields['duration'], gateway=gateway, type="ERROR"))
-                    else:
-                        asyncio.ensure_future(self.telemetry.generate_telemetry(
-                            duration=command.fields['duration'], gateway=gateway, type="NOMINAL"))
+                    asyncio.ensure_future(self.telemetry.generate_telemetry(
+                        duration=command.fields['duration'], gateway=gateway, type="NOMINAL"))
 
-                    await asyncio.sleep(4)
-                    self.check_cancelled(id=command.id, gateway=gateway)
-                    asyncio.ensure_future(gateway.complete_command(
-                        command_id=command.id,
-                        output=f"Started Telemetry Beacon in mode: {command.fields['mode']} for {command.fields['duration']} seconds."))
+                await asyncio.sleep(4)
+                self.check_cancelled(id=command.id, gateway=gateway)
+                asyncio.ensure_future(gateway.complete_command(
+                    command_id=command.id,
+                    output=f"Started Telemetry Beacon in mode: {command.fields['mode']} for {command.fields['duration']} seconds."))
 
             elif command.type == "update_file_list":
                 """
                 Sends a dummy file list to Major Tom.
                 """
                 for i in range(1, randint(2, 4)):
-                    self.file_list.append({
-                        "name": f'Payload-Image-{(len(self.file_list)+1):04d}.png',
+                    self.file_catalog.add({
+                        "name": f'Payload-Image-{(len(self.file_catalog)+1):04d}.png',
                         "size": randint(2000000, 3000000),
                         "timestamp": int(time.time() * 1000) + i*10,
                         "metadata": {"type": "image", "lat": (randint(-89, 89) + .0001*randint(0, 9999)), "lng": (randint(-179, 179) + .0001*randint(0, 9999))}
                     })
 
                 self.check_cancelled(id=command.id, gateway=gateway)
-                asyncio.ensure_future(gateway.update_file_list(
-                    system=self.name, files=self.file_list))
+                asyncio.ensure_future(self.report_files(gateway))
                 await asyncio.sleep(10)
                 self.check_cancelled(id=command.id, gateway=gateway)
                 asyncio.ensure_future(gateway.complete_command(
@@ -287,11 +313,12 @@ class DemoSat:
                 # Download file from Major Tom
                 try:
                     self.check_cancelled(id=command.id, gateway=gateway)
-                    filename, content = gateway.download_staged_file(
-                        gateway_download_path=command.fields["gateway_download_path"])
+                    filename, content = await self.http.run(
+                        download_staged_file, self.http, gateway, command.fields["gateway_download_path"])
                 except Exception as e:
                     asyncio.ensure_future(gateway.fail_command(command_id=command.id, errors=[
                                           "File failed to download", f"Error: {traceback.format_exc()}"]))
+                    return
 
                 # Write file locally.
                 with open(filename, "wb") as f:
@@ -410,15 +437,14 @@ class DemoSat:
                 try:
                     # Get the image info and download url
                     url = "https://epic.gsfc.nasa.gov/api/natural"
-                    r = requests.get(url)
+                    r = await self.http.aget(url)
                     if r.status_code != 200:
                         raise(RuntimeError(f"File Download Failed. Status code: {r.status_code}"))
 
                     # Retrieve necessary data from the response
                     images = json.loads(r.content)
                     latest_image = images[-1]
-                    for field in latest_image:
-                        logger.debug(f'{field}  :  {latest_image[field]}')
+                    logger.debug("Latest image: %s", latest_image)
                     image_date = datetime.datetime.strptime(
                         latest_image["date"], "%Y-%m-%d %H:%M:%S")
                     api_filename = latest_image["image"] + ".png"
@@ -429,21 +455,17 @@ class DemoSat:
                     image_url = "https://epic.gsfc.nasa.gov/archive/natural" + \
                         image_date.strftime("/%Y/%m/%d") + "/png/" + api_filename
 
-                    # Get the image itself
+                    # Get the image itself. The cache resumes an interrupted downlink, and skips it
+                    # entirely if this image was already downlinked.
                     self.check_cancelled(id=command.id, gateway=gateway)
-                    image_r = requests.get(image_url)
-                    if image_r.status_code != 200:
-                        raise(RuntimeError(
-                            f"File Download Failed. Status code: {image_r.status_code}"))
-
-                    # Write file to disk
-                    self.check_cancelled(id=command.id, gateway=gateway)
-                    with open(image_filename, "wb") as f:
-                        f.write(image_r.content)
-                    logger.info(f"Downloaded Image: {api_filename} as name {image_filename}")
-                except RuntimeError as e:
+                    fetch = http_fetcher(image_url, client=self.http)
+                    digest, image_path = await self.http.run(
+                        self.downlink_cache.downlink, key=image_url, fetch=fetch, meta=fetch.meta)
+                    logger.info("Downloaded Image: %s as name %s (%s)", api_filename, image_filename, digest)
+                except (RuntimeError, requests.RequestException) as e:
                     asyncio.ensure_future(gateway.fail_command(command_id=command.id, errors=[
                                           "File failed to download", f"Error: {traceback.format_exc()}"]))
+                    return
 
                 # Update command in Major Tom
                 await asyncio.sleep(10)
@@ -465,29 +487,78 @@ class DemoSat:
                     }
                 ))
 
-                # Upload file to Major Tom with Metadata
+                # Identical content that Major Tom already has for this system isn't uploaded again
                 self.check_cancelled(id=command.id, gateway=gateway)
+                if self.downlink_cache.is_uploaded(digest, self.name):
+                    asyncio.ensure_future(gateway.complete_command(
+                        command_id=command.id,
+                        output=f'"{api_filename}" was already uploaded to Major Tom, not uploading it again'
+                    ))
+                    return
+
+                # Upload file to Major Tom with Metadata
                 try:
-                    gateway.upload_downlinked_file(
+                    await self.http.run(
+                        upload_downlinked_file,
+                        self.http,
+                        gateway,
                         filename=image_filename,
-                        filepath=image_filename,  # Same as the name since we stored it locally
+                        filepath=image_path,
                         system=self.name,
                         command_id=command.id,
-                        content_type=image_r.headers["Content-Type"],
+                        content_type=self.downlink_cache.meta(digest).get("content_type", "image/png"),
                         metadata=latest_image
                     )
+                    self.downlink_cache.mark_uploaded(digest, self.name)
                     await asyncio.sleep(10)
                     self.check_cancelled(id=command.id, gateway=gateway)
                     asyncio.ensure_future(gateway.complete_command(
                         command_id=command.id,
                         output=f'"{image_filename}" successfully downlinked from Spacecraft and uploaded to Major Tom'
                     ))
-                except RuntimeError as e:
+                except (RuntimeError, requests.RequestException) as e:
                     asyncio.ensure_future(gateway.fail_command(command_id=command.id, errors=[
                                           "Downlinked File failed to upload to Major Tom", f"Error: {traceback.format_exc()}"]))
 
-                # Remove file now that it's uploaded so we don't fill the disk.
-                os.remove(image_filename)
+            elif command.type == "profile":
+                """
+                Samples the Gateway's stacks while it keeps running, then uploads them as a
+                flamegraph-compatible collapsed stack file.
+                """
+                duration = command.fields.get("duration", 30)
+                asyncio.ensure_future(gateway.transmit_command_update(
+                    command_id=command.id,
+                    state="processing_on_gateway",
+                    dict={"status": f"Profiling the Gateway for {duration} seconds"}
+                ))
+                profiler = SamplingProfiler()
+                profiler.start()
+                try:
+                    await asyncio.sleep(duration)
+                finally:
+                    profiler.stop()
+                self.check_cancelled(id=command.id, gateway=gateway)
+                path = profiler.write()
+                try:
+                    # Uploading blocks, so keep it off the event loop
+                    await self.http.run(
+                        upload_downlinked_file,
+                        self.http,
+                        gateway,
+                        filename=f"gateway-profile-{command.id}.collapsed",
+                        filepath=path,
+                        system=self.name,
+                        command_id=command.id,
+                        content_type="text/plain")
+                    asyncio.ensure_future(gateway.complete_command(
+                        command_id=command.id,
+                        output=f"Uploaded {profiler.samples} samples"
+                    ))
+                except (RuntimeError, requests.RequestException) as e:
+                    asyncio.ensure_future(gateway.fail_command(command_id=command.id, errors=[
+                                          "Profile failed to upload", f"Error: {traceback.format_exc()}"]))
+                finally:
+                    os.remove(path)
 
         except Exception as e:
             if type(e) == type(CommandCancelledError()):
@@ -1,6 +1,7 @@
 import time
 import random
 import asyncio
+from gateway.metric_batch import MetricBatch, MetricChannels, transmit_batch
 
 
 class DemoTelemetry:
@@ -9,6 +10,8 @@ class DemoTelemetry:
         self.alerted = False
         self.safemode = False
         self.start_time = time.time()  # For calculating uptime
+        # Each channel's identity is encoded once. See gateway/metric_batch.py
+        self.channels = MetricChannels()
         self.telemetry = {
             "battery": {
                 "voltage": {
@@ -70,27 +73,19 @@ class DemoTelemetry:
                 }
                 asyncio.ensure_future(gateway.transmit_events(events=[event]))
                 break
-            metrics = []
-            for subsystem in self.telemetry:
-                for metric in self.telemetry[subsystem]:
-                    metrics.append({
-                        "system": self.name,
-                        "subsystem": subsystem,
-                        "metric": metric,
-                        "value": self.telemetry[subsystem][metric]["value"],
-                        "timestamp": int(time.time() * 1000)
-                    })
-            metrics.append({
-                "system": self.name,
-                "subsystem": "obc",
-                "metric": "uptime",
-                "value": (time.time() - self.start_time),
-                "timestamp": int(time.time() * 1000)
-
-            })
-            asyncio.ensure_future(gateway.transmit_metrics(metrics=metrics))
+            asyncio.ensure_future(transmit_batch(gateway, self.build_batch()))
             await asyncio.sleep(1)
 
+    def build_batch(self):
+        ''' Builds one tick's worth of metrics from the current telemetry values, sharing one timestamp. '''
+        now = time.time()
+        batch = MetricBatch(timestamp=int(now * 1000))
+        for subsystem in self.telemetry:
+            for metric in self.telemetry[subsystem]:
+                batch.add(self.channels.prefix(self.name, subsystem, metric), self.telemetry[subsystem][metric]["value"])
+        batch.add(self.channels.prefix(self.name, "obc", "uptime"), now - self.start_time)
+        return batch
+
     def __nominal(self):
         for subsystem in self.telemetry:
             for metric in self.telemetry[subsystem]:
@@ -0,0 +1,124 @@
+'''
+Event loop lag watchdog for the async demo.
+
+Everything in DemoSat runs on one event loop, so a callback that blocks (a synchronous HTTP
+request, a large file write) freezes every beacon and every other command until it returns.
+
+The watchdog measures that directly. A heartbeat coroutine wakes up every `interval` seconds and
+records how late it was (the loop lag). A separate thread checks that the heartbeat keeps beating;
+when it has been silent for longer than `threshold`, the thread captures the stack of the event loop
+thread, which is the code doing the blocking. Once the loop recovers, the stall is reported to
+Major Tom as an event (with the stack in its debug info) and loop lag is reported as metrics.
+'''
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+
+logger = logging.getLogger(__name__)
+
+
+class LoopWatchdog:
+    def __init__(self, system, gateway, interval=0.05, threshold=0.25, metric_interval=1.0):
+        self.system = system
+        self.gateway = gateway
+        self.interval = interval
+        self.threshold = threshold
+        self.metric_interval = metric_interval
+        self.stalls = 0
+        self._last_beat = None
+        self._loop_thread_id = None
+        self._captured_stack = None
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._task = None
+        self._thread = None
+
+    def start(self):
+        ''' Starts watching the current event loop. Must be called from the loop's thread. '''
+        self._loop_thread_id = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.ensure_future(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _heartbeat(self):
+        window_max_lag = 0.0
+        window_start = time.monotonic()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._last_beat = now
+            window_max_lag = max(window_max_lag, lag)
+
+            # The watchdog thread may have caught a stall that ended just short of the threshold here
+            if lag >= self.threshold or self._captured_stack is not None:
+                self._report_stall(lag)
+
+            if now - window_start >= self.metric_interval:
+                self._report_metrics(window_max_lag)
+                window_max_lag = 0.0
+                window_start = now
+
+    def _watch(self):
+        # Runs in its own thread, so it keeps running while the event loop is blocked.
+        while not self._stopped.wait(self.interval):
+            silent_for = time.monotonic() - self._last_beat
+            if silent_for < self.threshold:
+                continue
+            with self._lock:
+                if self._captured_stack is not None:
+                    continue  # Already captured this stall
+                frame = sys._current_frames().get(self._loop_thread_id)
+                if frame is None:
+                    continue
+                self._captured_stack = "".join(traceback.format_stack(frame))
+            logger.warning(f"Event loop blocked for over {silent_for:.3f}s in:\n{self._captured_stack}")
+
+    def _report_stall(self, lag):
+        with self._lock:
+            stack = self._captured_stack
+            self._captured_stack = None
+        self.stalls += 1
+        logger.warning(f"Event loop was blocked for {lag:.3f}s")
+        asyncio.ensure_future(self.gateway.transmit_events(events=[{
+            "system": self.system,
+            "type": "Event Loop Stall",
+            "level": "warning",
+            "message": f"Gateway event loop was blocked for {lag * 1000:.0f} ms. Beacons and commands were delayed.",
+            "debug": {
+                "blocked_ms": round(lag * 1000, 1),
+                "stack": stack or "Not captured",
+            },
+            "timestamp": int(time.time() * 1000)
+        }]))
+
+    def _report_metrics(self, max_lag):
+        timestamp = int(time.time() * 1000)
+        asyncio.ensure_future(self.gateway.transmit_metrics(metrics=[
+            {
+                "system": self.system,
+                "subsystem": "gateway",
+                "metric": "event_loop_lag_ms",
+                "value": round(max_lag * 1000, 3),
+                "timestamp": timestamp
+            },
+            {
+                "system": self.system,
+                "subsystem": "gateway",
+                "metric": "event_loop_stalls",
+                "value": self.stalls,
+                "timestamp": timestamp
+            }
+        ]))
@@ -0,0 +1,307 @@
+'''
+A local columnar archive of the metrics and command states the gateway sends to Major Tom.
+
+TelemetryArchive taps `api.transmit`, so everything that reaches Major Tom through
+update_metrics, set_command_status or the demo's own calls is kept for post-pass analysis:
+
+    archive = TelemetryArchive("archive", system="Example FlatSat")
+    archive.install(api)          # after the outbound lanes, see outbound.py
+    ...
+    archive.read("metrics", day="2026-10-19", system="Example FlatSat")   # {column: [values]}
+
+The tap only appends a reference to the message to a queue, so the sending path pays well under
+a microsecond per point. A background thread turns the messages into columns, buffers them per
+partition, and writes a row group to a new part file once `row_group_size` rows are waiting or
+`flush_interval` seconds have passed. Files are partitioned by kind, day (UTC) and system:
+
+    archive/metrics/day=2026-10-19/system=Example%20FlatSat/part-<time in ns>-<random>.parquet
+    archive/commands/day=2026-10-19/system=Example%20FlatSat/part-<time in ns>-<random>.parquet
+
+Part files sort in the order they were written, and never collide with another run's. Once a
+partition's newest files include `compact_after` small ones (under `compact_size` bytes) in a row,
+those are merged into one compacted file, which is then left alone. Files are Parquet
+when pyarrow is installed. Without it they use a small built-in columnar format (.mtc) with the
+same columns, which `read` understands too.
+'''
+import array
+import collections
+import datetime
+import glob
+import json
+import logging
+import math
+import os
+import struct
+import threading
+import time
+import urllib.parse
+import uuid
+
+from .metric_batch import EncodedMessage
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+logger = logging.getLogger(__name__)
+
+# Marks a part file made by compaction
+COMPACTED = "-compacted"
+
+# kind -> [(column, type)]
+SCHEMAS = {
+    "metrics": [("timestamp", "int64"), ("subsystem", "string"), ("metric", "string"), ("value", "float64")],
+    "commands": [("timestamp", "int64"), ("command_id", "int64"), ("state", "string")],
+}
+
+
+class ParquetFormat:
+    extension = ".parquet"
+
+    def write(self, path, kind, columns):
+        types = {"int64": pyarrow.int64(), "float64": pyarrow.float64(), "string": pyarrow.string()}
+        table = pyarrow.table({name: pyarrow.array(columns[name], type=types[type]) for name, type in SCHEMAS[kind]})
+        pyarrow.parquet.write_table(table, path)
+
+    def read(self, path):
+        return pyarrow.parquet.read_table(path).to_pydict()
+
+
+class ColumnarFormat:
+    '''
+    Columns stored one after another: a header line of JSON naming each column's type and length
+    in bytes, then the columns. Numbers are packed arrays, and strings are dictionary encoded.
+    '''
+    extension = ".mtc"
+    MAGIC = b"MTC1"
+    HEADER_LENGTH = struct.Struct(">I")
+    ARRAY_TYPES = {"int64": "q", "float64": "d"}
+
+    def write(self, path, kind, columns):
+        header = []
+        blobs = []
+        for name, type in SCHEMAS[kind]:
+            values = columns[name]
+            if type == "string":
+                dictionary = {}
+                indices = array.array("I", (dictionary.setdefault(value, len(dictionary)) for value in values))
+                words = json.dumps(list(dictionary)).encode("utf-8")
+                blob = self.HEADER_LENGTH.pack(len(words)) + words + indices.tobytes()
+            else:
+                blob = array.array(self.ARRAY_TYPES[type], values).tobytes()
+            header.append({"name": name, "type": type, "length": len(blob)})
+            blobs.append(blob)
+        header = json.dumps({"rows": len(columns[SCHEMAS[kind][0][0]]), "columns": header}).encode("utf-8")
+        with open(path, "wb") as f:
+            f.write(self.MAGIC + self.HEADER_LENGTH.pack(len(header)) + header)
+            for blob in blobs:
+                f.write(blob)
+
+    def read(self, path):
+        with open(path, "rb") as f:
+            data = f.read()
+        if data[:len(self.MAGIC)] != self.MAGIC:
+            raise ValueError(f"{path} is not an archive file")
+        offset = len(self.MAGIC)
+        length, = self.HEADER_LENGTH.unpack_from(data, offset)
+        offset += self.HEADER_LENGTH.size
+        header = json.loads(data[offset:offset + length])
+        offset += length
+        columns = {}
+        for column in header["columns"]:
+            blob = data[offset:offset + column["length"]]
+            offset += column["length"]
+            if column["type"] == "string":
+                length, = self.HEADER_LENGTH.unpack_from(blob)
+                words = json.loads(blob[self.HEADER_LENGTH.size:self.HEADER_LENGTH.size + length])
+                indices = array.array("I", blob[self.HEADER_LENGTH.size + length:])
+                columns[column["name"]] = [words[i] for i in indices]
+            else:
+                columns[column["name"]] = array.array(self.ARRAY_TYPES[column["type"]], blob).tolist()
+        return columns
+
+
+def default_format():
+    return ParquetFormat() if pyarrow is not None else ColumnarFormat()
+
+
+def day_of(timestamp):
+    return datetime.datetime.fromtimestamp(timestamp / 1000, tz=datetime.timezone.utc).strftime("%Y-%m-%d")
+
+
+class Partition:
+    def __init__(self, kind):
+        self.kind = kind
+        self.columns = {name: [] for name, _ in SCHEMAS[kind]}
+        self.since = time.monotonic()
+
+    def __len__(self):
+        return len(self.columns["timestamp"])
+
+
+class TelemetryArchive:
+    def __init__(self, root, system=None, row_group_size=10000, flush_interval=5.0, compact_after=8,
+                 compact_size=8 * 1024 * 1024, format=None):
+        self.root = root
+        self.system = system  # Command states don't name a system
+        self.row_group_size = row_group_size
+        self.flush_interval = flush_interval
+        self.compact_after = compact_after
+        self.compact_size = compact_size
+        self.format = format or default_format()
+        self.queue = collections.deque()
+        self.partitions = {}  # (kind, day, system) -> Partition
+        self.stats = collections.Counter()
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+        self._lock = threading.Lock()  # Held while writing, so read() sees whole files
+
+    def install(self, api):
+        ''' Archives what `api.transmit` sends. '''
+        send = api.transmit
+
+        async def transmit(payload):
+            self.archive(payload)
+            return await send(payload)
+
+        api.transmit = transmit
+
+    def archive(self, payload):
+        ''' The hot path: queues a measurements or command_update message for the writer. '''
+        kind = payload.get("type")
+        if kind == "measurements":
+            self.queue.append(payload)
+        elif kind == "command_update":
+            self.queue.append((time.time(), payload))
+        else:
+            return
+        if self._thread is None:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="archive-writer", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while not self._stopped:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush(force=False)
+            except Exception:
+                logger.exception("Archiving failed")
+
+    def _drain(self):
+        ''' Moves queued messages into the partition buffers. Called with the lock held. '''
+        while self.queue:
+            item = self.queue.popleft()
+            if isinstance(item, tuple):
+                sent, payload = item
+                self._add_command(sent, payload["command"])
+            elif isinstance(item, EncodedMessage):
+                self._add_metrics(item.payload()["measurements"])
+            else:
+                self._add_metrics(item["measurements"])
+
+    def _partition(self, kind, timestamp, system):
+        key = (kind, day_of(timestamp), system)
+        partition = self.partitions.get(key)
+        if partition is None:
+            partition = self.partitions[key] = Partition(kind)
+        return partition
+
+    def _add_metrics(self, metrics):
+        for metric in metrics:
+            value = metric.get("value")
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                self.stats["skipped"] += 1
+                continue
+            timestamp = metric.get("timestamp") or int(time.time() * 1000)
+            columns = self._partition("metrics", timestamp, metric.get("system")).columns
+            columns["timestamp"].append(timestamp)
+            columns["subsystem"].append(metric.get("subsystem"))
+            columns["metric"].append(metric.get("metric"))
+            columns["value"].append(float(value) if math.isfinite(value) else math.nan)
+
+    def _add_command(self, sent, command):
+        timestamp = int(sent * 1000)
+        columns = self._partition("commands", timestamp, self.system).columns
+        columns["timestamp"].append(timestamp)
+        columns["command_id"].append(int(command["id"]))
+        columns["state"].append(str(getattr(command["state"], "value", command["state"])))
+
+    def flush(self, force=True):
+        ''' Writes buffered rows. Without force, only partitions that are full or old enough. '''
+        with self._lock:
+            self._drain()
+            now = time.monotonic()
+            for key, partition in list(self.partitions.items()):
+                if not len(partition):
+                    del self.partitions[key]
+                elif force or len(partition) >= self.row_group_size or now - partition.since >= self.flush_interval:
+                    del self.partitions[key]
+                    self._write(key, partition)
+
+    def _directory(self, kind, day, system):
+        return os.path.join(self.root, kind, f"day={day}", f"system={urllib.parse.quote(str(system), safe='')}")
+
+    def _part_path(self, directory):
+        # PIDs repeat across runs (the gateway is often PID 1 in a container), so names are random
+        return os.path.join(directory, f"part-{time.time_ns():020d}-{uuid.uuid4().hex}{self.format.extension}")
+
+    def _parts(self, directory):
+        return sorted(glob.glob(os.path.join(directory, "part-*" + self.format.extension)))
+
+    def _write(self, key, partition):
+        kind, day, system = key
+        directory = self._directory(kind, day, system)
+        os.makedirs(directory, exist_ok=True)
+        path = self._part_path(directory)
+        self.format.write(path + ".tmp", kind, partition.columns)
+        os.replace(path + ".tmp", path)
+        self.stats["rows"] += len(partition)
+        self.stats["files"] += 1
+        small = []
+        # Only the newest run of small, uncompacted files is merged, so rows stay in file order
+        for part in reversed(self._parts(directory)):
+            if part.endswith(COMPACTED + self.format.extension) or os.path.getsize(part) >= self.compact_size:
+                break
+            small.append(part)
+        if len(small) >= self.compact_after:
+            self._compact(kind, directory, small[::-1])
+
+    def _compact(self, kind, directory, parts):
+        ''' Merges part files into one compacted file, which sorts where the first of them did. '''
+        merged = {name: [] for name, _ in SCHEMAS[kind]}
+        for part in parts:
+            for name, values in self.format.read(part).items():
+                merged[name] += values
+        path = parts[0][:-len(self.format.extension)] + COMPACTED + self.format.extension
+        self.format.write(path + ".tmp", kind, merged)
+        os.replace(path + ".tmp", path)
+        for part in parts:
+            os.remove(part)
+        self.stats["compactions"] += 1
+        logger.debug("Compacted %s files in %s", len(parts), directory)
+
+    def read(self, kind, day, system):
+        ''' Every archived row for one partition, as {column: [values]}. '''
+        with self._lock:
+            directory = self._directory(kind, day, system)
+            columns = {name: [] for name, _ in SCHEMAS[kind]}
+            for part in self._parts(directory):
+                for name, values in self.format.read(part).items():
+                    columns[name] += values
+            return columns
+
+    def close(self):
+        self._stopped = True
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
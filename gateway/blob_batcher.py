@@ -0,0 +1,111 @@
+'''
+Batches commands bound for a groundstation network into multi-frame blobs.
+
+Sending each command as its own `transmit_blob` costs one websocket message (and one GSN
+upload) per command, even when many commands go up in the same pass. BlobBatcher collects the
+encoded frames for each (norad_id, pass_id) and sends them as one blob built with
+stubs.pack_frames, when any of these happens first:
+
+  - the batch reaches max_frames frames,
+  - the next frame would take the blob past max_bytes,
+  - max_delay seconds have passed since the batch's first frame.
+
+The spacecraft (or the Leaf sandbox, which echoes blobs back) sees one multi-frame blob, which
+received_blob_callback splits again with stubs.unpack_frames.
+
+If sending a blob fails, `failed` is called with the ids of the commands it carried and the error,
+so they can be failed rather than left uplinking.
+
+    batcher = BlobBatcher(send=lambda blob, context: ..., failed=lambda command_ids, error: ...)
+    batcher.add(encrypted, {"norad_id": "00000", "pass_id": "abc"}, command_id=7)
+'''
+import logging
+import threading
+
+from . import stubs
+from .scheduler import shared_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+def batch_key(context):
+    return (context.get("norad_id"), context.get("pass_id"))
+
+
+class Batch:
+    def __init__(self, context):
+        self.context = context
+        self.frames = []
+        self.command_ids = []
+        self.size = stubs.MULTI_FRAME_OVERHEAD
+        self.flush_call = None
+
+
+class BlobBatcher:
+    def __init__(self, send, max_frames=32, max_bytes=64 * 1024, max_delay=0.5, scheduler=None, failed=None):
+        self.send = send
+        self.failed = failed
+        self.scheduler = scheduler or shared_scheduler()
+        self.max_frames = max_frames
+        self.max_bytes = max_bytes
+        self.max_delay = max_delay
+        self.batches = {}  # (norad_id, pass_id) -> Batch
+        self.blobs_sent = 0
+        self.frames_sent = 0
+        self.blobs_failed = 0
+        self._lock = threading.Lock()
+
+    def add(self, frame, context, command_id=None):
+        ''' Queues one encoded frame, for the command `command_id`, for the pass described by context. '''
+        key = batch_key(context)
+        ready = []
+        with self._lock:
+            batch = self.batches.get(key)
+            if batch is not None and batch.size + stubs.framed_size(frame) > self.max_bytes:
+                ready.append(self._take(key))
+                batch = None
+            if batch is None:
+                batch = self.batches[key] = Batch(dict(context))
+                if self.max_delay is not None:
+                    # Sending waits on the websocket, so it runs on a scheduler worker
+                    batch.flush_call = self.scheduler.call_later_blocking(self.max_delay, self.flush, key)
+            batch.frames.append(frame)
+            batch.command_ids.append(command_id)
+            batch.size += stubs.framed_size(frame)
+            if len(batch.frames) >= self.max_frames or batch.size >= self.max_bytes:
+                ready.append(self._take(key))
+        # Send outside the lock, so a slow websocket doesn't hold up other passes
+        for batch in ready:
+            self._send(batch)
+
+    def flush(self, key=None):
+        ''' Sends the batch for one (norad_id, pass_id), or every batch. '''
+        with self._lock:
+            keys = [key] if key is not None else list(self.batches)
+            ready = [self._take(k) for k in keys if k in self.batches]
+        for batch in ready:
+            self._send(batch)
+
+    def pending(self):
+        with self._lock:
+            return sum(len(batch.frames) for batch in self.batches.values())
+
+    def _take(self, key):
+        batch = self.batches.pop(key)
+        if batch.flush_call is not None:
+            batch.flush_call.cancel()
+        return batch
+
+    def _send(self, batch):
+        logger.info("Sending %s frames (%s bytes) for %s", len(batch.frames), batch.size, batch.context)
+        try:
+            self.send(stubs.pack_frames(batch.frames), batch.context)
+        except Exception as e:
+            # Often on a scheduler worker, where nobody else would see it
+            logger.exception("Sending %s frames for %s failed", len(batch.frames), batch.context)
+            self.blobs_failed += 1
+            if self.failed is not None:
+                self.failed([id for id in batch.command_ids if id is not None], e)
+            return
+        self.blobs_sent += 1
+        self.frames_sent += len(batch.frames)
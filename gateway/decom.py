@@ -0,0 +1,140 @@
+'''
+Decommutates packed telemetry frames into Major Tom metrics.
+
+Spacecraft downlink telemetry as fixed-layout binary frames rather than dicts. The layouts are
+declared in a definitions file (satellite/telemetry_frames.json), one per APID:
+
+    {"apid": 1, "name": "housekeeping", "byte_order": "big", "fields": [
+        {"name": "timestamp", "type": "uint64"},                                  # milliseconds
+        {"subsystem": "battery", "metric": "voltage", "type": "uint16", "scale": 0.001},
+        ...]}
+
+Each layout is compiled once into a struct.Struct. A batch of frames is grouped by APID, and each
+group is unpacked in a single struct.iter_unpack pass over the joined frame bodies:
+
+    decom = Decommutator(system="Example FlatSat", definitions=load_frame_definitions())
+    metrics = decom.decode(frames)   # frames built with stubs.telemetry_frame(apid, body)
+    batch = decom.batch(frames)      # the same, pre-encoded for Major Tom. See metric_batch.py
+'''
+import logging
+import struct
+
+from . import stubs
+from .metric_batch import MetricBatch, MetricChannels
+
+logger = logging.getLogger(__name__)
+
+TYPES = {
+    "uint8": "B", "int8": "b", "uint16": "H", "int16": "h", "uint32": "I", "int32": "i",
+    "uint64": "Q", "int64": "q", "float32": "f", "float64": "d",
+}
+BYTE_ORDERS = {"big": ">", "little": "<"}
+
+
+class FrameLayout:
+    def __init__(self, definition):
+        self.apid = definition["apid"]
+        self.name = definition["name"]
+        codes = [BYTE_ORDERS[definition.get("byte_order", "big")]]
+        self.timestamp_index = None
+        self.points = []  # (index, subsystem, metric, scale, offset)
+        for index, field in enumerate(definition["fields"]):
+            if field["type"] not in TYPES:
+                raise ValueError(f"Unknown type {field['type']} in telemetry frame {self.name}")
+            codes.append(TYPES[field["type"]])
+            if field.get("name") == "timestamp":
+                self.timestamp_index = index
+            else:
+                self.points.append((index, field["subsystem"], field["metric"], field.get("scale"), field.get("offset", 0)))
+        if self.timestamp_index is None:
+            raise ValueError(f"Telemetry frame {self.name} has no timestamp field")
+        self.struct = struct.Struct("".join(codes))
+
+    def pack(self, timestamp, values):
+        ''' Builds a frame body from a timestamp in milliseconds and {(subsystem, metric): value}. '''
+        raw = [0] * (len(self.points) + 1)
+        raw[self.timestamp_index] = timestamp
+        for index, subsystem, metric, scale, offset in self.points:
+            value = values[(subsystem, metric)] - offset
+            raw[index] = round(value / scale) if scale else value
+        return self.struct.pack(*raw)
+
+    def decode(self, system, bodies):
+        ''' Decodes the joined bodies of any number of frames with this layout. '''
+        metrics = []
+        append = metrics.append
+        timestamp_index = self.timestamp_index
+        points = self.points
+        for raw in self.struct.iter_unpack(bodies):
+            timestamp = raw[timestamp_index]
+            for index, subsystem, metric, scale, offset in points:
+                value = raw[index]
+                if scale:
+                    value = value * scale
+                append({
+                    "system": system,
+                    "subsystem": subsystem,
+                    "metric": metric,
+                    "value": value + offset,
+                    "timestamp": timestamp,
+                })
+        return metrics
+
+
+def compile_layouts(definitions):
+    ''' Compiles frame definitions into {apid: FrameLayout}. '''
+    return {layout.apid: layout for layout in map(FrameLayout, definitions)}
+
+
+class Decommutator:
+    def __init__(self, system, definitions):
+        self.system = system
+        self.layouts = compile_layouts(definitions)
+        # apid -> [(index, encoded channel, scale, offset)], for batch()
+        channels = MetricChannels()
+        self.encoded_points = {
+            apid: [(index, channels.prefix(system, subsystem, metric), scale, offset)
+                   for index, subsystem, metric, scale, offset in layout.points]
+            for apid, layout in self.layouts.items()}
+
+    def decode(self, frames):
+        ''' Turns telemetry frames into a list of metrics, ready for transmit_metrics. '''
+        metrics = []
+        for apid, bodies in self._group(frames):
+            metrics += self.layouts[apid].decode(self.system, bodies)
+        return metrics
+
+    def batch(self, frames):
+        ''' Turns telemetry frames into a MetricBatch. '''
+        batch = MetricBatch()
+        add = batch.add
+        for apid, bodies in self._group(frames):
+            layout = self.layouts[apid]
+            timestamp_index = layout.timestamp_index
+            points = self.encoded_points[apid]
+            for raw in layout.struct.iter_unpack(bodies):
+                timestamp = raw[timestamp_index]
+                for index, prefix, scale, offset in points:
+                    value = raw[index]
+                    if scale:
+                        value = value * scale
+                    add(prefix, value + offset, timestamp)
+        return batch
+
+    def _group(self, frames):
+        ''' Yields (apid, joined bodies) for the well-formed frames, one per layout. '''
+        bodies = {}  # apid -> [body]
+        for frame in frames:
+            if not stubs.is_telemetry(frame):
+                logger.warning("Dropped a frame that isn't telemetry")
+                continue
+            apid, body = stubs.split_telemetry(frame)
+            layout = self.layouts.get(apid)
+            if layout is None:
+                logger.warning(f"Dropped a telemetry frame with unknown APID {apid}")
+            elif len(body) != layout.struct.size:
+                logger.warning(f"Dropped a {layout.name} frame of {len(body)} bytes, expected {layout.struct.size}")
+            else:
+                bodies.setdefault(apid, []).append(body)
+        for apid, group in bodies.items():
+            yield apid, b"".join(group)
@@ -0,0 +1,72 @@
+'''
+Remembers which command definitions have already been pushed to Major Tom.
+
+Gateways restart often, and every start used to re-send the full set of command definitions.
+Each push is now recorded as a content hash per Major Tom host, gateway and system, so an unchanged
+set of definitions skips `update_command_definitions` entirely. Gateways are told apart by a hash
+of their token, so the token itself isn't written to the cache.
+'''
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PATH = ".definitions_cache.json"
+
+
+def digest(definitions):
+    ''' A stable content hash of a set of command definitions. '''
+    encoded = json.dumps(definitions, sort_keys=True, separators=(",", ":")).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+class DefinitionsCache:
+    def __init__(self, path=DEFAULT_PATH):
+        self.path = path
+        self.digests = {}
+        if path is not None and os.path.exists(path):
+            try:
+                with open(path, "r") as f:
+                    self.digests = json.load(f)
+            except ValueError:
+                logger.warning("Ignoring unreadable definitions cache: %s", path)
+
+    @staticmethod
+    def key(host, token, system):
+        gateway = hashlib.sha256(str(token).encode("utf-8")).hexdigest()[:16]
+        return f"{host}/{gateway}/{system}"
+
+    def is_current(self, host, token, system, definitions):
+        return self.digests.get(self.key(host, token, system)) == digest(definitions)
+
+    def remember(self, host, token, system, definitions):
+        self.digests[self.key(host, token, system)] = digest(definitions)
+        if self.path is None:
+            return
+        # Write then rename, so a crash never leaves a half written cache behind
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.digests, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+
+async def push_definitions(api, system, definitions, cache, force=False):
+    '''
+    Sends command definitions to Major Tom unless the same definitions were already sent.
+    Returns True if they were sent.
+    '''
+    if not force and cache.is_current(api.host, api.gateway_token, system, definitions):
+        logger.info("Command definitions for %s are unchanged, not re-sending them", system)
+        return False
+
+    # Only remember definitions that went out over a live connection, rather than ones that
+    # were queued and might be lost if the gateway stops before it connects.
+    while api.websocket is None:
+        await asyncio.sleep(0.5)
+    await api.update_command_definitions(system=system, definitions=definitions)
+    cache.remember(api.host, api.gateway_token, system, definitions)
+    logger.info("Sent command definitions for %s", system)
+    return True
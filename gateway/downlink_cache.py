@@ -0,0 +1,230 @@
+'''
+A content-addressed cache of downlinked files.
+
+Downlinks are written to a partial file in fixed size chunks. The hash of each completed chunk is
+recorded in a manifest next to it, so an interrupted downlink resumes from the last chunk that
+still verifies rather than from byte zero. A finished file is stored under the SHA-256 of its
+content, which lets the gateway:
+
+  - skip the downlink entirely when the same source was already fetched,
+  - skip re-uploading content that Major Tom already has for a system,
+  - keep one copy of identical files that arrive under different names.
+
+The cache is kept under a disk quota by evicting the least recently used files. Downlinks of the
+same key are run one at a time, so a second request waits for the first and is served from the cache.
+
+    cache = DownlinkCache(".downlink_cache")
+    digest, path = cache.downlink(key=url, fetch=fetch)  # fetch(offset) -> (offset, iterable of bytes)
+    if not cache.is_uploaded(digest, system):
+        upload(path)
+        cache.mark_uploaded(digest, system)
+'''
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from .http_client import shared_client
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+DEFAULT_QUOTA = 1024 * 1024 * 1024
+# Downlinks of keys that hash to the same lock wait for each other
+KEY_LOCKS = 64
+
+
+def http_fetcher(url, client=None):
+    '''
+    Returns a fetch(offset) for DownlinkCache.downlink that streams url over HTTP, asking for a
+    Range when resuming. Servers that ignore the Range get a fresh download from byte 0.
+    The response's content type is kept in fetch.meta, to be passed on as downlink(meta=fetch.meta).
+    '''
+    client = client or shared_client()
+
+    def fetch(offset):
+        headers = {"Range": f"bytes={offset}-"} if offset else {}
+        r = client.get(url, headers=headers, stream=True)
+        if r.status_code == 206:
+            start = offset
+        elif r.status_code == 200:
+            start = 0
+        else:
+            r.close()
+            raise RuntimeError(f"File Download Failed. Status code: {r.status_code}")
+        if "Content-Type" in r.headers:
+            fetch.meta["content_type"] = r.headers["Content-Type"]
+        return start, _body(r)
+    fetch.meta = {}
+    return fetch
+
+
+def _body(response):
+    ''' Yields a streamed response's body, closing it when done, so it stops counting against its host's limit. '''
+    with response:
+        yield from response.iter_content(chunk_size=64 * 1024)
+
+
+class DownlinkCache:
+    def __init__(self, root, quota=DEFAULT_QUOTA, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.root = root
+        self.quota = quota
+        self.chunk_size = chunk_size
+        self.objects_dir = os.path.join(root, "objects")
+        self.partial_dir = os.path.join(root, "partial")
+        self.index_path = os.path.join(root, "index.json")
+        self._lock = threading.RLock()
+        self._key_locks = [threading.Lock() for _ in range(KEY_LOCKS)]
+        # objects: digest -> {"size", "last_used", "uploaded": [systems], "meta"}
+        # sources: downlink key -> digest
+        self.index = {"objects": {}, "sources": {}}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r") as f:
+                self.index = json.load(f)
+
+    def object_path(self, digest):
+        return os.path.join(self.objects_dir, digest)
+
+    def lookup(self, key):
+        ''' Returns the digest of a completed downlink for key, if it is still cached. '''
+        with self._lock:
+            digest = self.index["sources"].get(key)
+            if digest is None or not os.path.exists(self.object_path(digest)):
+                return None
+            return digest
+
+    def meta(self, digest):
+        return self.index["objects"].get(digest, {}).get("meta") or {}
+
+    def downlink(self, key, fetch, meta=None):
+        '''
+        Downlinks the file identified by `key`, resuming a partial downlink if there is one.
+        `fetch(offset)` must return (offset, chunks): the offset the data actually starts at (0 if the
+        source can't resume) and an iterable of bytes. `meta` is stored with the file once it completes.
+        Returns (digest, path) of the cached file.
+        '''
+        name = hashlib.sha256(key.encode("utf-8")).hexdigest()
+        # Held for the whole downlink, as the partial file and its manifest are the key's own
+        with self._key_locks[int(name[:8], 16) % KEY_LOCKS]:
+            digest = self.lookup(key)
+            if digest is not None:
+                logger.info("Downlink of %s is already cached as %s", key, digest)
+                self._touch(digest)
+                return digest, self.object_path(digest)
+            return self._downlink(key, name, fetch, meta)
+
+    def _downlink(self, key, name, fetch, meta):
+        os.makedirs(self.objects_dir, exist_ok=True)
+        os.makedirs(self.partial_dir, exist_ok=True)
+        part_path = os.path.join(self.partial_dir, name + ".part")
+        manifest_path = os.path.join(self.partial_dir, name + ".json")
+        chunk_hashes = self._verified_chunks(part_path, manifest_path)
+        offset = len(chunk_hashes) * self.chunk_size
+        if offset:
+            logger.info("Resuming downlink of %s from byte %s", key, offset)
+
+        start, chunks = fetch(offset)
+        if start != offset:
+            # The source started over, so must we
+            chunk_hashes = []
+            offset = start
+        with open(part_path, "r+b" if os.path.exists(part_path) else "wb") as f:
+            f.seek(offset)
+            f.truncate()
+            pending = bytearray()
+            for data in chunks:
+                pending += data
+                while len(pending) >= self.chunk_size:
+                    chunk = bytes(pending[:self.chunk_size])
+                    del pending[:self.chunk_size]
+                    f.write(chunk)
+                    chunk_hashes.append(hashlib.sha256(chunk).hexdigest())
+                    f.flush()
+                    self._write_json(manifest_path, {"key": key, "chunk_size": self.chunk_size, "chunks": chunk_hashes})
+            f.write(pending)
+
+        digest = self._file_digest(part_path)
+        size = os.path.getsize(part_path)
+        with self._lock:
+            os.replace(part_path, self.object_path(digest))
+            if os.path.exists(manifest_path):
+                os.remove(manifest_path)
+            entry = self.index["objects"].setdefault(digest, {"size": size, "uploaded": [], "meta": {}})
+            entry["meta"].update(meta or {})
+            self.index["sources"][key] = digest
+            self._touch(digest, save=False)
+            self._evict(keep=digest)
+            self._save_index()
+        logger.info("Downlinked %s (%s bytes) as %s", key, size, digest)
+        return digest, self.object_path(digest)
+
+    def is_uploaded(self, digest, system):
+        return system in self.index["objects"].get(digest, {}).get("uploaded", [])
+
+    def mark_uploaded(self, digest, system):
+        with self._lock:
+            uploaded = self.index["objects"][digest]["uploaded"]
+            if system not in uploaded:
+                uploaded.append(system)
+            self._save_index()
+
+    def total_size(self):
+        return sum(entry["size"] for entry in self.index["objects"].values())
+
+    def _verified_chunks(self, part_path, manifest_path):
+        ''' Returns the hashes of the leading chunks of a partial file that still match its manifest. '''
+        if not (os.path.exists(part_path) and os.path.exists(manifest_path)):
+            return []
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+        if manifest.get("chunk_size") != self.chunk_size:
+            return []
+        verified = []
+        with open(part_path, "rb") as f:
+            for expected in manifest["chunks"]:
+                chunk = f.read(self.chunk_size)
+                if len(chunk) < self.chunk_size or hashlib.sha256(chunk).hexdigest() != expected:
+                    break
+                verified.append(expected)
+        return verified
+
+    def _file_digest(self, path):
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(self.chunk_size), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def _touch(self, digest, save=True):
+        with self._lock:
+            self.index["objects"][digest]["last_used"] = time.time()
+            if save:
+                self._save_index()
+
+    def _evict(self, keep=None):
+        ''' Removes least recently used files until the cache fits in its quota. '''
+        objects = self.index["objects"]
+        total = self.total_size()
+        for digest in sorted(objects, key=lambda d: objects[d].get("last_used", 0)):
+            if total <= self.quota:
+                break
+            if digest == keep:
+                continue
+            total -= objects[digest]["size"]
+            del objects[digest]
+            self.index["sources"] = {k: d for k, d in self.index["sources"].items() if d != digest}
+            if os.path.exists(self.object_path(digest)):
+                os.remove(self.object_path(digest))
+            logger.info("Evicted %s from the downlink cache", digest)
+
+    def _save_index(self):
+        self._write_json(self.index_path, self.index)
+
+    @staticmethod
+    def _write_json(path, data):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
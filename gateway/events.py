@@ -0,0 +1,173 @@
+'''
+Keeps storms of events from flooding Major Tom.
+
+A flapping sensor or a mass cancel produces one transmit_events call per event. EventPipeline
+takes over `api.transmit_events` and, for everything below the immediate levels:
+
+  - aggregates: an event with the same system, type, level and message as one sent in the last
+    `window` seconds isn't sent again. When the window closes, one event reports how many more
+    there were (and for which commands).
+  - rate limits: each (system, level) may send `rate` events a second, in bursts of `burst`.
+    Events over the limit are counted, and reported in one summary event per window.
+  - batches: events are sent together every `flush_interval` seconds, or once `max_batch` are
+    waiting.
+
+Critical events skip all of that and are sent straight away.
+
+    events = EventPipeline()
+    events.install(api)
+'''
+import asyncio
+import collections
+import logging
+import time
+
+from .outbound import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+IMMEDIATE_LEVELS = frozenset(["critical"])
+
+
+def event_key(event):
+    return (event.get("system"), event.get("type", "Gateway Event"), event.get("level", "nominal"), event.get("message"))
+
+
+class Repeats:
+    def __init__(self, event, until):
+        self.event = event
+        self.until = until
+        self.count = 0
+        self.command_ids = []
+
+
+class EventPipeline:
+    def __init__(self, window=10.0, rate=5.0, burst=20, flush_interval=0.5, max_batch=100,
+                 immediate_levels=IMMEDIATE_LEVELS, max_command_ids=50):
+        self.window = window
+        self.rate = rate
+        self.burst = burst
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.immediate_levels = immediate_levels
+        self.max_command_ids = max_command_ids
+        self.send = None
+        self.loop = None
+        self.pending = []
+        self.repeats = {}  # event_key -> Repeats
+        self.buckets = {}  # (system, level) -> TokenBucket
+        self.suppressed = collections.defaultdict(collections.Counter)  # (system, level) -> Counter of types
+        self.suppressed_until = {}  # (system, level) -> loop time the summary is due
+        self.stats = collections.Counter()
+        self._wakeup = None
+        self._flusher = None
+
+    def install(self, api):
+        ''' Routes everything `api` sends with transmit_events through the pipeline. '''
+        self.send = api.transmit_events
+        api.transmit_events = self.submit
+
+    async def submit(self, events):
+        ''' Takes the place of GatewayAPI.transmit_events. Returns once the events are queued. '''
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+            self._wakeup = asyncio.Event()
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.ensure_future(self._flush_forever())
+        immediate = []
+        for event in events:
+            event = dict(event)
+            event.setdefault("timestamp", int(time.time() * 1000))
+            if event.get("level", "nominal") in self.immediate_levels:
+                immediate.append(event)
+            else:
+                self._add(event, self.loop.time())
+        if len(self.pending) >= self.max_batch:
+            self._wakeup.set()
+        if immediate:
+            self.stats["sent"] += len(immediate)
+            await self.send(events=immediate)
+
+    def _add(self, event, now):
+        key = event_key(event)
+        repeats = self.repeats.get(key)
+        if repeats is not None and now < repeats.until:
+            repeats.count += 1
+            if event.get("command_id") is not None and len(repeats.command_ids) < self.max_command_ids:
+                repeats.command_ids.append(event["command_id"])
+            self.stats["aggregated"] += 1
+            return
+        if repeats is not None:
+            # The window closed before the next flush got to it
+            self._summarize(repeats)
+        self.repeats[key] = Repeats(event, now + self.window)
+        self._admit(event, now)
+
+    def _admit(self, event, now):
+        ''' Queues an event if its (system, level) is under its rate, counts it as suppressed if not. '''
+        limit = (event.get("system"), event.get("level", "nominal"))
+        bucket = self.buckets.get(limit)
+        if bucket is None:
+            bucket = self.buckets[limit] = TokenBucket(self.rate, self.burst)
+        if bucket.ready_in(now) > 0:
+            self.suppressed[limit][event.get("type", "Gateway Event")] += 1
+            self.suppressed_until.setdefault(limit, now + self.window)
+            self.stats["suppressed"] += 1
+            return
+        bucket.take(now)
+        self.pending.append(event)
+
+    def _summarize(self, repeats):
+        ''' Queues the repeat count of a closed window, if the event repeated at all. '''
+        if not repeats.count:
+            return
+        event = repeats.event
+        debug = dict(event.get("debug") or {}, repeats=repeats.count)
+        if repeats.command_ids:
+            debug["command_ids"] = repeats.command_ids
+        self.pending.append(dict(
+            event,
+            message=f"{event.get('message')} (repeated {repeats.count} more times in {self.window:g}s)",
+            debug=debug,
+            timestamp=int(time.time() * 1000)))
+
+    def _close_windows(self, now):
+        ''' Queues the repeat counts and suppression summaries whose windows have closed. '''
+        for key, repeats in list(self.repeats.items()):
+            if now < repeats.until:
+                continue
+            del self.repeats[key]
+            self._summarize(repeats)
+        for limit, until in list(self.suppressed_until.items()):
+            if now < until:
+                continue
+            del self.suppressed_until[limit]
+            types = self.suppressed.pop(limit)
+            system, level = limit
+            self.pending.append({
+                "system": system,
+                "type": "Events Suppressed",
+                "level": level,
+                "message": f"{sum(types.values())} {level} events were not sent, over the limit of {self.rate:g} a second",
+                "debug": dict(types),
+                "timestamp": int(time.time() * 1000),
+            })
+
+    async def flush(self):
+        self._close_windows(self.loop.time())
+        while self.pending:
+            batch, self.pending = self.pending[:self.max_batch], self.pending[self.max_batch:]
+            self.stats["sent"] += len(batch)
+            await self.send(events=batch)
+
+    async def _flush_forever(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Sending events failed")
@@ -0,0 +1,116 @@
+'''
+An indexed catalog of the files available on a spacecraft, and of which ones Major Tom already knows about.
+
+Sending the whole file list on every update makes each message bigger than the last. Instead, the
+catalog keys every file by (name, timestamp) and keeps the files that haven't been reported yet
+in insertion order, so each update only carries the new files, split into pages:
+
+    for page in catalog.pending_pages():
+        gateway.update_file_list(system=name, files=page)
+        catalog.mark_reported(page)
+
+When given a path, the catalog is kept in an append-only JSONL log so that it survives restarts.
+When also given a system, the log is kept per system (see system_path), so satellites that share
+a path don't report each other's files.
+'''
+import json
+import logging
+import os
+import threading
+import urllib.parse
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_PAGE_SIZE = 100
+
+
+def system_path(path, system):
+    ''' ".file_catalog.jsonl" for "Example FlatSat" is ".file_catalog.Example%20FlatSat.jsonl". '''
+    root, ext = os.path.splitext(path)
+    return f"{root}.{urllib.parse.quote(str(system), safe='')}{ext}"
+
+
+class FileCatalog:
+    def __init__(self, path=None, page_size=DEFAULT_PAGE_SIZE, system=None):
+        if path is not None and system is not None:
+            path = system_path(path, system)
+        self.path = path
+        self.page_size = page_size
+        self.files = {}  # (name, timestamp) -> file
+        self._pending = {}  # (name, timestamp) -> file, in the order they were added
+        self._lock = threading.Lock()
+        if path is not None and os.path.exists(path):
+            self._load()
+            self._compact()
+
+    @staticmethod
+    def key(file):
+        return (file["name"], file["timestamp"])
+
+    def __len__(self):
+        return len(self.files)
+
+    def __contains__(self, file):
+        return self.key(file) in self.files
+
+    def add(self, file):
+        ''' Adds a file to the catalog. Returns False if it was already there. '''
+        key = self.key(file)
+        with self._lock:
+            if key in self.files:
+                return False
+            self.files[key] = file
+            self._pending[key] = file
+            self._append([{"add": file}])
+        return True
+
+    def pending_count(self):
+        return len(self._pending)
+
+    def pending_pages(self):
+        ''' Returns the files that haven't been reported yet, split into pages of at most page_size. '''
+        with self._lock:
+            pending = list(self._pending.values())
+        return [pending[i:i + self.page_size] for i in range(0, len(pending), self.page_size)]
+
+    def mark_reported(self, files):
+        with self._lock:
+            keys = [self.key(file) for file in files]
+            for key in keys:
+                self._pending.pop(key, None)
+            self._append([{"reported": list(key)} for key in keys])
+
+    def _append(self, records):
+        if self.path is None:
+            return
+        with open(self.path, "a") as f:
+            f.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+
+    def _load(self):
+        with open(self.path, "r") as f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # A partially written last line from a crash
+                    logger.warning("Skipping unreadable file catalog entry in %s", self.path)
+                    continue
+                if "add" in record:
+                    key = self.key(record["add"])
+                    self.files[key] = record["add"]
+                    self._pending[key] = record["add"]
+                elif "reported" in record:
+                    self._pending.pop(tuple(record["reported"]), None)
+
+    def _compact(self):
+        # Rewrite the log as one "add" per file plus one "reported" per reported file
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            for key, file in self.files.items():
+                f.write(json.dumps({"add": file}, separators=(",", ":")) + "\n")
+                if key not in self._pending:
+                    f.write(json.dumps({"reported": list(key)}, separators=(",", ":")) + "\n")
+        os.replace(tmp_path, self.path)
@@ -1,10 +1,24 @@
+import asyncio
 import logging
+import os
 import time
+import requests
 from asgiref.sync import async_to_sync
 from random import randint
-from . import stubs
-from .statuses import CommandStatus
+from . import http_client, stubs
+from .blob_batcher import BlobBatcher
+from .decom import Decommutator
+from .outbound import retry_after_of
+from .profiler import SamplingProfiler
+from .scheduler import shared_scheduler
+from .sequences import Sequences, parse_steps
+from .spool import PayloadSpool
+from .statuses import CommandStatus, TERMINAL_STATUSES
+from .tracing import Tracer
+from .uplink import UplinkWindow
+from .validation import CommandValidator
 from satellite.satellite import Satellite
+from satellite.telemetry import load_frame_definitions
 
 logger = logging.getLogger(__name__)
 
@@ -17,14 +31,56 @@ class Gateway:
         # your communication to the respective device(s).
         # For a Ground Station Network, support is included in the transmit_blob() and receive_blob() methods.
 
-        self.satellite = Satellite()
+        # Span tracing is disabled unless a Tracer writing to a file is passed in. See tracing.py
+        self.tracer = kwargs.get("tracer") or Tracer()
+        # One thread runs every delayed callback, for the Gateway and the satellite. See scheduler.py
+        self.scheduler = kwargs.get("scheduler") or shared_scheduler()
+        # A satellite in another process can be reached over a socket instead. See satellite_link.py
+        self.satellite = kwargs.get("satellite") or Satellite(
+            tracer=self.tracer, file_catalog_path=kwargs.get("file_catalog_path"), scheduler=self.scheduler)
         self.api = kwargs.get("api", None)
+        # The event loop the websocket API runs on. See call_api()
+        self.loop = kwargs.get("loop", None)
+        # Commands are checked against the definitions sent to Major Tom before anything is sent to the satellite.
+        self.validator = CommandValidator(kwargs.get("definitions"))
+        # Pooled, retrying HTTP for file transfers. See http_client.py
+        self.http = kwargs.get("http_client") or http_client.shared_client()
+        # The priority lanes installed on the api, if any. See outbound.py
+        self.outbound = kwargs.get("outbound", None)
+        # Commands for a groundstation network pass go up together in multi-frame blobs. See blob_batcher.py
+        self.blob_batcher = kwargs.get("blob_batcher") or BlobBatcher(
+            send=self.transmit_blob, failed=self.blob_failed, scheduler=self.scheduler)
+        # Payload data is kept on disk rather than in memory while it is processed. See spool.py
+        self.spool = kwargs.get("spool") or PayloadSpool()
+        # Packed telemetry frames are decoded into metrics with layouts compiled once. See decom.py
+        self.decom = Decommutator(
+            system=self.satellite.name, definitions=kwargs.get("frame_definitions") or load_frame_definitions())
+        # Several commands can be on their way to the satellite at once, each acknowledged. See uplink.py
+        self.uplink = kwargs.get("uplink") or UplinkWindow(
+            send=self.uplink_frame,
+            window=kwargs.get("uplink_window", 8),
+            timeout=kwargs.get("uplink_timeout", 2.0),
+            on_ack=self.command_acked,
+            on_give_up=self.command_unacknowledged,
+            scheduler=self.scheduler)
+        # Sequences of commands sent in one run_sequence command, and the statuses of their steps. See sequences.py
+        self.sequences = Sequences()
 
     def command_callback(self, command, api):
         ''' The command callback is where messages are received when an operator or script executes a command. 
             The goal of this method is to translate the command between Major Tom's definition and the
             actual bytes to be sent to the spacecraft or groundstation.           
         '''
+        # The trace id is carried inside the encoded frame, so the satellite and the response path
+        # can report their own spans for this command.
+        trace_id = self.tracer.start_trace(command.id)
+
+        # Reject malformed commands (and fill in defaults) before any translating or packetizing happens.
+        errors = self.validator.validate(command)
+        if errors:
+            self.fail_command(command.id, errors)
+            return
+
         if command.type == "ping":
             # The function argument `command` is Major Tom's populated command definition. 
             # It will need to be converted into something your satellite understands. 
@@ -33,16 +89,18 @@ class Gateway:
             # If these steps take time, you'll want to let the operator know by updating the status in the UI:
             logger.info("Preparing for satellite")
             self.set_command_status(command.id, CommandStatus.PREPARING)
-            binary = stubs.translate_command_to_binary(command)
-            packetized = stubs.packetize(binary)
-            encrypted = stubs.encrypt(packetized)    
+            with self.tracer.span(trace_id, "gateway.encode"):
+                binary = stubs.translate_command_to_binary(command, trace_id=trace_id)
+                packetized = stubs.packetize(binary)
+                encrypted = stubs.encrypt(packetized)    
 
             # Send it to the satellite. We include a reference to ourself allow an asynchronous response.
             # See satellite_response()
             # Again, you may choose to update the UI status:
             logger.info("Sending to satellite")
             self.set_command_status(command.id, CommandStatus.TRANSMITTED)
-            self.satellite.process_command(bytes=encrypted, gateway=self)
+            with self.tracer.span(trace_id, "gateway.uplink"):
+                self.uplink.submit(encrypted, command.id)
 
         elif command.type == "all_transitions":
             # We'll go through each of the command states. After sending this command from Major Tom, you'll
@@ -77,18 +135,21 @@ class Gateway:
 
             # We start with translating, packetizing, and/or encrypting the command
             self.set_command_status(command.id, CommandStatus.PREPARING)
-            binary = stubs.translate_command_to_binary(command)
-            packetized = stubs.packetize(binary)
-            encrypted = stubs.encrypt(packetized)   
+            with self.tracer.span(trace_id, "gateway.encode"):
+                binary = stubs.translate_command_to_binary(command, trace_id=trace_id)
+                packetized = stubs.packetize(binary)
+                encrypted = stubs.encrypt(packetized)   
 
             logger.info("Sending command to Leaf")
             context = {
-                # We use all zeroes for the Leaf sandbox. Eventually, this will
-                # be replaced with a field for Pass ID 
+                # We use all zeroes for the Leaf sandbox.
                 "norad_id": "00000",
             }
+            if command.fields.get("pass_id"):
+                context["pass_id"] = command.fields["pass_id"]
             self.set_command_status(command.id, CommandStatus.UPLINKING)
-            async_to_sync(self.api.transmit_blob)(blob=encrypted, context=context)
+            # Commands for the same pass are sent together, shortly. See blob_batcher.py
+            self.blob_batcher.add(encrypted, context, command_id=command.id)
             # If all goes well, the response will come back on `received_blob_callback()`
 
         elif command.type == "connect":
@@ -111,23 +172,130 @@ class Gateway:
             self.satellite.check_cancelled(id=command.id)
             self.set_command_status(command.id, CommandStatus.COMPLETED)
 
+        elif command.type == "profile":
+            """
+            Samples the Gateway's own stacks for a while and uploads them as a flamegraph-compatible
+            collapsed stack file, so a slow gateway can be profiled without redeploying it.
+            """
+            duration = command.fields.get("duration", 30)
+            logger.info("Profiling the Gateway for %s seconds", duration)
+            self.set_command_status(command.id, CommandStatus.PROCESSING)
+            profiler = SamplingProfiler()
+            profiler.profile(duration)
+            path = profiler.write()
+            try:
+                self.set_command_status(command.id, CommandStatus.DOWNLINKING)
+                http_client.upload_downlinked_file(
+                    self.http,
+                    self.api,
+                    filename=f"gateway-profile-{command.id}.collapsed",
+                    filepath=path,
+                    system=self.satellite.name,
+                    command_id=command.id,
+                    content_type="text/plain")
+                self.set_command_status(command.id, CommandStatus.COMPLETED, payload=f"Uploaded {profiler.samples} samples")
+            except (RuntimeError, requests.RequestException) as e:
+                self.fail_command(command.id, errors=["Profile failed to upload", str(e)])
+            finally:
+                os.remove(path)
+
+        elif command.type == "run_sequence":
+            """
+            Runs a list of commands from the gateway, pipelined to the satellite, so a whole sequence
+            costs one round trip to Major Tom instead of one per command.
+            """
+            self.run_sequence(command, trace_id)
+
         else:
             # You may not have special processing that is individualized to each command.
             # In that case, you can use something generic like the code below:
             logger.info("Preparing for satellite")
             self.set_command_status(command.id, CommandStatus.PREPARING)
-            binary = stubs.translate_command_to_binary(command)
-            packetized = stubs.packetize(binary)
-            encrypted = stubs.encrypt(packetized)    
+            with self.tracer.span(trace_id, "gateway.encode"):
+                binary = stubs.translate_command_to_binary(command, trace_id=trace_id)
+                packetized = stubs.packetize(binary)
+                encrypted = stubs.encrypt(packetized)    
 
             # Send it to the satellite. We include a reference to ourself in order to mimic an asynchronous response.
             # See satellite_response()
             # Again, you may choose to update the UI status:
             logger.info("Sending to satellite")
             self.set_command_status(command.id, CommandStatus.TRANSMITTED)
-            self.satellite.process_command(bytes=encrypted, gateway=self)
+            with self.tracer.span(trace_id, "gateway.uplink"):
+                self.uplink.submit(encrypted, command.id)
    
 
+    def run_sequence(self, command, trace_id):
+        ''' Sends each step of a run_sequence command to the satellite, and reports progress until they all finish. '''
+        try:
+            steps = parse_steps(command.fields.get("steps"))
+        except ValueError as e:
+            self.fail_command(command.id, errors=[str(e)])
+            return
+        deadline = time.monotonic() + command.fields.get("timeout", 300)
+        run = self.sequences.start(command.id, steps)
+        try:
+            self.set_command_status(command.id, CommandStatus.EXECUTING)
+            reported = None
+            for index, step in enumerate(steps):
+                reported = self.report_sequence(run, reported)
+                if step.delay and not run.sleep(step.delay):
+                    break
+                if step.condition == "completed" and not run.wait_for_earlier(index, deadline):
+                    break
+                if run.cancelled:
+                    break
+                step_command = step.command(run.step_id(index), command.system)
+                errors = self.validator.validate(step_command)
+                run.send(index)
+                if errors:
+                    run.update(index, CommandStatus.FAILED, errors)
+                    continue
+                with self.tracer.span(trace_id, "gateway.encode"):
+                    binary = stubs.translate_command_to_binary(step_command, trace_id=trace_id)
+                    packetized = stubs.packetize(binary)
+                    encrypted = stubs.encrypt(packetized)
+                with self.tracer.span(trace_id, "gateway.uplink"):
+                    self.uplink.submit(encrypted, step_command.id)
+
+            # Progress is reported from here, rather than from the threads the step statuses arrive on
+            while True:
+                reported = self.report_sequence(run, reported)
+                if run.settled() or time.monotonic() >= deadline:
+                    break
+                run.wait_for_change(reported, deadline)
+        finally:
+            self.sequences.finish(run)
+
+        if run.cancelled:
+            # cancel_callback reports the cancellation
+            return
+        errors = run.failures()
+        if errors:
+            self.fail_command(command.id, errors=errors)
+        else:
+            self.set_command_status(command.id, CommandStatus.COMPLETED, payload=f"Completed {len(steps)} steps")
+
+    def report_sequence(self, run, reported=None):
+        ''' Shows a sequence's progress, if more of its steps have finished than `reported`. Returns how many have. '''
+        finished = run.finished
+        if finished == reported:
+            return reported
+        progress = {
+            "progress_1_current": run.sent,
+            "progress_1_max": len(run.steps),
+            "progress_1_label": "Steps Sent",
+            "progress_2_current": finished,
+            "progress_2_max": len(run.steps),
+            "progress_2_label": "Steps Finished",
+        }
+        self.set_progress_bar(
+            command_id=run.command_id,
+            state=CommandStatus.EXECUTING,
+            status=f"{finished} of {len(run.steps)} steps finished",
+            progress_dict=progress)
+        return finished
+
     def fake_progress_bar(self, command_id, state, status):
         for i in range(0,101,20):
             progress={
@@ -152,11 +320,21 @@ class Gateway:
             self.set_command_status(command_id, CommandStatus.CANCELLED)
 
     def cancel_command(self, command_id):
+        # A sequence sends no more of its steps
+        self.sequences.cancel(command_id)
         # Stub
         return True
 
+    def transmit_blob(self, blob, context):
+        self.call_api(self.api.transmit_blob, blob=blob, context=context)
+
+    def blob_failed(self, command_ids, error):
+        ''' Fails the commands batched into a blob that couldn't be sent. '''
+        for command_id in command_ids:
+            self.fail_command(command_id, errors=[f"Sending to the groundstation network failed: {error}"])
+
     def update_file_list(self, system, files):
-        async_to_sync(self.api.update_file_list)(system=system, files=files)
+        self.call_api(self.api.update_file_list, system=system, files=files)
 
     def received_blob_callback(self, blob, context, *args, **kwargs):
         # When we receive data from a Groundstation Network, this callback is called.
@@ -164,15 +342,51 @@ class Gateway:
         # The "context" argument contains information around the conditions under which the data were obtained -- things like a Pass ID, Norad ID, or similar.
         # An optional "metadata" argument may contain traceability-related data, such as timestamps or internal processing steps.
         logger.info("Got binary from groundstation network!")
-        logger.info("Context was:" + str(context))
+        logger.info("Context was: %s", context)
         # logger.info("Metadata was:" + str(metadata))
-        decrypted = stubs.decrypt(blob)    
-        depacketized = stubs.depacketize(decrypted)
-        command = stubs.translate_binary_to_command(depacketized)
-
-        # Once the data is understandable, you can route it to the proper
-        # processing pipeline and inform the operator.
-        self.set_command_status(command.id, CommandStatus.COMPLETED)
+        # A blob may carry several frames when commands were batched. See blob_batcher.py
+        telemetry = []
+        for frame in stubs.unpack_frames(blob):
+            start, counter = time.time(), time.perf_counter()
+            decrypted = stubs.decrypt(frame)
+            depacketized = stubs.depacketize(decrypted)
+            if stubs.is_telemetry(depacketized):
+                # Decoded together below, in one pass per frame layout
+                telemetry.append(depacketized)
+                continue
+            if stubs.is_payload_data(depacketized):
+                # Science data goes to the spool, and the pipeline reads it from there without copies
+                segment = self.spool.append(depacketized, meta=context)
+                logger.info("Spooled %d bytes of payload data", segment.size)
+                try:
+                    stubs.send_to_data_pipeline(segment)
+                finally:
+                    # The pipeline has consumed it, so its space in the spool can be reused
+                    self.spool.discard(segment)
+                continue
+            command = stubs.translate_binary_to_command(depacketized)
+            self.tracer.record(stubs.trace_id_of(command), "gateway.decode_response", start, time.perf_counter() - counter)
+
+            # Once the data is understandable, you can route it to the proper
+            # processing pipeline and inform the operator.
+            self.set_command_status(command.id, CommandStatus.COMPLETED)
+        if telemetry:
+            self.downlink_telemetry(telemetry)
+
+    def close(self):
+        ''' Releases what the Gateway keeps on disk. Called on shutdown. '''
+        self.spool.close()
+
+    def downlink_telemetry(self, frames):
+        ''' Decommutates packed telemetry frames and sends the metrics to Major Tom in one batch. '''
+        batch = self.decom.batch(frames)
+        if not batch:
+            return
+        if self.outbound is not None:
+            # The outbound lanes send pre-encoded messages as they are. See metric_batch.py
+            self.call_api(self.api.transmit, batch.message())
+        else:
+            self.update_metrics(batch.metrics())
 
     def update_metrics(self, metrics):
         # Metrics are of the form:
@@ -183,20 +397,37 @@ class Gateway:
         #     "value": 7.23,
         #     "timestamp": int(time.time() * 1000)
         # }
-        async_to_sync(self.api.transmit_metrics)(metrics=metrics)
+        self.call_api(self.api.transmit_metrics, metrics=metrics)
+
+    def call_api(self, coroutine_function, *args, **kwargs):
+        '''
+        Runs one of the websocket API's coroutines from the Gateway's synchronous code and waits for it.
+        Responses from the satellite arrive on threads that asgiref doesn't know about, so when the API's
+        event loop is known, the coroutine is always handed to that loop instead of a private one.
+        '''
+        if self.loop is None:
+            return async_to_sync(coroutine_function)(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine_function(*args, **kwargs), self.loop).result()
 
     def set_command_status(self, command_id, status, **kwargs):
         ''' A helper method for updating Major Tom's display with a particular status for a specific command. '''
+        # The steps of a sequence only exist on the gateway. See run_sequence()
+        if self.sequences.update(command_id, status, kwargs.get("errors")):
+            return
         if self.api is None:
             raise Exception("Websocket API must be set.")
-        logger.info(f"Setting command #{command_id} status to {status}")
+        logger.info("Setting command #%s status to %s", command_id, status)
         args = {"status": status}
         args.update(kwargs)
-        async_to_sync(self.api.transmit_command_update)(
-            command_id=command_id,
-            state=status,
-            dict=args,
-        )
+        with self.tracer.span(self.tracer.trace_for(command_id), "gateway.set_command_status"):
+            self.call_api(
+                self.api.transmit_command_update,
+                command_id=command_id,
+                state=status,
+                dict=args,
+            )
+        if status in TERMINAL_STATUSES:
+            self.tracer.end_trace(command_id)
 
     def set_progress_bar(self, command_id, state, status, progress_dict):
         ''' A helper method for updating Major Tom's display with a progress bar for a particular command. '''
@@ -204,7 +435,8 @@ class Gateway:
             raise Exception("Websocket API must be set.")
         info = {"status": status}
         info.update(progress_dict)
-        async_to_sync(self.api.transmit_command_update)(
+        self.call_api(
+            self.api.transmit_command_update,
             command_id=command_id,
             state=state,
             dict=info,
@@ -216,26 +448,53 @@ class Gateway:
 
     def error_callback(self, message, *args, **kwargs):
         # It is important to implement this callback, as this is the main communication channel when Major Tom detects errors.
-        logger.warn(message)
+        logger.warning(message)
 
     def rate_limit_callback(self, message, *args, **kwargs):
-        logger.warn(message)
+        logger.warning(message)
+        # Back off the lowest priority traffic first, so command statuses keep flowing
+        if self.outbound is not None and self.loop is not None:
+            self.loop.call_soon_threadsafe(self.outbound.shed, retry_after_of(message))
 
     def transit_callback(self, message, *args, **kwargs):
         # This callback can be used to trigger code at the beginning of a pass.
         transit = message["transit"]
-        logger.info(f"Ahoy {transit['satellite_name']} from {transit['ground_station_name']}!")
+        logger.info("Ahoy %s from %s!", transit['satellite_name'], transit['ground_station_name'])
 
     ### CONNECTION TO SATELLITE ###
 
+    def uplink_frame(self, frame):
+        self.satellite.process_command(bytes=frame, gateway=self)
+
+    def satellite_ack(self, frame, *args, **kwargs):
+        ''' The satellite acknowledges each uplinked frame as soon as it arrives. See uplink.py '''
+        session, sequence = stubs.acked_sequence(frame)
+        self.uplink.ack(sequence, session)
+
+    def uplink_dropped(self, session, sequence):
+        ''' The link couldn't take an uplinked frame, so there's no ACK to wait for. '''
+        self.uplink.discard(sequence, session)
+
+    def command_acked(self, command_id):
+        self.set_command_status(command_id, CommandStatus.ACKED)
+
+    def command_unacknowledged(self, command_id, attempts):
+        self.fail_command(command_id, errors=[f"The satellite did not acknowledge the command after {attempts} attempts"])
+
     def satellite_response(self, encrypted, response, *args, **kwargs):
         '''
         This method can be called asynchronously by the satellite to mimic raw packets being received from a 
         flatsat or customer-owned groundstation.
         '''
+        start, counter = time.time(), time.perf_counter()
         decrypted = stubs.decrypt(encrypted)  
         depacketized = stubs.depacketize(decrypted)
+        if stubs.is_telemetry(depacketized) or depacketized.startswith(stubs.MULTI_FRAME_MAGIC):
+            # Telemetry frames aren't a response to any one command
+            self.downlink_telemetry(stubs.unpack_frames(depacketized))
+            return
         command = stubs.translate_binary_to_command(depacketized)
+        self.tracer.record(stubs.trace_id_of(command), "gateway.decode_response", start, time.perf_counter() - counter)
 
         payload = response
         self.set_command_status(command_id=command.id, status=CommandStatus.COMPLETED, payload=payload)
@@ -0,0 +1,228 @@
+'''
+A shared HTTP client for every file transfer the gateways make.
+
+Plain `requests.get`/`requests.post` calls open a new TCP (and TLS) connection each time, and
+block whatever thread they are called from. HttpClient keeps one pooled keep-alive Session for
+the whole process and adds what the transfer paths were each missing:
+
+  - a limit on concurrent requests per host, so a burst of transfers can't swamp Major Tom or S3,
+  - connect/read timeouts, so a dead peer can't hang a command forever,
+  - retries with jittered exponential backoff for connection errors and 429/5xx responses,
+  - `async` variants that run on the client's own thread pool instead of the event loop.
+
+Only idempotent methods are retried, and a request body that is a callable is called again for
+every attempt, so file uploads can be retried from the start of the file. A streamed response
+(stream=True) counts against its host's limit until it is closed, so close it, or use it in a
+`with` block, once its body has been read.
+
+The Major Tom file flows from the majortom_gateway package (download_staged_file and
+upload_downlinked_file) are re-implemented on top of the client at the bottom of this file.
+'''
+import asyncio
+import base64
+import concurrent.futures
+import functools
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+RETRY_METHODS = frozenset(["GET", "HEAD", "PUT", "DELETE", "OPTIONS"])
+RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+
+
+class HttpClient:
+    def __init__(self, max_per_host=4, pool_size=16, timeout=(5, 60), retries=3, backoff=0.5, max_workers=16):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="http")
+        self._host_limits = {}
+        self._lock = threading.Lock()
+
+    def _host_limit(self, url):
+        host = urlsplit(url).netloc
+        with self._lock:
+            if host not in self._host_limits:
+                self._host_limits[host] = threading.BoundedSemaphore(self.max_per_host)
+            return self._host_limits[host]
+
+    def _delay(self, attempt):
+        # Full jitter, so retries from many transfers don't line up
+        return random.uniform(0, self.backoff * (2 ** attempt))
+
+    def request(self, method, url, data=None, **kwargs):
+        '''
+        Like requests.Session.request, with the client's timeout, per-host limit and retries.
+        `data` may be a callable returning the body, called once per attempt.
+        '''
+        method = method.upper()
+        kwargs.setdefault("timeout", self.timeout)
+        attempts = self.retries + 1 if method in RETRY_METHODS else 1
+        for attempt in range(attempts):
+            body = data() if callable(data) else data
+            try:
+                r = self._limited_request(method, url, body, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt + 1 == attempts:
+                    raise
+                delay = self._delay(attempt)
+                logger.warning("%s %s failed (%s), retrying in %.2fs", method, url, e, delay)
+            else:
+                if r.status_code not in RETRY_STATUSES or attempt + 1 == attempts:
+                    return r
+                delay = self._delay(attempt)
+                logger.warning("%s %s returned %s, retrying in %.2fs", method, url, r.status_code, delay)
+                r.close()
+            finally:
+                if hasattr(body, "close"):
+                    body.close()
+            time.sleep(delay)
+
+    def _limited_request(self, method, url, body, kwargs):
+        limit = self._host_limit(url)
+        limit.acquire()
+        try:
+            r = self.session.request(method, url, data=body, **kwargs)
+        except BaseException:
+            limit.release()
+            raise
+        if not kwargs.get("stream"):
+            limit.release()
+            return r
+
+        # The body is still to be read from the connection, so the slot is held until it is closed
+        close = r.close
+        released = []
+
+        def close_and_release():
+            try:
+                close()
+            finally:
+                if not released:
+                    released.append(True)
+                    limit.release()
+        r.close = close_and_release
+        return r
+
+    def get(self, url, **kwargs):
+        return self.request("GET", url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request("POST", url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request("PUT", url, **kwargs)
+
+    async def run(self, function, *args, **kwargs):
+        ''' Runs a blocking function on the client's thread pool. '''
+        return await asyncio.get_event_loop().run_in_executor(
+            self.executor, functools.partial(function, *args, **kwargs))
+
+    async def arequest(self, method, url, **kwargs):
+        return await self.run(self.request, method, url, **kwargs)
+
+    async def aget(self, url, **kwargs):
+        return await self.arequest("GET", url, **kwargs)
+
+    def close(self):
+        self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_client():
+    ''' The process-wide client, so every transfer path shares one connection pool. '''
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = HttpClient()
+        return _shared
+
+
+def base_url(api):
+    return ("http://" if api.http else "https://") + api.host
+
+
+def download_staged_file(client, api, gateway_download_path):
+    ''' Same as GatewayAPI.download_staged_file. Returns (filename, content). '''
+    r = client.get(base_url(api) + gateway_download_path, headers=api.headers)
+    if r.status_code != 200:
+        raise RuntimeError(f"File Download Failed. Status code: {r.status_code}")
+    filename = re.findall('filename="(.+)";', r.headers['Content-Disposition'])[0]
+    logger.info("Downloaded Staged File: %s", filename)
+    return filename, r.content
+
+
+def _source(filepath):
+    ''' Returns (size, open) for a file path, or for a spooled Segment (see spool.py). '''
+    if hasattr(filepath, "open") and hasattr(filepath, "size"):
+        return filepath.size, filepath.open
+    return os.path.getsize(filepath), lambda: open(filepath, "rb")
+
+
+def upload_downlinked_file(client, api, filename, filepath, system, timestamp=None,
+                           content_type="binary/octet-stream", command_id=None, metadata=None):
+    ''' Same as GatewayAPI.upload_downlinked_file. `filepath` may also be a spooled Segment. '''
+    byte_size, open_source = _source(filepath)
+    md5 = hashlib.md5()
+    with open_source() as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            md5.update(chunk)
+    checksum = base64.b64encode(md5.digest())
+
+    # Ask Major Tom where to put the file
+    request_r = client.post(base_url(api) + "/rails/active_storage/direct_uploads", headers=api.headers, data={
+        "filename": filename,
+        "byte_size": byte_size,
+        "content_type": content_type,
+        "checksum": checksum
+    })
+    if request_r.status_code != 200:
+        logger.error(f"Transaction Failed. Status code: {request_r.status_code} \n Text Response: {request_r.text}")
+        raise RuntimeError(f"File Upload Request Failed. Status code: {request_r.status_code}")
+    request_content = json.loads(request_r.content)
+
+    # PUT the file to the Major Tom file bucket (S3 or Minio), re-opening it for each attempt
+    upload_r = client.put(
+        request_content["direct_upload"]["url"],
+        headers={"Content-Type": content_type, "Content-MD5": checksum},
+        data=open_source)
+    if upload_r.status_code not in (200, 204):
+        logger.error(f"Transaction Failed. Status code: {upload_r.status_code} \n Text Response: {upload_r.text}")
+        raise RuntimeError(f"File Upload Request Failed. Status code: {upload_r.status_code}")
+
+    # Tell Major Tom about the file
+    file_data = {
+        "signed_id": request_content["signed_id"],
+        "name": filename,
+        "timestamp": timestamp if timestamp is not None else time.time() * 1000,
+        "system": system
+    }
+    if command_id is not None:
+        file_data["command_id"] = command_id
+    if metadata is not None:
+        file_data["metadata"] = metadata
+    file_data_r = client.post(base_url(api) + "/gateway_api/v1.0/downlinked_files", headers=api.headers, json=file_data)
+    if file_data_r.status_code != 200:
+        logger.error(f"Transaction Failed. Status code: {file_data_r.status_code} \n Text Response: {file_data_r.text}")
+        raise RuntimeError(f"File Data Post Failed. Status code: {file_data_r.status_code}")
+    logger.info("Uploaded %s to Major Tom", filename)
@@ -0,0 +1,222 @@
+'''
+Emulates an RF link between the Gateway and the satellite.
+
+The link to the fake satellite is otherwise instant and lossless. LinkEmulator wraps the satellite
+(in process, or a RemoteSatellite) and impairs the encoded frames going each way:
+
+  - bandwidth:  bits per second. Frames queue behind each other, each direction separately.
+  - delay:      propagation delay in seconds, each way.
+  - jitter:     up to this many extra seconds per frame, uniformly distributed. A frame is never
+                delivered before one sent ahead of it in the same direction, so each direction
+                stays in order, as it would over one radio link.
+  - loss:       chance that a frame is lost.
+  - corruption: chance that one bit of a frame is flipped. Frames carry a CRC-32 on the link, so a
+                corrupted frame fails its check where it arrives and is dropped like a lost one.
+  - passes:     PassWindows. Frames sent outside a pass are lost.
+
+    gateway.satellite = LinkEmulator(gateway.satellite, **parse_link("bandwidth=9600,delay=0.25,loss=0.01"))
+
+Uplinked frames wait on the sending command's thread, as they would in a radio's transmit call.
+Downlinked responses are timed by the shared scheduler, and handed to the gateway in the order they
+arrive on a delivery thread of their own. Calls the satellite makes on the
+gateway without a frame (command statuses, metrics, file lists) get the delay, loss and outages too.
+'''
+import logging
+import random
+import struct
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+from .scheduler import shared_scheduler
+
+logger = logging.getLogger(__name__)
+
+LINK_OPTIONS = ("bandwidth", "delay", "jitter", "loss", "corruption", "pass", "seed")
+CHECKSUM = struct.Struct(">I")
+
+
+def checksummed(frame):
+    return frame + CHECKSUM.pack(zlib.crc32(frame))
+
+
+def checked(frame):
+    ''' Returns the frame without its checksum, or None if the check fails. '''
+    body, checksum = frame[:-CHECKSUM.size], frame[-CHECKSUM.size:]
+    if len(checksum) < CHECKSUM.size or CHECKSUM.unpack(checksum)[0] != zlib.crc32(body):
+        return None
+    return body
+
+
+def parse_link(text):
+    '''
+    Parses "bandwidth=9600,delay=0.25,jitter=0.05,loss=0.01,corruption=0.001,pass=600/120,seed=1"
+    into LinkEmulator keyword arguments. `pass` is "period/duration" in seconds.
+    '''
+    options = {}
+    for part in text.split(","):
+        name, _, value = part.partition("=")
+        name = name.strip()
+        if name not in LINK_OPTIONS or not value:
+            raise ValueError(f"Link options must be name=value, with names from {', '.join(LINK_OPTIONS)}, not {part!r}")
+        if name == "pass":
+            period, _, duration = value.partition("/")
+            options["passes"] = PassWindows(float(period), float(duration))
+        elif name == "seed":
+            options["seed"] = int(value)
+        else:
+            options[name] = float(value)
+    return options
+
+
+class PassWindows:
+    ''' The satellite is in view for `duration` seconds out of every `period`, starting now. '''
+
+    def __init__(self, period, duration, start=None):
+        self.period = period
+        self.duration = duration
+        self.start = time.monotonic() if start is None else start
+
+    def in_pass(self, now):
+        return (now - self.start) % self.period < self.duration
+
+
+class Channel:
+    '''
+    One direction of the link. Frames are transmitted one after another at the link's bandwidth,
+    and arrive in the order they were sent.
+    '''
+
+    def __init__(self, bandwidth):
+        self.bandwidth = bandwidth
+        self.free_at = 0.0
+        self.arrived_at = 0.0
+        self._lock = threading.Lock()
+
+    def transmit(self, size, now, latency=0.0):
+        '''
+        Returns when a `size` byte frame sent now arrives: once its last bit leaves the antenna and
+        `latency` seconds later, but not before the frame sent ahead of it.
+        '''
+        with self._lock:
+            if self.bandwidth:
+                self.free_at = max(now, self.free_at) + size * 8 / self.bandwidth
+                now = self.free_at
+            self.arrived_at = max(now + latency, self.arrived_at)
+            return self.arrived_at
+
+
+class LinkEmulator:
+    def __init__(self, satellite, bandwidth=None, delay=0.0, jitter=0.0, loss=0.0, corruption=0.0,
+                 passes=None, scheduler=None, seed=None):
+        self.satellite = satellite
+        self.delay = delay
+        self.jitter = jitter
+        self.loss = loss
+        self.corruption = corruption
+        self.passes = passes
+        self.uplink = Channel(bandwidth)
+        self.downlink = Channel(bandwidth)
+        self.scheduler = scheduler or shared_scheduler()
+        self.random = random.Random(seed)
+        self.stats = {"sent": 0, "lost": 0, "corrupted": 0, "out_of_pass": 0}
+        self._gateways = {}  # id(gateway) -> DownlinkGateway
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        # Everything else (name, check_cancelled, ...) is the satellite's own
+        return getattr(self.satellite, name)
+
+    def process_command(self, bytes, gateway):
+        ''' Uplinks an encoded command. Returns once the satellite has it, or it was lost. '''
+        sent = self.send(self.uplink, bytes)
+        if sent is None:
+            return
+        frame, arrival = sent
+        time.sleep(max(0.0, arrival - time.monotonic()))
+        self.satellite.process_command(bytes=frame, gateway=self.downlink_gateway(gateway))
+
+    def downlink_gateway(self, gateway):
+        proxy = self._gateways.get(id(gateway))
+        if proxy is None:
+            proxy = self._gateways[id(gateway)] = DownlinkGateway(self, gateway)
+        return proxy
+
+    def send(self, channel, frame):
+        '''
+        Puts a frame on the link. Returns (frame as it arrives, time.monotonic() it arrives at), or
+        None if it is lost or fails its checksum. Calls without bytes pass frame=None, and only see
+        delay, jitter and loss.
+        '''
+        now = time.monotonic()
+        if frame is not None:
+            frame = checksummed(frame)
+        with self._lock:
+            self.stats["sent"] += 1
+            if self.passes is not None and not self.passes.in_pass(now):
+                self.stats["out_of_pass"] += 1
+                logger.debug("Frame sent outside a pass was lost")
+                return None
+            if self.loss and self.random.random() < self.loss:
+                self.stats["lost"] += 1
+                logger.debug("Frame lost on the link")
+                return None
+            if frame and self.corruption and self.random.random() < self.corruption:
+                frame = bytearray(frame)
+                bit = self.random.randrange(len(frame) * 8)
+                frame[bit // 8] ^= 1 << (bit % 8)
+                frame = bytes(frame)
+            jitter = self.random.uniform(0, self.jitter) if self.jitter else 0.0
+        arrival = channel.transmit(len(frame) if frame is not None else 0, now, self.delay + jitter)
+        if frame is not None:
+            frame = checked(frame)
+            if frame is None:
+                with self._lock:
+                    self.stats["corrupted"] += 1
+                logger.debug("Frame failed its checksum and was dropped")
+                return None
+        return frame, arrival
+
+
+class DownlinkGateway:
+    ''' What the satellite sees as its gateway: every call comes back down the emulated link. '''
+
+    def __init__(self, link, gateway):
+        self.link = link
+        self.gateway = gateway
+        # The Gateway's methods wait on the websocket, so arrivals are handed off the scheduler thread,
+        # to one thread that keeps them in the order they arrived
+        self.deliveries = ThreadPoolExecutor(max_workers=1, thread_name_prefix="downlink")
+        # Held from sending a frame to scheduling its delivery, so frames arriving at the same time
+        # are delivered in the order they were sent
+        self._sending = threading.Lock()
+
+    def send(self, frame, method, *args, **kwargs):
+        with self._sending:
+            sent = self.link.send(self.link.downlink, frame)
+            if sent is None:
+                return
+            frame, arrival = sent
+            if frame is not None:
+                args = (frame,) + args
+            self.link.scheduler.call_at(arrival, self.deliveries.submit, self._call, method, args, kwargs)
+
+    def _call(self, method, args, kwargs):
+        try:
+            method(*args, **kwargs)
+        except Exception:
+            logger.exception("Gateway failed to handle %s from the link", method.__name__)
+
+    def satellite_response(self, encrypted, response, *args, **kwargs):
+        self.send(encrypted, self.gateway.satellite_response, response)
+
+    def satellite_ack(self, frame, *args, **kwargs):
+        self.send(frame, self.gateway.satellite_ack)
+
+    def __getattr__(self, name):
+        method = getattr(self.gateway, name)
+
+        def call(*args, **kwargs):
+            self.send(None, method, *args, **kwargs)
+        return call
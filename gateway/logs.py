@@ -0,0 +1,172 @@
+'''
+Logging that stays off the command path.
+
+configure_logging() replaces logging.basicConfig for the gateways. Records are handed to a queue
+(LazyQueueHandler) and formatted and written by a QueueListener thread, so the thread that logs
+never waits on the formatter or on the terminal:
+
+    listener = configure_logging(level=logging.INFO, json_output=True)
+    ...
+    listener.stop()   # also done at exit
+
+  - lazy formatting: log with %-style arguments (logger.info("Sent %s", thing)) rather than
+    f-strings, so nothing is formatted at all for records below the level, or dropped by sampling.
+    A record that is logged has its arguments merged into the message as it is queued, as
+    logging.handlers.QueueHandler does, so it shows them as they were when it was logged. The
+    rest of the formatting (time stamps, JSON) happens on the listener thread.
+  - sampling: each logger may log `sample_rate` records a second per message template, in bursts
+    of `sample_burst`, at INFO and below. The rest are dropped before they are queued, and the
+    next record that gets through says how many were. Warnings and errors are never sampled.
+    Up to `max_templates` templates are tracked, least recently used first out, so messages
+    formatted before they are logged don't grow it without bound.
+  - JSON output: one object a line, with the time, level, logger, thread and message, and any
+    `extra` fields.
+'''
+import atexit
+import collections
+import copy
+import json
+import logging
+import logging.handlers
+import queue
+import threading
+import time
+
+from .outbound import TokenBucket
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+# LogRecord attributes that aren't `extra` fields
+RECORD_ATTRIBUTES = frozenset(vars(logging.LogRecord("", 0, "", 0, "", None, None))) | {"message", "asctime", "suppressed"}
+
+
+class LazyQueueHandler(logging.handlers.QueueHandler):
+    ''' Queues records with their message merged. The listener's handlers do the rest of the formatting. '''
+
+    def prepare(self, record):
+        # Arguments may be changed by their owner once this returns, so they are merged now
+        record = copy.copy(record)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            # Tracebacks hold on to frames, so they are rendered before leaving the thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class LogListener(logging.handlers.QueueListener):
+    def stop(self):
+        # Safe to call again, as it is at exit
+        if self._thread is not None:
+            super().stop()
+
+
+class SamplingFilter(logging.Filter):
+    '''
+    Lets each logger send `rate` records a second per message template, in bursts of `burst`.
+    `rates` sets other rates for some loggers (and their children), for example {"gateway.gateway": 5}.
+    Records above `max_level` always pass.
+    '''
+
+    def __init__(self, rate=20, burst=None, rates=None, max_level=logging.INFO, max_templates=1024):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self.rates = rates or {}
+        self.max_level = max_level
+        self.max_templates = max_templates
+        self.buckets = collections.OrderedDict()  # (logger name, msg) -> TokenBucket, least recently used first
+        self.suppressed = {}  # (logger name, msg) -> records dropped since the last one through
+        self._lock = threading.Lock()
+
+    def rate_for(self, name):
+        while name:
+            if name in self.rates:
+                return self.rates[name]
+            name = name.rpartition(".")[0]
+        return self.rate
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                rate = self.rate_for(record.name)
+                if not rate:
+                    return True
+                bucket = self.buckets[key] = TokenBucket(rate, self.burst)
+                if len(self.buckets) > self.max_templates:
+                    evicted, _ = self.buckets.popitem(last=False)
+                    self.suppressed.pop(evicted, None)
+            else:
+                self.buckets.move_to_end(key)
+            if bucket.ready_in(now) > 0:
+                self.suppressed[key] = self.suppressed.get(key, 0) + 1
+                return False
+            bucket.take(now)
+            suppressed = self.suppressed.pop(key, 0)
+        if suppressed:
+            record.suppressed = suppressed
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, fmt=TEXT_FORMAT):
+        super().__init__(fmt)
+
+    def format(self, record):
+        text = super().format(record)
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            text += f" ({suppressed} similar messages suppressed)"
+        return text
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "time": record.created,
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        for name, value in vars(record).items():
+            if name not in RECORD_ATTRIBUTES:
+                entry[name] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            entry["suppressed"] = suppressed
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level=logging.INFO, json_output=False, sample_rate=20, sample_burst=None, sample_rates=None,
+                      stream=None):
+    '''
+    Routes the root logger through a queue to a stream handler on a listener thread. Replaces any
+    handlers already on the root logger. Returns the started listener.
+    '''
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(JsonFormatter() if json_output else TextFormatter())
+    records = queue.SimpleQueue()
+    queue_handler = LazyQueueHandler(records)
+    if sample_rate or sample_rates:
+        queue_handler.addFilter(SamplingFilter(rate=sample_rate, burst=sample_burst, rates=sample_rates))
+
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    listener = LogListener(records, handler)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
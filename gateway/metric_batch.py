@@ -0,0 +1,99 @@
+'''
+Builds measurements messages for Major Tom from pre-encoded templates.
+
+A metric point as a dict repeats the same system, subsystem and metric strings every tick, and
+json.dumps encodes them all over again for every point. MetricBatch encodes each channel's
+identity once (MetricChannels), shares one encoded timestamp between the points of a tick, and
+joins the pieces into the finished message text:
+
+    channels = MetricChannels()
+    battery_voltage = channels.prefix("Example FlatSat", "battery", "voltage")
+
+    batch = MetricBatch(timestamp=int(time.time() * 1000))
+    batch.add(battery_voltage, 3.91)
+    await transmit_batch(api, batch)
+
+The text is sent as it is by the outbound lanes (see outbound.py). Without them, transmit_batch
+falls back to transmit_metrics with ordinary dicts.
+'''
+import json
+import math
+import time
+
+
+class MetricChannels:
+    ''' Interned channel identities: the start of a measurement's JSON, encoded once per channel. '''
+
+    def __init__(self):
+        self._prefixes = {}  # (system, subsystem, metric) -> str
+
+    def prefix(self, system, subsystem, metric):
+        key = (system, subsystem, metric)
+        prefix = self._prefixes.get(key)
+        if prefix is None:
+            prefix = self._prefixes[key] = '{"system":%s,"subsystem":%s,"metric":%s,"value":' % (
+                json.dumps(system), json.dumps(subsystem), json.dumps(metric))
+        return prefix
+
+    def __len__(self):
+        return len(self._prefixes)
+
+
+def encode_value(value):
+    if type(value) is float and math.isfinite(value):
+        return float.__repr__(value)
+    if type(value) is int:
+        return int.__repr__(value)
+    return json.dumps(value)
+
+
+class EncodedMessage:
+    ''' A message for Major Tom that is already JSON. The outbound lanes send its text as it is. '''
+
+    def __init__(self, type, text):
+        self.type = type
+        self.text = text
+
+    def get(self, key, default=None):
+        # Enough of a dict for outbound.lane_for
+        return self.type if key == "type" else default
+
+    def payload(self):
+        ''' The message as a dict, for anything that needs one. '''
+        return json.loads(self.text)
+
+
+class MetricBatch:
+    def __init__(self, timestamp=None):
+        self.timestamp = int(time.time() * 1000) if timestamp is None else timestamp
+        self._suffixes = {}  # timestamp -> encoded end of a measurement
+        self._suffix = self._suffix_for(self.timestamp)
+        self.parts = []
+
+    def _suffix_for(self, timestamp):
+        suffix = self._suffixes.get(timestamp)
+        if suffix is None:
+            suffix = self._suffixes[timestamp] = ',"timestamp":%d}' % timestamp
+        return suffix
+
+    def add(self, prefix, value, timestamp=None):
+        ''' Adds one point for a channel prefix from MetricChannels, at the batch's timestamp unless given. '''
+        suffix = self._suffix if timestamp is None else self._suffix_for(timestamp)
+        self.parts.append(prefix + encode_value(value) + suffix)
+
+    def __len__(self):
+        return len(self.parts)
+
+    def message(self):
+        return EncodedMessage("measurements", '{"type":"measurements","measurements":[' + ",".join(self.parts) + "]}")
+
+    def metrics(self):
+        ''' The points as ordinary metric dicts. '''
+        return json.loads("[" + ",".join(self.parts) + "]")
+
+
+async def transmit_batch(api, batch):
+    ''' Sends a MetricBatch pre-encoded if the outbound lanes are installed on `api`, as plain metrics if not. '''
+    if getattr(api, "outbound", None) is not None:
+        return await api.transmit(batch.message())
+    return await api.transmit_metrics(metrics=batch.metrics())
@@ -0,0 +1,356 @@
+'''
+Priority lanes for everything the gateway sends to Major Tom.
+
+GatewayAPI sends every message down one websocket in the order it was produced, so a burst of
+telemetry can hold up a "failed" or "cancelled" status. OutboundScheduler takes over
+`api.transmit` and sorts each outgoing message into a lane by its type:
+
+    command   command_update, transmit_blob   (command state, and uplink to a ground station network)
+    events    events
+    metrics   measurements
+    bulk      file_list, command_definitions_update, and anything else
+
+A single sender drains the lanes with weighted fair queuing: each message gets a virtual finish
+time of 1 / weight after the later of the lane's previous message and the current virtual time,
+and the earliest finish time goes next. Higher weighted lanes get proportionally more of the
+link, but no lane is starved. A lane can also be given its own rate limit (messages/second),
+for example from run.py's --lane-rates "metrics=50,bulk=5" (see parse_rates).
+
+When Major Tom reports a rate limit, lanes are shed for `retry_after` seconds starting from the
+lowest priority, one more lane for each rate limit received while shedding. The command lane is
+never shed. Shed lanes are held and sent once the backoff ends, except metrics: a fresh set of
+measurements is only a second away, so those are dropped instead.
+
+Command, event and metric messages also share an AdaptiveTokenBucket. Every rate limit halves
+its rate, and it climbs back linearly while messages are being sent (AIMD, as in TCP congestion
+control), so the gateway settles just under the rate Major Tom accepts instead of being
+throttled over and over. When given a system, the current rate is reported as the
+gateway.outbound_rate metric while the websocket is connected. These reports (GatewayReport) go in
+the metrics lane, but don't take from the adaptive rate or make it climb.
+
+    outbound = OutboundScheduler(system="Space Oddity")
+    outbound.install(api)
+
+Messages that are already JSON (metric_batch.EncodedMessage) are written to the websocket as they
+are, skipping json.dumps.
+'''
+import asyncio
+import collections
+import logging
+import time
+
+from .metric_batch import EncodedMessage
+
+logger = logging.getLogger(__name__)
+
+# Highest priority first
+LANES = ("command", "events", "metrics", "bulk")
+
+LANE_FOR_TYPE = {
+    "command_update": "command",
+    "transmit_blob": "command",
+    "events": "events",
+    "measurements": "metrics",
+}
+
+DEFAULT_WEIGHTS = {"command": 8, "events": 4, "metrics": 2, "bulk": 1}
+
+# Lanes whose backlog is dropped, rather than held, while they are shed
+LOSSY_LANES = frozenset(["metrics"])
+
+# Lanes that share the adaptive rate
+ADAPTIVE_LANES = frozenset(["command", "events", "metrics"])
+
+DEFAULT_RETRY_AFTER = 5.0
+
+
+def lane_for(payload):
+    return LANE_FOR_TYPE.get(payload.get("type"), "bulk")
+
+
+def parse_rates(text):
+    ''' Parses "metrics=50,bulk=5" into OutboundScheduler rates: messages/second per lane. '''
+    rates = {}
+    for part in text.split(","):
+        lane, _, rate = part.partition("=")
+        lane = lane.strip()
+        try:
+            rate = float(rate)
+        except ValueError:
+            rate = None
+        if lane not in LANES or rate is None or rate < 0:
+            raise ValueError(f"Lane rates must be lane=messages/second, with lanes from {', '.join(LANES)}, not {part!r}")
+        rates[lane] = rate
+    return rates
+
+
+class GatewayReport(dict):
+    ''' A message the scheduler sends about itself. It is exempt from the adaptive rate. '''
+
+
+def is_adaptive(lane, payload):
+    return lane in ADAPTIVE_LANES and not isinstance(payload, GatewayReport)
+
+
+class TokenBucket:
+    ''' Allows `rate` messages per second, in bursts of up to `burst`. '''
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated = None
+
+    def _refill(self, now):
+        if self.updated is not None:
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_in(self, now):
+        ''' Seconds until a message may be sent, 0 if it may be sent now. '''
+        self._refill(now)
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+
+class AdaptiveTokenBucket(TokenBucket):
+    '''
+    A token bucket whose rate is multiplied by `decrease` on every rate limit, and grows by
+    `increase` messages/second for every second spent sending, between `minimum` and `maximum`.
+    It starts at `maximum` unless given a starting rate, so nothing is held back until Major Tom
+    first pushes back.
+    '''
+
+    def __init__(self, rate=None, minimum=1.0, maximum=1000.0, increase=10.0, decrease=0.5):
+        rate = maximum if rate is None else rate
+        super().__init__(rate, burst=rate)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease = decrease
+        self.last_take = None
+
+    def _set_rate(self, rate):
+        self.rate = min(self.maximum, max(self.minimum, rate))
+        # Allow about a second's worth of burst at the current rate
+        self.burst = max(1.0, self.rate)
+        self.tokens = min(self.tokens, self.burst)
+
+    def throttle(self):
+        self._set_rate(self.rate * self.decrease)
+
+    def take(self, now):
+        super().take(now)
+        if self.last_take is not None:
+            # Only time spent sending counts, so an idle gateway doesn't climb back to the maximum
+            self._set_rate(self.rate + self.increase * min(1.0, now - self.last_take))
+        self.last_take = now
+
+
+class OutboundScheduler:
+    def __init__(self, weights=None, rates=None, adaptive=None, system=None, metric_interval=1.0):
+        self.weights = dict(DEFAULT_WEIGHTS, **(weights or {}))
+        # lane -> TokenBucket, for lanes with a rate limit
+        self.buckets = {lane: TokenBucket(rate) for lane, rate in (rates or {}).items() if rate}
+        # Shared by ADAPTIVE_LANES, on top of their own limits
+        self.adaptive = adaptive or AdaptiveTokenBucket()
+        # The system to report gateway.outbound_rate under. Not reported without one.
+        self.system = system
+        self.metric_interval = metric_interval
+        self._next_report = None
+        self.queues = {lane: collections.deque() for lane in LANES}  # lane -> deque of (finish, payload, future)
+        self.last_finish = {lane: 0.0 for lane in LANES}
+        self.virtual_time = 0.0
+        self.shed_level = 0  # How many of the lowest priority lanes are shed
+        self.shed_until = 0.0
+        self.sent = {lane: 0 for lane in LANES}
+        self.dropped = {lane: 0 for lane in LANES}
+        self.send = None
+        self.api = None
+        self.loop = None
+        self._wakeup = None
+        self._drainer = None
+
+    def install(self, api):
+        ''' Routes everything `api` sends through the lanes. '''
+        self.api = api
+        self.send = api.transmit
+        api.transmit = self.submit
+        # Lets senders of pre-encoded messages know they can use api.transmit. See metric_batch.py
+        api.outbound = self
+
+    def queued(self, lane=None):
+        if lane is not None:
+            return len(self.queues[lane])
+        return sum(len(queue) for queue in self.queues.values())
+
+    def shed_lanes(self):
+        ''' The lanes currently shed, lowest priority first. '''
+        if self.loop is None or self.loop.time() >= self.shed_until:
+            return ()
+        return tuple(reversed(LANES))[:self.shed_level]
+
+    async def submit(self, payload):
+        '''
+        Queues a message and waits until it has been sent.
+        Returns False if it was dropped instead.
+        '''
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+            self._wakeup = asyncio.Event()
+        if self._drainer is None or self._drainer.done():
+            self._drainer = asyncio.ensure_future(self._drain())
+        return await self._enqueue(payload)
+
+    def _enqueue(self, payload):
+        lane = lane_for(payload)
+        future = self.loop.create_future()
+        if lane in LOSSY_LANES and lane in self.shed_lanes():
+            self.dropped[lane] += 1
+            future.set_result(False)
+            return future
+        finish = max(self.virtual_time, self.last_finish[lane]) + 1.0 / self.weights[lane]
+        self.last_finish[lane] = finish
+        self.queues[lane].append((finish, payload, future))
+        self._wakeup.set()
+        return future
+
+    def shed(self, retry_after=DEFAULT_RETRY_AFTER):
+        '''
+        Sheds one more of the lowest priority lanes for retry_after seconds, and cuts the adaptive rate.
+        Call on the event loop.
+        '''
+        self.adaptive.throttle()
+        logger.warning(f"Outbound rate cut to {self.adaptive.rate:.1f} messages/second")
+        now = self.loop.time() if self.loop is not None else 0.0
+        self.shed_level = min(self.shed_level + 1 if now < self.shed_until else 1, len(LANES) - 1)
+        self.shed_until = now + retry_after
+        shed = self.shed_lanes() if self.loop is not None else ()
+        logger.warning(f"Rate limited by Major Tom, holding back {', '.join(shed)} for {retry_after}s")
+        for lane in shed:
+            if lane in LOSSY_LANES:
+                self._drop_queued(lane)
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def rate_limit_callback(self, message, *args, **kwargs):
+        ''' Can be passed to GatewayAPI as its rate_limit_callback. '''
+        self.shed(retry_after_of(message))
+
+    def _drop_queued(self, lane):
+        queue = self.queues[lane]
+        self.dropped[lane] += len(queue)
+        while queue:
+            _, _, future = queue.popleft()
+            if not future.done():
+                future.set_result(False)
+
+    def _next(self):
+        '''
+        Returns (lane, wait): the lane to send from next, or None and how long until one is ready
+        (None if there is nothing to send at all).
+        '''
+        now = self.loop.time()
+        shed = self.shed_lanes()
+        best = None
+        wait = None
+        for lane in LANES:
+            queue = self.queues[lane]
+            if not queue:
+                continue
+            if lane in shed:
+                ready_in = self.shed_until - now
+            else:
+                ready_in = self.buckets[lane].ready_in(now) if lane in self.buckets else 0
+                if is_adaptive(lane, queue[0][1]):
+                    ready_in = max(ready_in, self.adaptive.ready_in(now))
+            if ready_in > 0:
+                wait = ready_in if wait is None else min(wait, ready_in)
+            elif best is None or queue[0][0] < self.queues[best][0][0]:
+                best = lane
+        return best, wait
+
+    def _report_rate(self):
+        '''
+        Queues the gateway.outbound_rate metric, every metric_interval seconds while connected.
+        Reports aren't queued up while disconnected, to be sent in a burst on reconnecting.
+        '''
+        now = self.loop.time()
+        if self._next_report is not None and now < self._next_report:
+            return self._next_report - now
+        self._next_report = now + self.metric_interval
+        if getattr(self.api, "websocket", None) is None:
+            return self.metric_interval
+        timestamp = int(time.time() * 1000)
+        self._enqueue(GatewayReport({"type": "measurements", "measurements": [
+            {
+                "system": self.system,
+                "subsystem": "gateway",
+                "metric": "outbound_rate",
+                "value": round(self.adaptive.rate, 2),
+                "timestamp": timestamp
+            },
+            {
+                "system": self.system,
+                "subsystem": "gateway",
+                "metric": "outbound_queued",
+                "value": self.queued(),
+                "timestamp": timestamp
+            }
+        ]}))
+        return self.metric_interval
+
+    async def _drain(self):
+        while True:
+            if self.system is not None:
+                until_report = self._report_rate()
+            lane, wait = self._next()
+            if lane is None:
+                if self.system is not None:
+                    wait = until_report if wait is None else min(wait, until_report)
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            finish, payload, future = self.queues[lane].popleft()
+            self.virtual_time = max(self.virtual_time, finish)
+            if lane in self.buckets:
+                self.buckets[lane].take(self.loop.time())
+            if is_adaptive(lane, payload):
+                self.adaptive.take(self.loop.time())
+            try:
+                await self._send(payload)
+            except Exception as e:
+                if not future.done():
+                    future.set_exception(e)
+                continue
+            self.sent[lane] += 1
+            if not future.done():
+                future.set_result(True)
+
+    async def _send(self, payload):
+        if isinstance(payload, EncodedMessage):
+            websocket = getattr(self.api, "websocket", None)
+            if websocket is not None:
+                try:
+                    await websocket.send(payload.text)
+                    return
+                except Exception as e:
+                    logger.warning(f"Sending a pre-encoded {payload.type} message failed, retrying as a dict: {type(e).__name__}: {e}")
+            # GatewayAPI.transmit queues messages while disconnected, and those must be dicts
+            payload = payload.payload()
+        await self.send(payload)
+
+
+def retry_after_of(message):
+    ''' How long Major Tom asked us to back off for, from a rate_limit message. '''
+    try:
+        return float(message["rate_limit"]["retry_after"])
+    except (KeyError, TypeError, ValueError):
+        return DEFAULT_RETRY_AFTER
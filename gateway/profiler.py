@@ -0,0 +1,72 @@
+'''
+A low overhead sampling profiler that can be started from a Major Tom command.
+
+A background thread wakes up every `interval` seconds and records the stack of every other
+thread in the process. Stacks are kept in the "collapsed" format used by flamegraph.pl,
+speedscope and similar tools: one line per unique stack, frames separated by semicolons,
+followed by the number of samples in which that stack was seen.
+
+    MainThread;run_forever (base_events.py:600);_run_once (base_events.py:1815) 42
+'''
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+class SamplingProfiler:
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.samples = 0
+        self.counts = {}
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def profile(self, duration):
+        ''' Samples for `duration` seconds, blocking the calling thread. '''
+        self.start()
+        time.sleep(duration)
+        self.stop()
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, f"Thread-{thread_id}"))
+                key = ";".join(reversed(stack))
+                self.counts[key] = self.counts.get(key, 0) + 1
+            self.samples += 1
+
+    def collapsed(self):
+        ''' Returns the samples as collapsed stack lines, most frequent first. '''
+        stacks = sorted(self.counts.items(), key=lambda item: item[1], reverse=True)
+        return "".join(f"{stack} {count}\n" for stack, count in stacks)
+
+    def write(self, path=None):
+        ''' Writes the collapsed stacks to `path` (or a new temporary file) and returns the path. '''
+        if path is None:
+            fd, path = tempfile.mkstemp(prefix="gateway-profile-", suffix=".collapsed")
+            os.close(fd)
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+        return path
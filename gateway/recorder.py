@@ -0,0 +1,109 @@
+'''
+Records what Major Tom sends a gateway, so a real session can be replayed offline.
+
+SessionRecorder wraps the GatewayAPI callbacks (command, cancel, received_blob and transit) and
+appends each inbound message, as Major Tom sent it, to a JSONL file:
+
+    [1600000000.123, {"type": "command", "command": {...}}]
+
+Replay a recording against either gateway with `python -m loadtest.replay FILE`.
+'''
+import asyncio
+import base64
+import functools
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def command_message(command, *args, **kwargs):
+    return {"type": "command", "command": command.json_command}
+
+
+def cancel_message(command_id, *args, **kwargs):
+    return {"type": "cancel", "command": {"id": command_id}}
+
+
+def received_blob_message(blob, context, *args, **kwargs):
+    return {"type": "received_blob", "blob": base64.b64encode(blob).decode("ascii"), "context": context}
+
+
+def transit_message(message, *args, **kwargs):
+    return message
+
+
+# Callback name -> rebuilds the Major Tom message from the callback's arguments
+MESSAGES = {
+    "command_callback": command_message,
+    "cancel_callback": cancel_message,
+    "received_blob_callback": received_blob_message,
+    "transit_callback": transit_message,
+}
+
+
+class SessionRecorder:
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "a")
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def record(self, message):
+        line = json.dumps([round(time.time(), 3), message], separators=(",", ":")) + "\n"
+        with self._lock:
+            if self.file.closed:
+                # Callbacks still running as the gateway shuts down
+                return
+            self.file.write(line)
+            self.file.flush()
+            self.count += 1
+
+    def wrap(self, name, callback):
+        ''' Returns callback, recording the message behind each call first. Keeps async callbacks async. '''
+        to_message = MESSAGES[name]
+
+        if asyncio.iscoroutinefunction(callback):
+            @functools.wraps(callback)
+            async def recorded(*args, **kwargs):
+                self.record(to_message(*args, **kwargs))
+                return await callback(*args, **kwargs)
+        else:
+            @functools.wraps(callback)
+            def recorded(*args, **kwargs):
+                self.record(to_message(*args, **kwargs))
+                return callback(*args, **kwargs)
+        return recorded
+
+    def wrap_callbacks(self, **callbacks):
+        '''
+        Wraps the recordable callbacks among GatewayAPI keyword arguments, passing the rest through:
+            GatewayAPI(host=..., **recorder.wrap_callbacks(command_callback=..., error_callback=...))
+        '''
+        return {
+            name: self.wrap(name, callback) if name in MESSAGES and callback is not None else callback
+            for name, callback in callbacks.items()
+        }
+
+    def close(self):
+        with self._lock:
+            self.file.close()
+
+
+def load_session(path):
+    ''' Returns the recorded [(timestamp, message)], in order. Skips a partially written last line. '''
+    session = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                timestamp, message = json.loads(line)
+            except ValueError:
+                logger.warning("Skipping unreadable session entry in %s", path)
+                continue
+            session.append((timestamp, message))
+    return session
@@ -0,0 +1,127 @@
+'''
+Talks to a satellite running in another process (see satellite/server.py) over a Unix or TCP socket.
+
+RemoteSatellite takes the place of the in-process Satellite in the Gateway:
+
+    satellite = RemoteSatellite("unix:/tmp/flatsat.sock", loop)
+    gateway = Gateway(satellite=satellite, loop=loop, ...)
+    asyncio.ensure_future(satellite.connect())
+
+Commands are written to the socket from whichever thread sends them, through the event loop's
+transport. Frames from the satellite are decoded on the event loop, then handed to one link thread
+which calls the Gateway: the Gateway's methods wait on the websocket, so they can't run on the loop
+itself, and one thread keeps the satellite's updates for a command in the order they were sent.
+'''
+import asyncio
+import logging
+import random
+from concurrent.futures import ThreadPoolExecutor
+
+from . import stubs
+from satellite.link import ACK, CALL, COMMAND, GATEWAY_METHODS, RESPONSE, FrameDecoder, encode_frame, parse_address
+from satellite.satellite import CommandCancelledError, safeget
+
+logger = logging.getLogger(__name__)
+
+
+class SatelliteProtocol(asyncio.Protocol):
+    def __init__(self, link):
+        self.link = link
+        self.decoder = FrameDecoder()
+
+    def data_received(self, data):
+        for frame in self.decoder.feed(data):
+            self.link.dispatch(*frame)
+
+    def connection_lost(self, exc):
+        self.link.disconnected(exc)
+
+
+class RemoteSatellite:
+    def __init__(self, address, loop, name="Example FlatSat", retry_delay=1.0, max_retry_delay=30.0):
+        self.address = address
+        self.loop = loop
+        self.name = name
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.transport = None
+        self.gateway = None  # Set by the first command, which carries the gateway to answer
+        self.running_commands = {}
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="satellite-link")
+        self._lost = None  # Resolves when the current connection drops
+        self.closed = False
+
+    async def connect(self):
+        ''' Connects, and reconnects whenever the link drops, until close() is called. '''
+        delay = self.retry_delay
+        while not self.closed:
+            family, where = parse_address(self.address)
+            try:
+                if family == "unix":
+                    transport, _ = await self.loop.create_unix_connection(lambda: SatelliteProtocol(self), where)
+                else:
+                    transport, _ = await self.loop.create_connection(lambda: SatelliteProtocol(self), *where)
+            except OSError as e:
+                logger.warning(f"Could not reach the satellite at {self.address}: {e}. Retrying in {delay:.1f}s")
+                await asyncio.sleep(delay * random.uniform(0.5, 1.0))
+                delay = min(delay * 2, self.max_retry_delay)
+                continue
+            logger.info("Connected to the satellite at %s", self.address)
+            self.transport = transport
+            delay = self.retry_delay
+            self._lost = self.loop.create_future()
+            await self._lost
+
+    def disconnected(self, exc):
+        logger.warning(f"Lost the satellite link to {self.address}: {exc}")
+        self.transport = None
+        if self._lost is not None and not self._lost.done():
+            self._lost.set_result(None)
+
+    def process_command(self, bytes, gateway):
+        ''' Uplinks an encoded command. Safe to call from any thread. '''
+        self.gateway = gateway
+        if self.transport is None:
+            frame = bytes
+            if stubs.is_sequenced(frame):
+                session, sequence, frame = stubs.unsequence_frame(frame)
+                gateway.uplink_dropped(session, sequence)
+            command = stubs.translate_binary_to_command(stubs.depacketize(stubs.decrypt(frame)))
+            gateway.fail_command(command.id, errors=[f"No link to the satellite at {self.address}"])
+            return
+        self.loop.call_soon_threadsafe(self._write, encode_frame(COMMAND, body=bytes))
+
+    def _write(self, frame):
+        if self.transport is not None:
+            self.transport.write(frame)
+
+    def dispatch(self, kind, header, body):
+        if self.gateway is None:
+            logger.warning("Dropped a frame from the satellite that arrived before any command")
+            return
+        if kind == RESPONSE:
+            self.executor.submit(self._call, self.gateway.satellite_response, body, header["response"])
+        elif kind == ACK:
+            self.executor.submit(self._call, self.gateway.satellite_ack, body)
+        elif kind == CALL and header["method"] in GATEWAY_METHODS:
+            method = getattr(self.gateway, header["method"])
+            self.executor.submit(self._call, method, *header["args"], **header["kwargs"])
+        else:
+            logger.warning(f"Ignored a frame of kind {kind} from the satellite: {header}")
+
+    def _call(self, method, *args, **kwargs):
+        try:
+            method(*args, **kwargs)
+        except Exception:
+            logger.exception(f"Gateway failed to handle {method.__name__} from the satellite")
+
+    def check_cancelled(self, id):
+        ''' Checks to see if a command-in-progress has been cancelled. '''
+        if safeget(self.running_commands, str(id), "cancel"):
+            raise(CommandCancelledError(f"Command {id} Cancelled"))
+
+    def close(self):
+        self.closed = True
+        if self.transport is not None:
+            self.loop.call_soon_threadsafe(self.transport.close)
+        self.executor.shutdown(wait=False)
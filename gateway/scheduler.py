@@ -0,0 +1,133 @@
+'''
+One thread for every delayed callback in the process.
+
+threading.Timer starts (and tears down) a thread per call, which at hundreds of commands per
+minute means hundreds of short-lived threads, each with its own stack. Scheduler keeps every
+pending call in a heap ordered by due time, and a single thread sleeps until the earliest one is
+due, runs it, and goes back to sleep:
+
+    scheduler = shared_scheduler()
+    call = scheduler.call_later(1.0, print, "a second later")
+    call.cancel()
+
+Callbacks run one at a time on the scheduler thread, so they should be short. A callback that
+may block, such as anything that waits on the websocket, is scheduled with call_later_blocking
+instead: when it is due, it is handed to one of a small pool of worker threads, so a slow send
+doesn't hold up every other delayed call in the process.
+'''
+import heapq
+import itertools
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledCall:
+    def __init__(self, when, function, args, kwargs):
+        self.when = when
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+def name_of(function):
+    return getattr(function, '__name__', function)
+
+
+class Scheduler:
+    def __init__(self, name="scheduler", workers=16):
+        self.name = name
+        self.workers = workers
+        self._executor = None  # Runs call_later_blocking callbacks, started on first use
+        self._heap = []  # (when, sequence, ScheduledCall)
+        self._sequence = itertools.count()  # Keeps calls due at the same time in order
+        self._condition = threading.Condition()
+        self._thread = None
+        self._stopped = False
+
+    def call_later(self, delay, function, *args, **kwargs):
+        return self.call_at(time.monotonic() + delay, function, *args, **kwargs)
+
+    def call_at(self, when, function, *args, **kwargs):
+        ''' Runs function(*args, **kwargs) on the scheduler thread at time.monotonic() `when`. '''
+        call = ScheduledCall(when, function, args, kwargs)
+        with self._condition:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+            heapq.heappush(self._heap, (when, next(self._sequence), call))
+            # Only the earliest call changes how long the thread should sleep
+            if self._heap[0][2] is call:
+                self._condition.notify()
+        return call
+
+    def call_later_blocking(self, delay, function, *args, **kwargs):
+        ''' Like call_later, but function runs on a worker thread, where it may block. '''
+        return self.call_later(delay, self._hand_off, function, args, kwargs)
+
+    def call_at_blocking(self, when, function, *args, **kwargs):
+        return self.call_at(when, self._hand_off, function, args, kwargs)
+
+    def _hand_off(self, function, args, kwargs):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=f"{self.name}-worker")
+        self._executor.submit(self._run_call, function, args, kwargs)
+
+    def _run_call(self, function, args, kwargs):
+        try:
+            function(*args, **kwargs)
+        except Exception:
+            logger.exception(f"Scheduled call to {name_of(function)} failed")
+
+    def pending(self):
+        with self._condition:
+            return sum(1 for _, _, call in self._heap if not call.cancelled)
+
+    def stop(self):
+        ''' Stops the thread. Calls that haven't run yet are dropped. '''
+        with self._condition:
+            self._stopped = True
+            self._heap = []
+            self._condition.notify()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._stopped:
+                    if not self._heap:
+                        self._condition.wait()
+                        continue
+                    delay = self._heap[0][0] - time.monotonic()
+                    if delay <= 0:
+                        break
+                    self._condition.wait(delay)
+                if self._stopped:
+                    return
+                _, _, call = heapq.heappop(self._heap)
+            if call.cancelled:
+                continue
+            self._run_call(call.function, call.args, call.kwargs)
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_scheduler():
+    ''' The process-wide scheduler, shared by the Satellite and the Gateway. '''
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = Scheduler()
+        return _shared
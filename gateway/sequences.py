@@ -0,0 +1,202 @@
+'''
+Command sequences run by the gateway.
+
+A run_sequence command carries a list of steps as JSON, so an operator pays one round trip to
+Major Tom for the whole sequence rather than one per command:
+
+    [{"type": "ping"},
+     {"type": "telemetry", "fields": {"mode": "NOMINAL", "duration": 5}, "delay": 2},
+     {"type": "update_file_list", "condition": "completed"}]
+
+  - "fields": the step's command fields, checked against the command definitions.
+  - "delay": seconds to wait before sending the step.
+  - "condition": "always" (the default) sends the step straight after the one before, so steps are
+    pipelined through the uplink window. "completed" waits for every earlier step to complete, and
+    stops the sequence there if any of them didn't.
+
+Each step goes to the satellite as its own command, with an id made from the sequence's id (see
+step_id). Commands the Gateway runs itself rather than sending to the satellite (GATEWAY_COMMANDS)
+can't be steps. The statuses the satellite reports for a step are routed to its SequenceRun instead of
+Major Tom, and the Gateway reports the sequence's progress on the run_sequence command.
+'''
+import json
+import threading
+import time
+
+from majortom_gateway.command import Command
+
+from .statuses import CommandStatus, TERMINAL_STATUSES
+
+CONDITIONS = ("always", "completed")
+# Handled by Gateway.command_callback without going to the satellite
+GATEWAY_COMMANDS = ("run_sequence", "connect", "profile", "all_transitions", "ping_through_leaf_network")
+
+
+class Step:
+    def __init__(self, type, fields=None, delay=0, condition="always"):
+        self.type = type
+        self.fields = fields or {}
+        self.delay = delay
+        self.condition = condition
+
+    def command(self, id, system):
+        return Command({
+            "id": id,
+            "type": self.type,
+            "system": system,
+            "fields": [{"name": name, "value": value} for name, value in self.fields.items()],
+        })
+
+
+def parse_steps(steps):
+    ''' Builds Steps from a run_sequence command's steps field, a list or its JSON. Raises ValueError if they're invalid. '''
+    if isinstance(steps, str):
+        try:
+            steps = json.loads(steps)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"steps is not valid JSON: {e}")
+    if not isinstance(steps, list) or not steps:
+        raise ValueError("steps must be a non-empty list")
+    parsed = []
+    for number, step in enumerate(steps, start=1):
+        if not isinstance(step, dict) or not isinstance(step.get("type"), str):
+            raise ValueError(f"Step {number} must be an object with a command type")
+        if step["type"] == "run_sequence":
+            raise ValueError(f"Step {number} can't be another sequence")
+        if step["type"] in GATEWAY_COMMANDS:
+            raise ValueError(f"Step {number} ({step['type']}) is run by the gateway, so it can't be a step")
+        fields = step.get("fields", {})
+        if not isinstance(fields, dict):
+            raise ValueError(f"Step {number} fields must be an object")
+        delay = step.get("delay", 0)
+        if isinstance(delay, bool) or not isinstance(delay, (int, float)) or delay < 0:
+            raise ValueError(f"Step {number} delay must be a number of seconds")
+        condition = step.get("condition", "always")
+        if condition not in CONDITIONS:
+            raise ValueError(f"Step {number} condition must be one of: {', '.join(CONDITIONS)}")
+        parsed.append(Step(step["type"], fields, delay, condition))
+    return parsed
+
+
+def step_id(command_id, index):
+    return f"{command_id}.{index + 1}"
+
+
+def is_step_id(command_id):
+    # Major Tom's command ids are integers
+    return isinstance(command_id, str) and "." in command_id
+
+
+class SequenceRun:
+    def __init__(self, command_id, steps):
+        self.command_id = command_id
+        self.steps = steps
+        self.states = [None] * len(steps)  # The latest status of each step sent
+        self.errors = {}  # index -> errors
+        self.sent = 0
+        self.finished = 0
+        self.cancelled = False
+        self.changed = threading.Condition()
+
+    def step_id(self, index):
+        return step_id(self.command_id, index)
+
+    def send(self, index):
+        with self.changed:
+            self.sent += 1
+            self.states[index] = CommandStatus.TRANSMITTED
+
+    def update(self, index, status, errors=None):
+        with self.changed:
+            if self.states[index] in TERMINAL_STATUSES:
+                return
+            self.states[index] = status
+            if status in TERMINAL_STATUSES:
+                self.finished += 1
+                if status != CommandStatus.COMPLETED:
+                    self.errors[index] = errors or [CommandStatus(status).value]
+            self.changed.notify_all()
+
+    def cancel(self):
+        with self.changed:
+            self.cancelled = True
+            self.changed.notify_all()
+
+    def sleep(self, seconds):
+        ''' Waits for a step's delay. Returns False if the sequence was cancelled meanwhile. '''
+        with self.changed:
+            return not self.changed.wait_for(lambda: self.cancelled, seconds)
+
+    def wait_for_earlier(self, index, deadline):
+        ''' Waits for every step before `index` to finish. Returns True if they all completed. '''
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.cancelled or self.finished == self.sent, max(0, deadline - time.monotonic()))
+            return not self.cancelled and all(state == CommandStatus.COMPLETED for state in self.states[:index])
+
+    def wait_for_change(self, seen, deadline):
+        ''' Waits until more steps have finished than `seen`, or the deadline. '''
+        with self.changed:
+            self.changed.wait_for(
+                lambda: self.cancelled or self.finished > seen, max(0, deadline - time.monotonic()))
+
+    def settled(self):
+        with self.changed:
+            return self.cancelled or self.finished == self.sent
+
+    def failures(self):
+        ''' Error strings for the steps that didn't complete, in step order. '''
+        with self.changed:
+            errors = []
+            for index, step in enumerate(self.steps):
+                state = self.states[index]
+                if index in self.errors:
+                    errors += [f"Step {index + 1} ({step.type}): {error}" for error in self.errors[index]]
+                elif state is not None and state not in TERMINAL_STATUSES:
+                    errors.append(f"Step {index + 1} ({step.type}) did not finish in time")
+                elif state is None:
+                    errors.append(f"Step {index + 1} ({step.type}) was not sent")
+            return errors
+
+
+class Sequences:
+    ''' The sequences running on a Gateway, and which of them each step id belongs to. '''
+
+    def __init__(self):
+        self.runs = {}  # command id -> SequenceRun
+        self.steps = {}  # step id -> (SequenceRun, index)
+        self._lock = threading.Lock()
+
+    def start(self, command_id, steps):
+        run = SequenceRun(command_id, steps)
+        with self._lock:
+            self.runs[command_id] = run
+            for index in range(len(steps)):
+                self.steps[run.step_id(index)] = (run, index)
+        return run
+
+    def finish(self, run):
+        with self._lock:
+            self.runs.pop(run.command_id, None)
+            for index in range(len(run.steps)):
+                self.steps.pop(run.step_id(index), None)
+
+    def update(self, command_id, status, errors=None):
+        '''
+        Routes a step's status to its sequence. Returns False if `command_id` isn't a step. Statuses
+        for the steps of a sequence that has already finished are dropped.
+        '''
+        if not is_step_id(command_id):
+            return False
+        with self._lock:
+            step = self.steps.get(command_id)
+        if step is not None:
+            run, index = step
+            run.update(index, status, errors)
+        return True
+
+    def cancel(self, command_id):
+        with self._lock:
+            run = self.runs.get(command_id)
+        if run is not None:
+            run.cancel()
@@ -0,0 +1,156 @@
+'''
+A memory-mapped spool for payload data received from the spacecraft.
+
+Science products can be hundreds of megabytes, far more than should be held in memory while they
+are processed and uploaded. PayloadSpool appends each product to one spool file, in chunks, and
+keeps an index of where each one lives. Later stages read it back through memoryviews of a
+memory map of the file, so nothing is copied, and the operating system pages the data in and out
+as needed: resident memory stays bounded no matter how large a product is.
+
+    spool = PayloadSpool()
+    segment = spool.append(chunks, meta={"norad_id": "00000"})  # bytes, or an iterable of bytes
+    view = segment.view()                                       # zero-copy memoryview
+    with segment.open() as f:                                   # file-like, for streaming uploads
+        ...
+    spool.discard(segment)
+
+Once every segment has been discarded, the spool starts over with a fresh file. The old file is
+unlinked rather than truncated, so a view that is still held keeps working until it is released.
+'''
+import logging
+import mmap
+import os
+import tempfile
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class Segment:
+    def __init__(self, spool, id, offset, size, meta):
+        self.spool = spool
+        self.id = id
+        self.offset = offset
+        self.size = size
+        self.meta = meta
+
+    def view(self, start=0, end=None):
+        ''' A zero-copy memoryview of bytes [start, end) of the segment. '''
+        end = self.size if end is None else min(end, self.size)
+        return self.spool.view(self.offset + start, self.offset + end)
+
+    def open(self):
+        return SegmentReader(self)
+
+    def __repr__(self):
+        return f"Segment(id={self.id}, offset={self.offset}, size={self.size})"
+
+
+class SegmentReader:
+    ''' A read-only file-like object over a segment, returning memoryview slices rather than copies. '''
+
+    def __init__(self, segment):
+        self.segment = segment
+        self.position = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.segment.size - self.position
+        data = self.segment.view(self.position, self.position + size)
+        self.position += len(data)
+        return data
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_SET:
+            self.position = offset
+        elif whence == os.SEEK_CUR:
+            self.position += offset
+        else:
+            self.position = self.segment.size + offset
+        self.position = max(0, min(self.position, self.segment.size))
+        return self.position
+
+    def tell(self):
+        return self.position
+
+    def __len__(self):
+        return self.segment.size
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class PayloadSpool:
+    def __init__(self, path=None, chunk_size=1024 * 1024):
+        self.path = path
+        self.chunk_size = chunk_size
+        self.file = None  # Opened with the first segment
+        self.segments = {}  # id -> Segment
+        self.next_id = 1
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _open(self):
+        if self.path is None:
+            fd, self.path = tempfile.mkstemp(prefix="payload-", suffix=".spool")
+            os.close(fd)
+        self.file = open(self.path, "w+b")
+
+    def append(self, data, meta=None):
+        ''' Writes bytes, or an iterable of bytes, to the end of the spool. Returns its Segment. '''
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            view = memoryview(data)
+            chunks = (view[i:i + self.chunk_size] for i in range(0, len(view), self.chunk_size))
+        else:
+            chunks = data
+        with self._lock:
+            if self.file is None:
+                self._open()
+            self.file.seek(0, os.SEEK_END)
+            offset = self.file.tell()
+            for chunk in chunks:
+                self.file.write(chunk)
+            self.file.flush()
+            segment = Segment(self, self.next_id, offset, self.file.tell() - offset, meta or {})
+            self.segments[segment.id] = segment
+            self.next_id += 1
+        logger.debug("Spooled %s", segment)
+        return segment
+
+    def view(self, start, end):
+        ''' A zero-copy memoryview of bytes [start, end) of the spool file. '''
+        with self._lock:
+            if end > start and (self._map is None or len(self._map) < end):
+                # Map the file as it is now. Views of an earlier map stay valid until released.
+                self._map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+            if end <= start:
+                return memoryview(b"")
+            return memoryview(self._map)[start:end]
+
+    def discard(self, segment):
+        ''' Forgets a segment. Once no segments are left, the spool starts over with a fresh file. '''
+        with self._lock:
+            self.segments.pop(segment.id, None)
+            if not self.segments and self.file is not None:
+                self._close()
+                self._open()
+
+    def size(self):
+        return os.path.getsize(self.path) if self.file is not None else 0
+
+    def _close(self):
+        self._map = None
+        self.file.close()
+        self.file = None
+        os.remove(self.path)
+
+    def close(self):
+        with self._lock:
+            if self.file is not None:
+                self._close()
@@ -12,4 +12,7 @@ class CommandStatus(str, Enum):
     PROCESSING = "processing_on_gateway"
     CANCELLED = "cancelled"
     COMPLETED = "completed"
-    FAILED = "failed"
\ No newline at end of file
+    FAILED = "failed"
+
+# States after which Major Tom expects no further updates for a command.
+TERMINAL_STATUSES = (CommandStatus.COMPLETED, CommandStatus.FAILED, CommandStatus.CANCELLED)
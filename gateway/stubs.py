@@ -1,18 +1,26 @@
-import random 
 import json
+import struct
 from majortom_gateway.command import Command
 
 # TRANSLATION
 
-def translate_command_to_binary(command):
+def translate_command_to_binary(command, trace_id=None):
     # For the stub, we will go to a json string and back instead of binary
-    bytes = json.dumps(command.json_command).encode('utf-8')
+    # A trace id (see tracing.py) rides along inside the frame so both ends of the link can report spans.
+    json_command = command.json_command
+    if trace_id is not None:
+        json_command = dict(json_command, trace_id=trace_id)
+    bytes = json.dumps(json_command).encode('utf-8')
     return bytes
 
 def translate_binary_to_command(bytes):
     command = json.loads(bytes.decode('utf-8'))
     return Command(command)
 
+def trace_id_of(command):
+    # Returns the trace id carried in a decoded command's frame, if there is one.
+    return command.json_command.get("trace_id")
+
 # PACKETIZATION
 
 def packetize(data):
@@ -24,6 +32,91 @@ def depacketize(data):
     return data
 
 
+# FRAMING
+
+# Several encoded commands can share one blob to a groundstation network (see blob_batcher.py):
+# the magic, a frame count, then each frame prefixed with its length.
+MULTI_FRAME_MAGIC = b"MTMF"
+FRAME_COUNT = struct.Struct(">H")
+FRAME_LENGTH = struct.Struct(">I")
+
+def pack_frames(frames):
+    parts = [MULTI_FRAME_MAGIC, FRAME_COUNT.pack(len(frames))]
+    for frame in frames:
+        parts.append(FRAME_LENGTH.pack(len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+def unpack_frames(blob):
+    # Blobs without the magic are a single frame, as sent before batching
+    if not blob.startswith(MULTI_FRAME_MAGIC):
+        return [blob]
+    view = memoryview(blob)
+    offset = len(MULTI_FRAME_MAGIC)
+    count, = FRAME_COUNT.unpack_from(view, offset)
+    offset += FRAME_COUNT.size
+    frames = []
+    for _ in range(count):
+        length, = FRAME_LENGTH.unpack_from(view, offset)
+        offset += FRAME_LENGTH.size
+        if offset + length > len(blob):
+            raise ValueError(f"Truncated multi-frame blob: frame of {length} bytes at offset {offset}")
+        frames.append(bytes(view[offset:offset + length]))
+        offset += length
+    return frames
+
+def framed_size(frame):
+    # Bytes a frame adds to a multi-frame blob
+    return FRAME_LENGTH.size + len(frame)
+
+MULTI_FRAME_OVERHEAD = len(MULTI_FRAME_MAGIC) + FRAME_COUNT.size
+
+# Frames uplinked through the sliding window (see uplink.py) carry a sequence number, which the
+# satellite acknowledges with an ACK frame as soon as the frame arrives. Sequence numbers start
+# again for every window, so they are qualified by the window's session id.
+SEQUENCE_MAGIC = b"MTSQ"
+ACK_MAGIC = b"MTAK"
+SEQUENCE = struct.Struct(">II")
+
+def sequence_frame(session, sequence, frame):
+    return SEQUENCE_MAGIC + SEQUENCE.pack(session, sequence) + frame
+
+def is_sequenced(data):
+    return data[:len(SEQUENCE_MAGIC)] == SEQUENCE_MAGIC
+
+def unsequence_frame(data):
+    # Returns (session, sequence, frame)
+    session, sequence = SEQUENCE.unpack_from(data, len(SEQUENCE_MAGIC))
+    return session, sequence, data[len(SEQUENCE_MAGIC) + SEQUENCE.size:]
+
+def ack_frame(session, sequence):
+    return ACK_MAGIC + SEQUENCE.pack(session, sequence)
+
+def acked_sequence(data):
+    # Returns (session, sequence)
+    if data[:len(ACK_MAGIC)] != ACK_MAGIC:
+        raise ValueError(f"Not an ACK frame: {data!r}")
+    return SEQUENCE.unpack_from(data, len(ACK_MAGIC))
+
+
+# TELEMETRY
+
+# Packed telemetry frames (see decom.py) start with a marker and the APID that selects their layout.
+TELEMETRY_MARKER = b"MTTM"
+APID = struct.Struct(">H")
+
+def telemetry_frame(apid, body):
+    return TELEMETRY_MARKER + APID.pack(apid) + body
+
+def is_telemetry(data):
+    return data[:len(TELEMETRY_MARKER)] == TELEMETRY_MARKER
+
+def split_telemetry(data):
+    # Returns (apid, body)
+    apid, = APID.unpack_from(data, len(TELEMETRY_MARKER))
+    return apid, data[len(TELEMETRY_MARKER) + APID.size:]
+
+
 # ENCRYPTION
 
 def decrypt(data):
@@ -36,12 +129,17 @@ def encrypt(data):
 
 # DATA PROCESSING
 
+# Payload (science) data is marked so it can be told apart from command responses.
+PAYLOAD_MARKER = b"MTPL"
+
 def is_payload_data(data):
-    return random.choice([True, False])
+    return bytes(data[:len(PAYLOAD_MARKER)]) == PAYLOAD_MARKER
 
 
 # ROUTING
-def send_to_data_pipeline(data):
+def send_to_data_pipeline(segment):
+    # Receives a spooled payload (see spool.py). Read it with segment.view() or segment.open()
+    # rather than copying it into memory.
     pass
 
 
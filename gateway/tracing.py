@@ -0,0 +1,137 @@
+'''
+Lightweight span tracing for the command path.
+
+When a command enters the Gateway it is given a trace id. The id is carried inside the
+encoded frame (see stubs.translate_command_to_binary), so the satellite and the response
+path can attribute their work to the same command without any shared state.
+
+Spans are appended to a JSONL file, one object per line:
+
+    {"trace": "9f0c2a...", "stage": "gateway.encode", "start": 1600000000.123, "duration": 0.000112}
+
+To print per-stage latency percentiles for a run:
+
+    python -m gateway.tracing spans.jsonl
+'''
+import argparse
+import json
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+TERMINAL_STAGE = "end_to_end"
+
+
+class Tracer:
+    def __init__(self, path=None):
+        # A tracer without a path is disabled, and every method becomes (nearly) free.
+        self.path = path
+        self.enabled = path is not None
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if self.enabled else None
+        self._commands = {}  # command_id -> (trace_id, wall clock start, perf_counter start)
+
+    def start_trace(self, command_id):
+        ''' Allocates a trace id for a command and remembers when it arrived. '''
+        if not self.enabled:
+            return None
+        trace_id = os.urandom(8).hex()
+        self._commands[str(command_id)] = (trace_id, time.time(), time.perf_counter())
+        return trace_id
+
+    def trace_for(self, command_id):
+        entry = self._commands.get(str(command_id))
+        return entry[0] if entry else None
+
+    def end_trace(self, command_id):
+        ''' Records the end-to-end span of a command once it reaches a terminal state. '''
+        entry = self._commands.pop(str(command_id), None)
+        if entry is None:
+            return
+        trace_id, start, counter = entry
+        self.record(trace_id, TERMINAL_STAGE, start, time.perf_counter() - counter)
+
+    @contextmanager
+    def span(self, trace_id, stage):
+        if not self.enabled or trace_id is None:
+            yield
+            return
+        start = time.time()
+        counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(trace_id, stage, start, time.perf_counter() - counter)
+
+    def record(self, trace_id, stage, start, duration):
+        if not self.enabled or trace_id is None:
+            return
+        line = json.dumps({"trace": trace_id, "stage": stage, "start": start, "duration": duration},
+                          separators=(",", ":"))
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            self.enabled = False
+
+
+def load_spans(path):
+    ''' Returns {stage: [durations in seconds]} for a span file. '''
+    stages = {}
+    with open(path, "r") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            span = json.loads(line)
+            stages.setdefault(span["stage"], []).append(span["duration"])
+    return stages
+
+
+def percentile(values, pct):
+    ''' Nearest-rank percentile of an already sorted list. '''
+    if not values:
+        return None
+    rank = max(0, min(len(values) - 1, math.ceil(pct / 100.0 * len(values)) - 1))
+    return values[rank]
+
+
+def summarize(stages, percentiles=(50, 90, 99)):
+    ''' Returns a list of rows: (stage, count, [percentile values...], max), all in seconds. '''
+    rows = []
+    for stage in sorted(stages):
+        durations = sorted(stages[stage])
+        rows.append((stage, len(durations), [percentile(durations, p) for p in percentiles], durations[-1]))
+    return rows
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Print per-stage latency percentiles from a span file.")
+    parser.add_argument("path", help="Span file written by the Gateway's --trace-file option.")
+    parser.add_argument(
+        "-p",
+        "--percentiles",
+        default="50,90,99",
+        help="Comma separated list of percentiles to print.")
+    args = parser.parse_args(argv)
+
+    percentiles = [float(p) for p in args.percentiles.split(",")]
+    rows = summarize(load_spans(args.path), percentiles=percentiles)
+
+    header = ["stage", "count"] + [f"p{p:g} (ms)" for p in percentiles] + ["max (ms)"]
+    print("  ".join(f"{h:>14}" if i else f"{h:<32}" for i, h in enumerate(header)))
+    for stage, count, values, maximum in rows:
+        cells = [f"{stage:<32}", f"{count:>14}"]
+        cells += [f"{v * 1000:>14.3f}" for v in values]
+        cells.append(f"{maximum * 1000:>14.3f}")
+        print("  ".join(cells))
+
+
+if __name__ == "__main__":
+    main()
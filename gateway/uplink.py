@@ -0,0 +1,121 @@
+'''
+A sliding-window uplink to one satellite.
+
+Sending a command and waiting to hear back before the next one leaves a high-latency link idle for
+a round trip per command. UplinkWindow keeps up to `window` command frames in flight at once. Each
+frame gets a sequence number (stubs.sequence_frame), which the satellite acknowledges with an ACK
+frame as soon as the frame arrives. Every window numbers its frames from 0, under a random session
+id, so a satellite that outlives one gateway doesn't take the next one's frames for copies:
+
+    uplink = UplinkWindow(send=lambda frame: satellite.process_command(bytes=frame, gateway=gateway),
+                          on_ack=..., on_give_up=...)
+    uplink.submit(encrypted, command_id)   # waits while the window is full
+    uplink.ack(sequence, session)          # from the satellite's ACK frame
+
+A frame that isn't acknowledged within `timeout` seconds is sent again, on its own (selective
+repeat), up to `max_attempts` times in all. The satellite ignores copies it has already received,
+other than acknowledging them again.
+'''
+import itertools
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from . import stubs
+from .scheduler import shared_scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class InFlight:
+    def __init__(self, sequence, frame, command_id):
+        self.sequence = sequence
+        self.frame = frame
+        self.command_id = command_id
+        self.attempts = 0
+        self.timeout_call = None
+
+
+class UplinkWindow:
+    def __init__(self, send, window=8, timeout=2.0, max_attempts=4, on_ack=None, on_give_up=None, scheduler=None):
+        self.send = send
+        self.window = window
+        self.timeout = timeout
+        self.max_attempts = max_attempts
+        self.on_ack = on_ack
+        self.on_give_up = on_give_up
+        self.scheduler = scheduler or shared_scheduler()
+        self.session = int.from_bytes(os.urandom(4), "big")
+        self.in_flight = {}  # sequence -> InFlight
+        self.sequences = itertools.count()
+        self.retransmits = 0
+        self._condition = threading.Condition()
+        # Sending can block (an in-process satellite runs the command), so retransmits don't run on the scheduler
+        self._resender = ThreadPoolExecutor(max_workers=window, thread_name_prefix="uplink-retransmit")
+
+    def submit(self, frame, command_id):
+        ''' Sends a command frame once there is room in the window. Returns its sequence number. '''
+        with self._condition:
+            self._condition.wait_for(lambda: len(self.in_flight) < self.window)
+            sequence = next(self.sequences) % (1 << 32)
+            entry = self.in_flight[sequence] = InFlight(
+                sequence, stubs.sequence_frame(self.session, sequence, frame), command_id)
+        self._transmit(entry)
+        return sequence
+
+    def _transmit(self, entry):
+        with self._condition:
+            if self.in_flight.get(entry.sequence) is not entry:
+                return
+            entry.attempts += 1
+            entry.timeout_call = self.scheduler.call_later(self.timeout, self._expire, entry.sequence)
+        self.send(entry.frame)
+
+    def ack(self, sequence, session=None):
+        ''' Handles the satellite's ACK. Late or repeated ACKs, and ACKs for other sessions, are ignored. '''
+        entry = self.discard(sequence, session)
+        if entry is not None and self.on_ack is not None:
+            self.on_ack(entry.command_id)
+
+    def discard(self, sequence, session=None):
+        ''' Stops waiting for a frame's ACK. Returns its InFlight entry, or None if it wasn't in flight. '''
+        if session is not None and session != self.session:
+            return None
+        with self._condition:
+            entry = self.in_flight.pop(sequence, None)
+            if entry is None:
+                return None
+            entry.timeout_call.cancel()
+            self._condition.notify()
+        return entry
+
+    def _expire(self, sequence):
+        with self._condition:
+            entry = self.in_flight.get(sequence)
+            if entry is None:
+                return
+            if entry.attempts >= self.max_attempts:
+                del self.in_flight[sequence]
+                self._condition.notify()
+                give_up = True
+            else:
+                self.retransmits += 1
+                give_up = False
+        if give_up:
+            logger.warning(f"No ACK for command {entry.command_id} after {entry.attempts} attempts")
+            if self.on_give_up is not None:
+                self._resender.submit(self.on_give_up, entry.command_id, entry.attempts)
+        else:
+            logger.info("Retransmitting command %s (sequence %s)", entry.command_id, sequence)
+            self._resender.submit(self._retransmit, entry)
+
+    def _retransmit(self, entry):
+        try:
+            self._transmit(entry)
+        except Exception:
+            logger.exception(f"Retransmitting command {entry.command_id} failed")
+
+    def outstanding(self):
+        with self._condition:
+            return len(self.in_flight)
@@ -0,0 +1,147 @@
+'''
+Command field validation compiled from command definitions.
+
+The definitions sent to Major Tom (satellite/example_commands.json, DemoSat.definitions) already
+describe each field's type, range and default. CommandValidator turns them, once, into a small
+check function per command, so a bad command can be rejected before it is packetized or sent
+anywhere:
+
+    validator = CommandValidator(definitions)
+    errors = validator.validate(command)  # None, or a list of error strings
+
+Supported field properties:
+  - "type": "string"/"text", "integer", "number"/"float", "boolean". Other types are not type checked.
+  - "range": a list of allowed values, or [min, max] for numeric types.
+  - "default": filled into the command when the field is missing.
+'''
+
+TYPE_NAMES = {
+    "string": "a string",
+    "text": "a string",
+    "integer": "an int",
+    "number": "a number",
+    "float": "a number",
+    "boolean": "a boolean",
+}
+
+NUMERIC_TYPES = ("integer", "number", "float")
+
+
+def _is_string(value):
+    return isinstance(value, str)
+
+
+def _is_integer(value):
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value):
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _is_boolean(value):
+    return isinstance(value, bool)
+
+
+TYPE_CHECKS = {
+    "string": _is_string,
+    "text": _is_string,
+    "integer": _is_integer,
+    "number": _is_number,
+    "float": _is_number,
+    "boolean": _is_boolean,
+}
+
+
+def compile_field(field):
+    ''' Returns check(value) -> error string or None, for a single field definition. '''
+    name = field["name"]
+    field_type = field.get("type")
+    value_range = field.get("range")
+    type_check = TYPE_CHECKS.get(field_type)
+
+    checks = []
+    if type_check is not None:
+        type_name = TYPE_NAMES[field_type]
+
+        def check_type(value):
+            if not type_check(value):
+                return f"{name} type is invalid. Must be {type_name}. Type: {type(value)}"
+        checks.append(check_type)
+
+    if value_range:
+        if field_type in NUMERIC_TYPES and len(value_range) == 2 and all(_is_number(v) for v in value_range):
+            minimum, maximum = value_range
+
+            def check_range(value):
+                if not minimum <= value <= maximum:
+                    return f"{name} is out of range. Must be between {minimum} and {maximum}. Value: {value}"
+        else:
+            allowed = frozenset(value_range)
+            allowed_text = ", ".join(str(v) for v in value_range)
+
+            def check_range(value):
+                if value not in allowed:
+                    return f"{name} is invalid. Must be one of: {allowed_text}. Value: {value}"
+        checks.append(check_range)
+
+    if not checks:
+        return None
+    if len(checks) == 1:
+        return checks[0]
+
+    def check(value):
+        # The range check assumes the type check passed
+        for c in checks:
+            error = c(value)
+            if error:
+                return error
+    return check
+
+
+def compile_command(definition):
+    ''' Returns check(command) -> list of errors or None, for a single command definition. '''
+    required = []
+    defaults = []
+    field_checks = []
+    for field in definition.get("fields", []):
+        name = field["name"]
+        if "default" in field:
+            defaults.append((name, field["default"]))
+        else:
+            required.append(name)
+        check = compile_field(field)
+        if check is not None:
+            field_checks.append((name, check))
+
+    def check(command):
+        fields = command.fields
+        for name, default in defaults:
+            if name not in fields:
+                fields[name] = default
+                # Keep the raw command in sync so the default survives encoding
+                command.json_command.setdefault("fields", []).append({"name": name, "value": default})
+        errors = [f"{name} is required." for name in required if name not in fields]
+        for name, field_check in field_checks:
+            if name in fields:
+                error = field_check(fields[name])
+                if error:
+                    errors.append(error)
+        return errors or None
+    return check
+
+
+class CommandValidator:
+    def __init__(self, definitions=None):
+        self.checks = {name: compile_command(definition) for name, definition in (definitions or {}).items()}
+
+    def validate(self, command):
+        '''
+        Fills in defaults and checks a command's fields against its definition.
+        Returns a list of errors if any are found, otherwise None.
+        Commands without a definition are left to whatever handles unknown commands.
+        '''
+        check = self.checks.get(command.type)
+        if check is None:
+            return None
+        return check(command)
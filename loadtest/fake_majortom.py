@@ -0,0 +1,173 @@
+'''
+A local stand-in for Major Tom's Gateway API.
+
+It accepts a single gateway connection, speaks the same websocket messages as Major Tom
+(see majortom_gateway.GatewayAPI), and keeps track of everything the gateway sends back.
+Staged files for `uplink_file` are served over plain HTTP on the same port.
+'''
+import asyncio
+import copy
+import json
+import logging
+import time
+import websockets
+
+from gateway.statuses import TERMINAL_STATUSES
+
+logger = logging.getLogger(__name__)
+
+STAGED_FILE_PREFIX = "/gateway_api/v1.0/staged_files/"
+
+
+class FakeMajorTom:
+    def __init__(self, host="127.0.0.1", port=0, mission="Load Test"):
+        self.host = host
+        self.port = port
+        self.mission = mission
+        self.server = None
+        self.websocket = None
+        self.connected = asyncio.Event()
+        self.next_command_id = 1
+        self.replayed_ids = {}  # recorded command id -> the id it was replayed with
+        self.staged_files = {}  # path -> (filename, content)
+
+        # Everything the gateway has told us
+        self.message_counts = {}
+        self.measurement_count = 0
+        self.event_count = 0
+        self.sent = {}  # command_id -> (type, monotonic time sent)
+        self.finished = {}  # command_id -> (state, monotonic time of the first terminal state)
+        self.cancels_sent = 0
+        self._terminal_states = {status.value for status in TERMINAL_STATUSES}
+        self._finished_changed = asyncio.Event()
+
+    @property
+    def address(self):
+        return f"{self.host}:{self.port}"
+
+    async def start(self):
+        self.server = await websockets.serve(
+            self._handler, self.host, self.port, process_request=self._process_request)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Fake Major Tom listening on %s", self.address)
+        return self
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+
+    def stage_file(self, filename, content):
+        ''' Makes a file available to `download_staged_file`. Returns its gateway_download_path. '''
+        path = STAGED_FILE_PREFIX + filename
+        self.staged_files[path] = (filename, content)
+        return path
+
+    async def wait_for_gateway(self, timeout=10):
+        await asyncio.wait_for(self.connected.wait(), timeout)
+
+    async def send(self, message):
+        await self.websocket.send(json.dumps(message))
+
+    async def send_command(self, command_type, system, fields=None):
+        command_id = self.next_command_id
+        self.next_command_id += 1
+        self.sent[command_id] = (command_type, time.monotonic())
+        await self.send({
+            "type": "command",
+            "command": {
+                "id": command_id,
+                "type": command_type,
+                "system": system,
+                "fields": [{"name": name, "value": value} for name, value in (fields or {}).items()]
+            }
+        })
+        return command_id
+
+    async def send_recorded(self, message):
+        '''
+        Sends a message from a recorded session (see gateway/recorder.py), tracking it like any other.
+        Commands and cancels are given ids of this server's own, so recorded ids can't collide with
+        commands it sent itself, such as the harness's warm-up ping.
+        '''
+        if message["type"] in ("command", "cancel"):
+            message = copy.deepcopy(message)
+            message["command"]["id"] = self._replayed_id(message["command"]["id"])
+        if message["type"] == "command":
+            self.sent[message["command"]["id"]] = (message["command"]["type"], time.monotonic())
+        elif message["type"] == "cancel":
+            self.cancels_sent += 1
+        await self.send(message)
+
+    def _replayed_id(self, recorded_id):
+        if recorded_id not in self.replayed_ids:
+            self.replayed_ids[recorded_id] = self.next_command_id
+            self.next_command_id += 1
+        return self.replayed_ids[recorded_id]
+
+    async def send_cancel(self, command_id):
+        self.cancels_sent += 1
+        await self.send({"type": "cancel", "command": {"id": command_id}})
+
+    def reset_stats(self):
+        self.message_counts = {}
+        self.measurement_count = 0
+        self.event_count = 0
+        self.sent = {}
+        self.finished = {}
+        self.cancels_sent = 0
+
+    def outstanding(self):
+        return [command_id for command_id in self.sent if command_id not in self.finished]
+
+    async def wait_until_finished(self, timeout):
+        ''' Waits for every sent command to reach a terminal state, or for the timeout to expire. '''
+        deadline = time.monotonic() + timeout
+        while self.outstanding():
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            self._finished_changed.clear()
+            try:
+                await asyncio.wait_for(self._finished_changed.wait(), remaining)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def _process_request(self, path, request_headers):
+        if path.startswith(STAGED_FILE_PREFIX):
+            if path not in self.staged_files:
+                return 404, [], b"Not Found"
+            filename, content = self.staged_files[path]
+            return 200, [
+                ("Content-Disposition", f'attachment; filename="{filename}";'),
+                ("Content-Type", "binary/octet-stream"),
+            ], content
+        return None
+
+    async def _handler(self, websocket, path=None):
+        self.websocket = websocket
+        await websocket.send(json.dumps({"type": "hello", "hello": {"mission": self.mission}}))
+        self.connected.set()
+        try:
+            async for raw in websocket:
+                self.handle_message(json.loads(raw))
+        except websockets.ConnectionClosed:
+            pass
+        finally:
+            self.connected.clear()
+
+    def handle_message(self, message):
+        message_type = message["type"]
+        self.message_counts[message_type] = self.message_counts.get(message_type, 0) + 1
+
+        if message_type == "command_update":
+            command = message["command"]
+            if command["state"] in self._terminal_states and command["id"] not in self.finished:
+                self.finished[command["id"]] = (command["state"], time.monotonic())
+                self._finished_changed.set()
+        elif message_type == "measurements":
+            self.measurement_count += len(message["measurements"])
+        elif message_type == "events":
+            self.event_count += len(message["events"])
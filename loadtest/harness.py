@@ -0,0 +1,214 @@
+'''
+Drives a command mix against a gateway connected to a FakeMajorTom and reports how it kept up.
+
+The gateway is wired exactly as run.py wires it (see run.setup_sync and run.setup_async),
+so the numbers cover the websocket library, the callbacks and the (fake) satellite.
+'''
+import argparse
+import asyncio
+import contextlib
+import logging
+import os
+import random
+import tempfile
+import time
+
+import run
+from gateway.tracing import percentile
+from loadtest.fake_majortom import FakeMajorTom
+
+logger = logging.getLogger(__name__)
+
+SYSTEMS = {
+    "sync": "Example FlatSat",
+    "async": "Space Oddity",
+}
+
+DEFAULT_MIX = {"ping": 1}
+
+# Commands that can be sent in a mix. "cancel" is special: it cancels a command that is still
+# running, or an unknown command if nothing is in flight.
+COMMAND_TYPES = ("ping", "telemetry", "update_file_list", "uplink_file", "cancel")
+
+
+def parse_mix(text):
+    ''' Parses "ping=8,telemetry=1,cancel=1" into {"ping": 8, "telemetry": 1, "cancel": 1} '''
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in COMMAND_TYPES:
+            raise ValueError(f"Unknown command type in mix: {name}. Must be one of {', '.join(COMMAND_TYPES)}")
+        mix[name] = float(weight) if weight else 1.0
+    return mix
+
+
+class LoadReport:
+    def __init__(self, mode, duration, server):
+        self.mode = mode
+        self.duration = duration
+        self.sent = len(server.sent)
+        self.cancels_sent = server.cancels_sent
+        self.message_counts = dict(server.message_counts)
+        self.measurement_count = server.measurement_count
+        self.event_count = server.event_count
+        self.states = {}
+        self.latencies = {}  # command type -> sorted latencies in seconds
+        for command_id, (command_type, sent_at) in server.sent.items():
+            if command_id not in server.finished:
+                continue
+            state, finished_at = server.finished[command_id]
+            self.states[state] = self.states.get(state, 0) + 1
+            self.latencies.setdefault(command_type, []).append(finished_at - sent_at)
+        for values in self.latencies.values():
+            values.sort()
+        self.finished = sum(self.states.values())
+        self.unfinished = self.sent - self.finished
+
+    @property
+    def throughput(self):
+        ''' Commands brought to a terminal state per second of load. '''
+        return self.finished / self.duration if self.duration else 0.0
+
+    def percentile(self, pct, command_type=None):
+        if command_type is None:
+            values = sorted(v for latencies in self.latencies.values() for v in latencies)
+        else:
+            values = self.latencies.get(command_type, [])
+        return percentile(values, pct)
+
+    def format(self):
+        lines = [
+            f"Mode: {self.mode}  Duration: {self.duration:.1f}s",
+            f"Commands sent: {self.sent}  finished: {self.finished}  unfinished: {self.unfinished}  cancels sent: {self.cancels_sent}",
+            f"Throughput: {self.throughput:.1f} commands/s",
+            f"Final states: {self.states}",
+            f"Messages from gateway: {self.message_counts}",
+            f"Measurements: {self.measurement_count}  Events: {self.event_count}",
+            "Latency (ms):",
+        ]
+        for command_type in sorted(self.latencies):
+            values = self.latencies[command_type]
+            lines.append("  {:<20} n={:<6} p50={:>9.1f} p90={:>9.1f} p99={:>9.1f} max={:>9.1f}".format(
+                command_type, len(values),
+                percentile(values, 50) * 1000, percentile(values, 90) * 1000,
+                percentile(values, 99) * 1000, values[-1] * 1000))
+        return "\n".join(lines)
+
+
+def build_gateway(mode, address, scratch, satellite=None, link=None):
+    '''
+    Wires a gateway the same way run.py does, pointed at the fake server. Returns the GatewayAPI.
+    Files the gateway keeps go in the `scratch` directory. The sync gateway can talk to a satellite
+    in another process at the `satellite` address, and through an emulated `link` (see
+    gateway/link_emulator.py).
+    '''
+    args = argparse.Namespace(
+        majortomhost=address, gatewaytoken="load-test", basicauth=None, http=True, trace_file=None,
+        file_catalog=None, downlink_cache=os.path.join(scratch, "downlink_cache"), downlink_cache_quota=1024,
+        lane_rates=None, record=None, archive=None,
+        satellite=satellite, link=link, uplink_window=8, uplink_timeout=2.0)
+    if mode == "sync":
+        gateway, websocket_connection, _ = run.setup_sync(args)
+        if satellite:
+            asyncio.ensure_future(gateway.satellite.connect())
+    elif mode == "async":
+        _, websocket_connection = run.setup_async(args)
+    else:
+        raise ValueError(f"Mode must be sync or async, not {mode}")
+    return websocket_connection
+
+
+def command_fields(command_type, server):
+    if command_type == "telemetry":
+        return {"mode": "NOMINAL", "duration": 1}
+    if command_type == "uplink_file":
+        return {"gateway_download_path": server.stage_file("loadtest-uplink.bin", b"\x00" * 1024)}
+    return {}
+
+
+@contextlib.asynccontextmanager
+async def connected_gateway(mode, warm_up_timeout=10.0, satellite=None, link=None):
+    ''' Starts a FakeMajorTom with a freshly wired gateway connected to it, and yields the server. '''
+    server = await FakeMajorTom().start()
+    scratch = tempfile.TemporaryDirectory(prefix="loadtest-")
+    api = build_gateway(mode, server.address, scratch.name, satellite, link)
+    connection = asyncio.ensure_future(api.connect_with_retries())
+    try:
+        await server.wait_for_gateway()
+
+        # The gateway library waits a moment after connecting before it reads any messages.
+        # A warm-up ping keeps that pause (and the definitions upload) out of the numbers.
+        await server.send_command("ping", SYSTEMS[mode])
+        await server.wait_until_finished(warm_up_timeout)
+        server.reset_stats()
+        yield server
+    finally:
+        api.shutdown_intended = True
+        await server.stop()
+        connection.cancel()
+        try:
+            await connection
+        except BaseException:
+            pass
+        scratch.cleanup()
+
+
+async def run_load(mode="sync", mix=None, rate=10.0, duration=5.0, drain=10.0, seed=None, satellite=None, link=None):
+    ''' Runs a load against a freshly wired gateway and returns a LoadReport. '''
+    mix = mix or DEFAULT_MIX
+    rng = random.Random(seed)
+    names = list(mix)
+    weights = [mix[name] for name in names]
+    system = SYSTEMS[mode]
+
+    async with connected_gateway(mode, warm_up_timeout=drain, satellite=satellite, link=link) as server:
+        total = int(rate * duration)
+        start = time.monotonic()
+        for i in range(total):
+            delay = start + i / rate - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            command_type = rng.choices(names, weights)[0]
+            if command_type == "cancel":
+                in_flight = server.outstanding()
+                target = rng.choice(in_flight) if in_flight else server.next_command_id + 1000000
+                await server.send_cancel(target)
+            else:
+                await server.send_command(command_type, system, command_fields(command_type, server))
+        elapsed = max(time.monotonic() - start, duration)
+
+        await server.wait_until_finished(drain)
+        return LoadReport(mode, elapsed, server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive a command mix against a gateway connected to a fake Major Tom.")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="Which gateway to run.")
+    parser.add_argument("--mix", default="ping=1", help='Weighted command mix, for example "ping=8,telemetry=1,cancel=1".')
+    parser.add_argument("--rate", type=float, default=10.0, help="Target commands per second.")
+    parser.add_argument("--duration", type=float, default=10.0, help="Seconds to generate load for.")
+    parser.add_argument("--drain", type=float, default=30.0, help="Seconds to wait for outstanding commands afterwards.")
+    parser.add_argument("--seed", type=int, default=None, help="Random seed for the command mix.")
+    parser.add_argument(
+        "--satellite",
+        help="Sync mode only. Address of a satellite started with `python -m satellite.server`, to load the socket link too.")
+    parser.add_argument(
+        "--link",
+        help='Sync mode only. Emulated RF link to the satellite, for example "bandwidth=9600,delay=0.25,loss=0.01".')
+    parser.add_argument(
+        '-l',
+        '--loglevel',
+        choices=["debug", "info", "error"],
+        default="error",
+        help='Log level for the logger.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=getattr(logging, args.loglevel.upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    report = asyncio.run(run_load(
+        mode=args.mode, mix=parse_mix(args.mix), rate=args.rate,
+        duration=args.duration, drain=args.drain, seed=args.seed, satellite=args.satellite, link=args.link))
+    print(report.format())
@@ -0,0 +1,144 @@
+'''
+A local stand-in for the HTTP side of Major Tom and its file bucket.
+
+It serves the endpoints the file transfer paths use, with keep-alive (HTTP/1.1), so tests and
+benchmarks can exercise gateway/http_client.py without the network:
+
+  GET  /files/<size>                              `size` bytes, honoring Range requests
+  GET  /gateway_api/v1.0/staged_files/<name>      a staged file, as download_staged_file expects
+  POST /rails/active_storage/direct_uploads       hands out an upload URL
+  PUT  /bucket/<key>                              stores an uploaded file
+  POST /gateway_api/v1.0/downlinked_files         records the uploaded file's details
+
+`fail_next` makes the next N requests return 503, to exercise retries. `latency` delays every
+response, standing in for the round trip to a real server.
+'''
+import http.server
+import json
+import threading
+import time
+from urllib.parse import parse_qs
+
+STAGED_FILE_PREFIX = "/gateway_api/v1.0/staged_files/"
+
+
+class HttpStandIn:
+    def __init__(self, host="127.0.0.1", port=0, latency=0):
+        self.latency = latency
+        self.fail_next = 0
+        self.requests = 0
+        self.connections = 0
+        self.uploads = {}  # key -> bytes
+        self.downlinked_files = []
+        self._lock = threading.Lock()
+        self.server = http.server.ThreadingHTTPServer((host, port), self._handler_class())
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return f"{host}:{port}"
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, args=(0.05,), name="http-standin", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _should_fail(self):
+        with self._lock:
+            self.requests += 1
+            if self.fail_next > 0:
+                self.fail_next -= 1
+                return True
+        return False
+
+    def _handler_class(self):
+        standin = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with standin._lock:
+                    standin.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, body=b"", headers=None):
+                self.send_response(status)
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def _body(self):
+                return self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+            def _start(self):
+                body = self._body()
+                if standin.latency:
+                    time.sleep(standin.latency)
+                if standin._should_fail():
+                    self._reply(503)
+                    return None
+                return body
+
+            def do_GET(self):
+                if self._start() is None:
+                    return
+                if self.path.startswith("/files/"):
+                    content = bytes(i % 256 for i in range(int(self.path[len("/files/"):])))
+                    requested = self.headers.get("Range")
+                    if requested:
+                        start = int(requested[len("bytes="):].split("-")[0])
+                        self._reply(206, content[start:], {"Content-Type": "application/octet-stream"})
+                    else:
+                        self._reply(200, content, {"Content-Type": "application/octet-stream"})
+                elif self.path.startswith(STAGED_FILE_PREFIX):
+                    name = self.path[len(STAGED_FILE_PREFIX):]
+                    self._reply(200, f"staged {name}".encode(), {
+                        "Content-Disposition": f'attachment; filename="{name}"; filename*=UTF-8\'\'{name}'})
+                else:
+                    self._reply(404)
+
+            def do_PUT(self):
+                body = self._start()
+                if body is None:
+                    return
+                with standin._lock:
+                    standin.uploads[self.path[len("/bucket/"):]] = body
+                self._reply(200)
+
+            def do_POST(self):
+                body = self._start()
+                if body is None:
+                    return
+                if self.path == "/rails/active_storage/direct_uploads":
+                    request = parse_qs(body.decode())
+                    key = request["filename"][0]
+                    self._reply(200, json.dumps({
+                        "signed_id": f"signed-{key}",
+                        "direct_upload": {"url": f"{standin.url}/bucket/{key}"}
+                    }).encode(), {"Content-Type": "application/json"})
+                elif self.path == "/gateway_api/v1.0/downlinked_files":
+                    with standin._lock:
+                        standin.downlinked_files.append(json.loads(body))
+                    self._reply(200, b"{}", {"Content-Type": "application/json"})
+                else:
+                    self._reply(404)
+
+        return Handler
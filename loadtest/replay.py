@@ -0,0 +1,84 @@
+'''
+Replays a recorded Major Tom session (see gateway/recorder.py) against a gateway connected to a
+FakeMajorTom, at the recorded pace, N times faster, or as fast as possible:
+
+    python -m loadtest.replay session.jsonl --mode sync --speed 10
+    python -m loadtest.replay session.jsonl --mode async --speed max
+
+The report is the same as the load test's, so runs of different builds can be compared directly.
+'''
+import argparse
+import asyncio
+import copy
+import logging
+import time
+
+from gateway.recorder import load_session
+from loadtest.harness import LoadReport, connected_gateway
+
+logger = logging.getLogger(__name__)
+
+
+def parse_speed(text):
+    ''' "1", "10", "2.5" or "max". Returns None for max. '''
+    if text == "max":
+        return None
+    speed = float(text)
+    if speed <= 0:
+        raise ValueError("Speed must be positive, or max")
+    return speed
+
+
+def retarget(message, system):
+    ''' Points a recorded command at another system, so a session can be replayed on either gateway. '''
+    if system is None or message["type"] != "command":
+        return message
+    message = copy.deepcopy(message)
+    message["command"]["system"] = system
+    return message
+
+
+async def replay(session, mode="sync", speed=1.0, drain=10.0, system=None):
+    ''' Replays [(timestamp, message)] against a freshly wired gateway and returns a LoadReport. '''
+    async with connected_gateway(mode, warm_up_timeout=drain) as server:
+        start = time.monotonic()
+        first = session[0][0] if session else 0
+        for timestamp, message in session:
+            if speed is not None:
+                delay = start + (timestamp - first) / speed - time.monotonic()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            await server.send_recorded(retarget(message, system))
+        elapsed = time.monotonic() - start
+
+        await server.wait_until_finished(drain)
+        return LoadReport(mode, elapsed, server)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Replay a recorded Major Tom session against a gateway.")
+    parser.add_argument("session", help="A session file written by run.py --record.")
+    parser.add_argument("--mode", choices=["sync", "async"], default="sync", help="Which gateway to run.")
+    parser.add_argument("--speed", type=parse_speed, default=1.0, help='How much faster than recorded to replay, or "max".')
+    parser.add_argument("--drain", type=float, default=30.0, help="Seconds to wait for outstanding commands afterwards.")
+    parser.add_argument("--system", default=None, help="Send every recorded command to this system instead.")
+    parser.add_argument(
+        '-l',
+        '--loglevel',
+        choices=["debug", "info", "error"],
+        default="error",
+        help='Log level for the logger.')
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(
+        level=getattr(logging, args.loglevel.upper()),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    session = load_session(args.session)
+    print(f"Replaying {len(session)} messages from {args.session}")
+    report = asyncio.run(replay(session, mode=args.mode, speed=args.speed, drain=args.drain, system=args.system))
+    print(report.format())
+
+
+if __name__ == '__main__':
+    main()
@@ -1,10 +1,10 @@
 import logging
 import asyncio
 import argparse
-import json
-from gateway.gateway import Gateway
-from demo.demo_sat import DemoSat
-from majortom_gateway import GatewayAPI
+import atexit
+
+# The gateway, demo satellite and Major Tom packages are imported inside the functions that use them,
+# so that only the selected mode's dependencies are loaded (and `-h` loads none of them).
 
 logger = logging.getLogger(__name__)
 
@@ -28,8 +28,18 @@ def parse_args():
         '-l',
         '--loglevel',
         choices=["debug", "info", "error"],
-        default="debug",
+        default="info",
         help='Log level for the logger.')
+    parser.add_argument(
+        '--log-format',
+        choices=["text", "json"],
+        default="text",
+        help='Log as text, or as one JSON object a line.')
+    parser.add_argument(
+        '--log-sample-rate',
+        type=float,
+        default=20,
+        help="Records each logger may log a second for the same message, at info and debug. The rest are counted and dropped. Set to 0 to log everything.")
     parser.add_argument(
         '--http',
         help="If included, you can instruct the gateway to connect without encryption. This is to support on prem deployments and local development without https.",
@@ -40,62 +50,199 @@ def parse_args():
 
         help="If included, we use the original demo_sat.py gateway file instead of gateway.py. ",
         action="store_true")
+    parser.add_argument(
+        '--stall-threshold',
+        type=float,
+        default=0.25,
+        help="Async gateway only. Seconds the event loop may be blocked before the stall is reported to Major Tom with the offending stack. Set to 0 to disable the watchdog.")
+    parser.add_argument(
+        '--definitions-cache',
+        default=".definitions_cache.json",
+        help="File that remembers which command definitions were already sent to Major Tom, so unchanged definitions are not re-sent on every start.")
+    parser.add_argument(
+        '--force-definitions',
+        help="If included, command definitions are sent to Major Tom even if they haven't changed since the last start.",
+        action="store_true")
+    parser.add_argument(
+        '--file-catalog',
+        default=".file_catalog.jsonl",
+        help="File that keeps the satellite's file list, and which files were already sent to Major Tom, between restarts. The satellite's name is added before the extension, so each system keeps its own.")
+    parser.add_argument(
+        '--downlink-cache',
+        default=".downlink_cache",
+        help="Async gateway only. Directory that keeps downlinked files by content hash, so interrupted downlinks resume and repeated files aren't downlinked or uploaded again.")
+    parser.add_argument(
+        '--downlink-cache-quota',
+        type=int,
+        default=1024,
+        help="Async gateway only. Megabytes the downlink cache may use before the least recently used files are evicted.")
+    parser.add_argument(
+        '--satellite',
+        help='Sync gateway only. If included, the gateway talks to a satellite running in another process (`python -m satellite.server ADDRESS`) at this address, "unix:/path/to.sock" or "host:port", instead of one in its own process.')
+    parser.add_argument(
+        '--link',
+        help='Sync gateway only. If included, frames to and from the satellite go through an emulated RF link, for example "bandwidth=9600,delay=0.25,jitter=0.05,loss=0.01,corruption=0.001,pass=600/120". See gateway/link_emulator.py')
+    parser.add_argument(
+        '--uplink-window',
+        type=int,
+        default=8,
+        help="Sync gateway only. Commands that may be on their way to the satellite, not yet acknowledged, at once.")
+    parser.add_argument(
+        '--uplink-timeout',
+        type=float,
+        default=2.0,
+        help="Sync gateway only. Seconds to wait for the satellite to acknowledge a command before sending it again.")
+    parser.add_argument(
+        '--lane-rates',
+        help='If included, limits what each outbound lane may send to Major Tom, in messages a second, for example "metrics=50,bulk=5". Lanes are command, events, metrics and bulk. See gateway/outbound.py')
+    parser.add_argument(
+        '--archive',
+        help="If included, every metric and command state sent to Major Tom is also kept in columnar files under this directory, partitioned by day and system. See gateway/archive.py")
+    parser.add_argument(
+        '--record',
+        help="If included, every command, cancel, blob and transit message from Major Tom is appended to this file, to be replayed later with `python -m loadtest.replay FILE`.")
+    parser.add_argument(
+        '--trace-file',
+        help="If included, the sync gateway writes per-stage command latency spans to this file. Summarize them with `python -m gateway.tracing FILE`.")
     
     return parser.parse_args()
 
 def configure_logging(args):
-    if args.loglevel == 'error':
-        logging.basicConfig(
-            level=logging.ERROR,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    elif args.loglevel == 'info':
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    elif args.loglevel == 'debug':
-        logging.basicConfig(
-            level=logging.DEBUG,
-            format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    else:
-        raise Exception(f"Invalid log level: {args.loglevel}")
+    ''' Logs through a queue, so formatting and writing happen on their own thread. See gateway/logs.py '''
+    from gateway.logs import configure_logging as configure
 
-def run_async(args):
-    logger.info("Starting up!")
-    loop = asyncio.get_event_loop()
+    return configure(
+        level=getattr(logging, args.loglevel.upper()),
+        json_output=args.log_format == "json",
+        sample_rate=args.log_sample_rate)
+
+def lane_rates(args):
+    ''' Per-lane rate limits for the OutboundScheduler from --lane-rates. '''
+    if not args.lane_rates:
+        return None
+    from gateway.outbound import parse_rates
+
+    return parse_rates(args.lane_rates)
+
+def recorded(args, **callbacks):
+    ''' Wraps the GatewayAPI callbacks in a session recorder when --record is given. '''
+    if not args.record:
+        return callbacks
+    from gateway.recorder import SessionRecorder
+
+    logger.info("Recording the session to %s", args.record)
+    recorder = SessionRecorder(args.record)
+    atexit.register(recorder.close)
+    return recorder.wrap_callbacks(**callbacks)
+
+def archive(args, api, system):
+    ''' Keeps what `api` sends to Major Tom in a local archive when --archive is given. '''
+    if not args.archive:
+        return None
+    from gateway.archive import TelemetryArchive
+
+    logger.info("Archiving metrics and command states to %s", args.archive)
+    telemetry_archive = TelemetryArchive(args.archive, system=system)
+    telemetry_archive.install(api)
+    # Writes whatever is still buffered
+    atexit.register(telemetry_archive.close)
+    return telemetry_archive
+
+def setup_async(args):
+    ''' Builds the Demo Satellite and its websocket connection without starting anything. '''
+    from demo.demo_sat import DemoSat
+    from gateway.events import EventPipeline
+    from gateway.outbound import OutboundScheduler
+    from majortom_gateway import GatewayAPI
 
     logger.debug("Setting up Demo Satellite")
-    demo_sat = DemoSat(name="Space Oddity")
+    demo_sat = DemoSat(
+        name="Space Oddity",
+        file_catalog_path=args.file_catalog,
+        downlink_cache_path=args.downlink_cache,
+        downlink_cache_quota=args.downlink_cache_quota * 1024 * 1024)
 
     logger.debug("Setting up MajorTom")
+    outbound = OutboundScheduler(system=demo_sat.name, rates=lane_rates(args))
     gateway = GatewayAPI(
         host=args.majortomhost,
         gateway_token=args.gatewaytoken,
         basic_auth=args.basicauth,
-        command_callback=demo_sat.command_callback,
-        cancel_callback=demo_sat.cancel_callback,
-        http=args.http)
+        http=args.http,
+        **recorded(
+            args,
+            command_callback=demo_sat.command_callback,
+            cancel_callback=demo_sat.cancel_callback,
+            rate_limit_callback=outbound.rate_limit_callback))
+    # Command statuses go out ahead of telemetry and file lists. See gateway/outbound.py
+    outbound.install(gateway)
+    # Repeated events are aggregated and event storms rate limited. See gateway/events.py
+    EventPipeline().install(gateway)
+    archive(args, gateway, system=demo_sat.name)
+
+    return demo_sat, gateway
+
+def run_async(args):
+    from gateway.definitions_cache import DefinitionsCache, push_definitions
+
+    logger.info("Starting up!")
+    loop = asyncio.get_event_loop()
+
+    demo_sat, gateway = setup_async(args)
 
     logger.debug("Connecting to MajorTom")
     asyncio.ensure_future(gateway.connect_with_retries())
 
     logger.debug("Sending Command Definitions")
-    asyncio.ensure_future(gateway.update_command_definitions(
+    asyncio.ensure_future(push_definitions(
+        api=gateway,
         system=demo_sat.name,
-        definitions=demo_sat.definitions))
+        definitions=demo_sat.definitions,
+        cache=DefinitionsCache(args.definitions_cache),
+        force=args.force_definitions))
+
+    if args.stall_threshold > 0:
+        from demo.watchdog import LoopWatchdog
+        logger.debug("Starting Event Loop Watchdog")
+        watchdog = LoopWatchdog(system=demo_sat.name, gateway=gateway, threshold=args.stall_threshold)
+        watchdog.start()
 
     logger.debug("Starting Event Loop")
     loop.run_forever()
 
-def run_sync(args):
-    logger.debug("Starting Event Loop")
-    loop = asyncio.get_event_loop()
+def setup_sync(args):
+    ''' Builds the Gateway and its websocket connection without starting anything. '''
+    from gateway.events import EventPipeline
+    from gateway.gateway import Gateway
+    from gateway.outbound import OutboundScheduler
+    from gateway.tracing import Tracer
+    from majortom_gateway import GatewayAPI
+    from satellite.satellite import load_command_definitions
 
     # Gateways are the link between the generic interfaces of Major Tom and the specifics of your
     # satellite(s) and groundstation(s). They can be designed to handle one or more satellites and 
     # one or more groundstations.    
 
+    # To make it easier to interact with this Gateway, we are going to configure a bunch of commands for a satellite
+    # called "Example FlatSat". Please see the associated json file to see the list of commands.
+    logger.debug("Setting up Example Flatsat satellite and associated commands")
+    definitions = load_command_definitions()
+
+    satellite = None
+    if args.satellite:
+        from gateway.satellite_link import RemoteSatellite
+        logger.debug("Linking to the satellite at %s", args.satellite)
+        satellite = RemoteSatellite(args.satellite, loop=asyncio.get_event_loop())
+
     logger.debug("Setting up Gateway")
-    gateway = Gateway()
+    gateway = Gateway(
+        tracer=Tracer(args.trace_file),
+        loop=asyncio.get_event_loop(),
+        definitions=definitions,
+        file_catalog_path=args.file_catalog,
+        satellite=satellite,
+        uplink_window=args.uplink_window,
+        uplink_timeout=args.uplink_timeout)
 
     # Gateways use a websocket API, and we have a library to make the interface easier.
     # We instantiate the API, making sure to specify both sides of the connection:
@@ -108,34 +255,62 @@ def run_sync(args):
                             basic_auth=args.basicauth,
                             http=args.http,
 
-                            command_callback=gateway.command_callback,
-                            error_callback=gateway.error_callback,
-                            rate_limit_callback=gateway.rate_limit_callback,
-                            cancel_callback=gateway.cancel_callback,
-                            transit_callback=gateway.transit_callback,
-                            received_blob_callback=gateway.received_blob_callback,
+                            **recorded(
+                                args,
+                                command_callback=gateway.command_callback,
+                                error_callback=gateway.error_callback,
+                                rate_limit_callback=gateway.rate_limit_callback,
+                                cancel_callback=gateway.cancel_callback,
+                                transit_callback=gateway.transit_callback,
+                                received_blob_callback=gateway.received_blob_callback,
+                            )
                         )
     
     # It is useful to have a reference to the websocket api within your Gateway
     gateway.api = websocket_connection
+
+    if args.link:
+        from gateway.link_emulator import LinkEmulator, parse_link
+        logger.debug("Emulating a link to the satellite with %s", args.link)
+        gateway.satellite = LinkEmulator(gateway.satellite, **parse_link(args.link))
+
+    # Command statuses go out ahead of telemetry and file lists. See gateway/outbound.py
+    gateway.outbound = OutboundScheduler(system=gateway.satellite.name, rates=lane_rates(args))
+    gateway.outbound.install(websocket_connection)
+    # Repeated events are aggregated and event storms rate limited. See gateway/events.py
+    EventPipeline().install(websocket_connection)
+    archive(args, websocket_connection, system=gateway.satellite.name)
+
+    return gateway, websocket_connection, definitions
+
+def run_sync(args):
+    from gateway.definitions_cache import DefinitionsCache, push_definitions
+
+    logger.debug("Starting Event Loop")
+    loop = asyncio.get_event_loop()
+
+    gateway, websocket_connection, definitions = setup_sync(args)
     
     # Connect to MT
     asyncio.ensure_future(websocket_connection.connect_with_retries())
 
-    # To make it easier to interact with this Gateway, we are going to configure a bunch of commands for a satellite
-    # called "Example FlatSat". Please see the associated json file to see the list of commands.
-    logger.debug("Setting up Example Flatsat satellite and associated commands")
-    with open('satellite/example_commands.json','r') as f:
-        command_defs = json.loads(f.read())
-    asyncio.ensure_future(websocket_connection.update_command_definitions(
+    if args.satellite:
+        asyncio.ensure_future(gateway.satellite.connect())
+
+    asyncio.ensure_future(push_definitions(
+        api=websocket_connection,
         system="Example FlatSat",
-        definitions=command_defs["definitions"]))
+        definitions=definitions,
+        cache=DefinitionsCache(args.definitions_cache),
+        force=args.force_definitions))
 
     try:
         loop.run_forever()
     except KeyboardInterrupt:
         loop.run_until_complete(loop.shutdown_asyncgens())
         loop.close()
+    finally:
+        gateway.close()
 
     # Now, head to the Major Tom UI. You should see the Gateway whose token you used as "Connected". 
     # 
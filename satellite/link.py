@@ -0,0 +1,68 @@
+'''
+Framing for the socket link between the Gateway and an out-of-process satellite.
+
+Each frame is a fixed header (total length, kind, length of a JSON header), then the JSON header,
+then raw bytes. Command and response frames carry the encoded command as raw bytes, exactly as a
+radio would; everything else the satellite tells the Gateway is a CALL frame naming the Gateway
+method and its arguments.
+
+    COMMAND   gateway -> satellite   body: encrypted command bytes
+    RESPONSE  satellite -> gateway   header: {"response": ...}, body: encrypted command bytes
+    CALL      satellite -> gateway   header: {"method": ..., "args": [...], "kwargs": {...}}
+    ACK       satellite -> gateway   body: ACK frame for an uplinked sequence number
+
+Addresses are either "unix:/path/to.sock" or "host:port".
+'''
+import json
+import struct
+
+COMMAND = 1
+RESPONSE = 2
+CALL = 3
+ACK = 4
+
+FRAME_HEADER = struct.Struct(">IBI")  # length of everything after the length field, kind, JSON header length
+
+# The Gateway methods the satellite may call over the link
+GATEWAY_METHODS = ("fail_command", "set_command_status", "update_metrics", "update_file_list")
+
+
+def encode_frame(kind, header=None, body=b""):
+    header = json.dumps(header, separators=(",", ":")).encode("utf-8") if header is not None else b""
+    return b"".join((
+        FRAME_HEADER.pack(FRAME_HEADER.size - 4 + len(header) + len(body), kind, len(header)),
+        header,
+        body))
+
+
+class FrameDecoder:
+    ''' Splits a byte stream back into (kind, header, body) frames, however it was chunked. '''
+
+    def __init__(self):
+        self.buffer = bytearray()
+
+    def feed(self, data):
+        self.buffer += data
+        frames = []
+        offset = 0
+        while len(self.buffer) - offset >= FRAME_HEADER.size:
+            length, kind, header_length = FRAME_HEADER.unpack_from(self.buffer, offset)
+            end = offset + 4 + length
+            if len(self.buffer) < end:
+                break
+            start = offset + FRAME_HEADER.size
+            header = json.loads(self.buffer[start:start + header_length]) if header_length else None
+            frames.append((kind, header, bytes(self.buffer[start + header_length:end])))
+            offset = end
+        del self.buffer[:offset]
+        return frames
+
+
+def parse_address(address):
+    ''' Returns ("unix", path) or ("tcp", (host, port)). '''
+    if address.startswith("unix:"):
+        return "unix", address[len("unix:"):]
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Satellite address must be unix:/path or host:port, not {address!r}")
+    return "tcp", (host, int(port))
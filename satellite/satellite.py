@@ -3,16 +3,35 @@ This is a fake satellite.
 
 It takes the place of a simulator, flatsat, engineering model, or real satellite.
 '''
+import collections
+import functools
+import json
+import os
+import threading
 import time
-from threading import Timer
 from gateway import stubs
+from gateway.decom import compile_layouts
+from gateway.file_catalog import FileCatalog
+from gateway.scheduler import shared_scheduler
 from gateway.statuses import CommandStatus
-from satellite.telemetry import FakeTelemetry
+from gateway.tracing import Tracer
+from gateway.validation import CommandValidator
+from satellite.telemetry import FakeTelemetry, load_frame_definitions
 from random import randint
 import logging
 
 logger = logging.getLogger(__name__)
 
+COMMAND_DEFINITIONS_PATH = os.path.join(os.path.dirname(__file__), "example_commands.json")
+
+@functools.lru_cache(maxsize=None)
+def load_command_definitions(path=COMMAND_DEFINITIONS_PATH):
+    ''' Reads a command definitions file once per process. Callers must not modify the result. '''
+    with open(path, "r") as f:
+        return json.load(f)["definitions"]
+
+HOUSEKEEPING_APID = 1
+
 class CommandCancelledError(RuntimeError):
     """Raised when a command is cancelled to halt the progress of that command"""
 
@@ -25,12 +44,22 @@ def safeget(dct, *keys):
     return dct
 
 class Satellite:
-    def __init__(self):
+    def __init__(self, tracer=None, file_catalog_path=None, scheduler=None):
         self.name = "Example FlatSat"
-        self.file_list = []
+        # Files on board, and which of them Major Tom already knows about. See file_catalog.py
+        self.file_catalog = FileCatalog(path=file_catalog_path, system=self.name)
         self.running_commands = {}
         self.force_cancel = True  # Forces all commands to be cancelled, regardless of run state.
         self.telemetry = FakeTelemetry(name=self.name)
+        # Telemetry goes down as packed housekeeping frames, which the gateway decommutates. See gateway/decom.py
+        self.housekeeping = compile_layouts(load_frame_definitions())[HOUSEKEEPING_APID]
+        self.tracer = tracer or Tracer()
+        self.validator = CommandValidator(load_command_definitions())
+        # Delayed responses share one thread rather than starting a Timer each. See gateway/scheduler.py
+        self.scheduler = scheduler or shared_scheduler()
+        # Recently received (session, sequence) numbers, so retransmitted copies aren't run twice. See gateway/uplink.py
+        self.received_sequences = collections.OrderedDict()
+        self._sequences_lock = threading.Lock()
 
     def add_running_command(self, command_id, cancel=False):
         self.running_commands[str(command_id)] = {"cancel": False}
@@ -41,26 +70,74 @@ class Satellite:
         encrypted = stubs.encrypt(packetized)   
         gateway.satellite_response(encrypted, response)
 
+    def respond_later(self, delay, gateway, encrypted, response, trace_id=None):
+        ''' Mimics the delay of a real downlink before responding to the gateway. '''
+        start, counter = time.time(), time.perf_counter()
+
+        def respond():
+            self.tracer.record(trace_id, "satellite.response_delay", start, time.perf_counter() - counter)
+            gateway.satellite_response(encrypted, response)
+
+        # Responding waits on the websocket, so it doesn't run on the scheduler thread itself
+        self.scheduler.call_later_blocking(delay, respond)
+
+    def downlink_telemetry(self, metrics, gateway):
+        ''' Packs a telemetry tick into a housekeeping frame and downlinks it. '''
+        body = self.housekeeping.pack(
+            int(time.time() * 1000),
+            {(metric["subsystem"], metric["metric"]): metric["value"] for metric in metrics})
+        frame = stubs.telemetry_frame(HOUSEKEEPING_APID, body)
+        gateway.satellite_response(stubs.encrypt(stubs.packetize(frame)), None)
+
+    def report_files(self, gateway):
+        ''' Sends Major Tom only the files it hasn't seen yet, a page at a time. '''
+        for page in self.file_catalog.pending_pages():
+            gateway.update_file_list(system=self.name, files=page)
+            self.file_catalog.mark_reported(page)
+
     def check_cancelled(self, id):
         ''' Checks to see if a command-in-progress has been cancelled. '''
         if safeget(self.running_commands, str(id), "cancel"):
             # Raise an exception to immediately stop the command operations
             raise(CommandCancelledError(f"Command {id} Cancelled"))
 
+    def acknowledge(self, bytes, gateway):
+        '''
+        ACKs a sequenced frame as soon as it arrives. Returns the command frame inside it, or None if
+        this is a copy of one already received.
+        '''
+        session, sequence, frame = stubs.unsequence_frame(bytes)
+        gateway.satellite_ack(stubs.ack_frame(session, sequence))
+        with self._sequences_lock:
+            if (session, sequence) in self.received_sequences:
+                return None
+            self.received_sequences[(session, sequence)] = True
+            if len(self.received_sequences) > 1024:
+                self.received_sequences.popitem(last=False)
+        return frame
+
     def process_command(self, bytes, gateway):
-        logger.info(f"Satellite received: {bytes}")
+        logger.debug("Satellite received: %r", bytes)
+        if stubs.is_sequenced(bytes):
+            bytes = self.acknowledge(bytes, gateway)
+            if bytes is None:
+                return
 
         # The satellite would have it's own command transformation -- we'll just re-use the stubs
+        start, counter = time.time(), time.perf_counter()
         decrypted = stubs.decrypt(bytes)  
         depacketized = stubs.depacketize(decrypted)
         command = stubs.translate_binary_to_command(depacketized)
+        trace_id = stubs.trace_id_of(command)
+        self.tracer.record(trace_id, "satellite.decode", start, time.perf_counter() - counter)
 
         if command.type == "ping":
-            binary = stubs.translate_command_to_binary(command)
-            packetized = stubs.packetize(binary)
-            encrypted = stubs.encrypt(packetized)    
-            r = Timer(1.0, gateway.satellite_response, (encrypted, "pong"))
-            r.start()
+            # The decoded command still carries its trace id, so re-encoding it keeps the trace intact.
+            with self.tracer.span(trace_id, "satellite.encode"):
+                binary = stubs.translate_command_to_binary(command)
+                packetized = stubs.packetize(binary)
+                encrypted = stubs.encrypt(packetized)    
+            self.respond_later(1.0, gateway, encrypted, "pong", trace_id=trace_id)
 
         elif command.type == "telemetry":
             # Begins telemetry beaconing. 2 modes: error and nominal
@@ -70,11 +147,11 @@ class Satellite:
             self.telemetry.safemode = False
 
             errors = self.validate(command)
-            duration =  command.fields['duration']
-            mode = command.fields['mode']
             if errors:
                 gateway.fail_command(command.id, errors)
             else:
+                duration =  command.fields['duration']
+                mode = command.fields['mode']
                 msg = f"Started Telemetry Beacon in mode: {command.fields['mode']} for {command.fields['duration']} seconds."
                 gateway.set_command_status(command.id, CommandStatus.COMPLETED, payload=msg)
                 timeout = time.time() + duration
@@ -82,9 +159,9 @@ class Satellite:
                     self.check_cancelled(id=command.id)
                     metrics, errors = self.telemetry.generate_telemetry(mode=mode)
                     if not errors:
-                        gateway.update_metrics(metrics)
+                        self.downlink_telemetry(metrics, gateway)
                     else:
-                        logger.warn(errors)
+                        logger.warning(errors)
                     time.sleep(1)
         
         elif command.type == "update_file_list":
@@ -98,17 +175,18 @@ class Satellite:
             See the documentation for a full list of such commands.
             """
             for i in range(1, randint(2, 4)):
-                self.file_list.append({
-                    "name": f'Payload-Image-{(len(self.file_list)+1):04d}.png',
+                self.file_catalog.add({
+                    "name": f'Payload-Image-{(len(self.file_catalog)+1):04d}.png',
                     "size": randint(2000000, 3000000),
                     "timestamp": int(time.time() * 1000) + i*10,
                     "metadata": {"type": "image", "lat": (randint(-89, 89) + .0001*randint(0, 9999)), "lng": (randint(-179, 179) + .0001*randint(0, 9999))}
                 })
 
             self.check_cancelled(id=command.id)
-            logger.info("Files: {}".format(self.file_list))
-            r = Timer(0.1, gateway.update_file_list, kwargs={"system":self.name, "files":self.file_list})
-            r.start()
+            logger.info("Files: %s, new since the last update: %s", len(self.file_catalog), self.file_catalog.pending_count())
+            # Reporting waits on the websocket, so it stays on this command's thread rather than the scheduler's
+            time.sleep(0.1)
+            self.report_files(gateway=gateway)
             time.sleep(10)
             self.check_cancelled(id=command.id)
             gateway.set_command_status(
@@ -118,13 +196,13 @@ class Satellite:
 
         elif command.type == "error":
             """ Simulates a command erroring out. """
-            logger.warn(f"We can print a warning to the log here.")
+            logger.warning(f"We can print a warning to the log here.")
             errors = [f"Command purposely failed."]
             gateway.fail_command(command.id, errors=errors)
 
         else:
             # We'd want to generate an error if the command wasn't found.
-            logger.warn(f"Satellite does not recognize command {command.type}")
+            logger.warning(f"Satellite does not recognize command {command.type}")
             errors = [f"Command {command.type} not found on Satellite."]
             gateway.fail_command(command.id, errors=errors)
 
@@ -133,8 +211,4 @@ class Satellite:
     Returns a list of errors if any are found. 
     Otherwise returns None '''
     def validate(self, command):
-        if command.type == "telemetry":
-            if type(command.fields['duration']) != type(int()):
-                return [f"Duration type is invalid. Must be an int. Type: {type(command.fields['duration'])}"]
-        
-        return None
\ No newline at end of file
+        return self.validator.validate(command)
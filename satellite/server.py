@@ -0,0 +1,125 @@
+'''
+Runs the fake satellite in its own process, behind a socket.
+
+    python -m satellite.server unix:/tmp/flatsat.sock
+    python -m satellite.server 127.0.0.1:7000
+
+Then start the sync gateway with `--satellite` and the same address. Commands arrive as framed
+bytes (see link.py) and go to Satellite.process_command on a worker thread, since some commands
+run for a long time. The satellite's calls back to the Gateway are written back as frames.
+
+Running several servers spreads simulated spacecraft across cores.
+'''
+import argparse
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from satellite.link import ACK, CALL, COMMAND, GATEWAY_METHODS, RESPONSE, FrameDecoder, encode_frame, parse_address
+from satellite.satellite import Satellite
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteGateway:
+    '''
+    What the satellite sees as its gateway: every call is written to the connection as a frame.
+    Safe to call from any thread.
+    '''
+
+    def __init__(self, loop, writer):
+        self.loop = loop
+        self.writer = writer
+
+    def send(self, frame):
+        self.loop.call_soon_threadsafe(self._write, frame)
+
+    def _write(self, frame):
+        if not self.writer.is_closing():
+            self.writer.write(frame)
+
+    def satellite_response(self, encrypted, response, *args, **kwargs):
+        self.send(encode_frame(RESPONSE, {"response": response}, encrypted))
+
+    def satellite_ack(self, frame, *args, **kwargs):
+        self.send(encode_frame(ACK, body=frame))
+
+    def __getattr__(self, name):
+        if name not in GATEWAY_METHODS:
+            raise AttributeError(name)
+
+        def call(*args, **kwargs):
+            self.send(encode_frame(CALL, {"method": name, "args": args, "kwargs": kwargs}))
+        return call
+
+
+class SatelliteServer:
+    def __init__(self, satellite=None, address="unix:/tmp/flatsat.sock", max_workers=64):
+        self.satellite = satellite or Satellite()
+        self.address = address
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="satellite")
+        self.server = None
+
+    async def start(self):
+        family, where = parse_address(self.address)
+        if family == "unix":
+            self.server = await asyncio.start_unix_server(self.handle, path=where)
+        else:
+            self.server = await asyncio.start_server(self.handle, host=where[0], port=where[1])
+        logger.info("%s listening on %s", self.satellite.name, self.address)
+        return self
+
+    async def handle(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        gateway = RemoteGateway(loop, writer)
+        decoder = FrameDecoder()
+        logger.info("Gateway connected")
+        try:
+            while True:
+                data = await reader.read(64 * 1024)
+                if not data:
+                    break
+                for kind, header, body in decoder.feed(data):
+                    if kind == COMMAND:
+                        loop.run_in_executor(self.executor, self.process_command, body, gateway)
+                    else:
+                        logger.warning(f"Satellite ignored a frame of kind {kind}")
+        finally:
+            logger.info("Gateway disconnected")
+            writer.close()
+
+    def process_command(self, body, gateway):
+        try:
+            self.satellite.process_command(bytes=body, gateway=gateway)
+        except Exception:
+            logger.exception("Satellite failed to process a command")
+
+    def close(self):
+        if self.server is not None:
+            self.server.close()
+        self.executor.shutdown(wait=False)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Runs the fake satellite behind a socket, for the gateway's --satellite option.")
+    parser.add_argument("address", help='Where to listen: "unix:/path/to.sock" or "host:port".')
+    parser.add_argument("--file-catalog", help="File that keeps the satellite's file list between restarts. The satellite's name is added before the extension.")
+    parser.add_argument("-l", "--loglevel", choices=["debug", "info", "error"], default="info")
+    args = parser.parse_args(argv)
+    logging.basicConfig(
+        level=args.loglevel.upper(),
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    loop = asyncio.get_event_loop()
+    server = SatelliteServer(Satellite(file_catalog_path=args.file_catalog), args.address)
+    loop.run_until_complete(server.start())
+    try:
+        loop.run_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,18 @@
+import functools
+import json
+import os
 import time
 import random
 
+TELEMETRY_FRAMES_PATH = os.path.join(os.path.dirname(__file__), "telemetry_frames.json")
+
+
+@functools.lru_cache(maxsize=None)
+def load_frame_definitions(path=TELEMETRY_FRAMES_PATH):
+    ''' Reads the telemetry frame layouts once per process. Callers must not modify the result. See gateway/decom.py '''
+    with open(path, "r") as f:
+        return json.load(f)["frames"]
+
 
 class FakeTelemetry:
     def __init__(self, name):
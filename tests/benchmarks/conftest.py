@@ -0,0 +1,38 @@
+import pytest
+from gateway.gateway import Gateway
+from majortom_gateway.command import Command
+
+
+class StubAPI:
+    ''' Stands in for GatewayAPI, counting what would have been sent to Major Tom. '''
+    def __init__(self):
+        self.command_updates = 0
+        self.metrics = 0
+
+    async def transmit_command_update(self, command_id, state, dict={}):
+        self.command_updates += 1
+
+    async def transmit_metrics(self, metrics):
+        self.metrics += len(metrics)
+
+    async def update_file_list(self, system, files, timestamp=None):
+        pass
+
+
+def make_command(type="ping", id=1, fields=None, system="Example FlatSat"):
+    return Command({
+        "id": id,
+        "type": type,
+        "system": system,
+        "fields": [{"name": name, "value": value} for name, value in (fields or {}).items()]
+    })
+
+
+@pytest.fixture
+def api():
+    return StubAPI()
+
+
+@pytest.fixture
+def gateway(api):
+    return Gateway(api=api)
@@ -0,0 +1,25 @@
+from gateway import stubs
+from conftest import make_command
+
+
+def round_trip(command):
+    binary = stubs.translate_command_to_binary(command)
+    encrypted = stubs.encrypt(stubs.packetize(binary))
+    return stubs.translate_binary_to_command(stubs.depacketize(stubs.decrypt(encrypted)))
+
+
+def test_bench_codec_round_trip(benchmark):
+    command = make_command("telemetry", fields={"mode": "NOMINAL", "duration": 300})
+    result = benchmark(round_trip, command)
+    assert(result.fields == command.fields)
+
+
+def test_bench_codec_round_trip_traced(benchmark):
+    command = make_command("ping")
+
+    def traced_round_trip():
+        binary = stubs.translate_command_to_binary(command, trace_id="0123456789abcdef")
+        return stubs.translate_binary_to_command(stubs.depacketize(stubs.decrypt(stubs.encrypt(stubs.packetize(binary)))))
+
+    result = benchmark(traced_round_trip)
+    assert(stubs.trace_id_of(result) == "0123456789abcdef")
@@ -0,0 +1,14 @@
+from gateway import stubs
+from gateway.decom import Decommutator
+from satellite.satellite import HOUSEKEEPING_APID, Satellite
+from satellite.telemetry import FakeTelemetry, load_frame_definitions
+
+
+def test_bench_decommutate_frames(benchmark):
+    satellite = Satellite()
+    metrics, _ = FakeTelemetry(name=satellite.name).generate_telemetry()
+    values = {(m["subsystem"], m["metric"]): m["value"] for m in metrics}
+    frames = [stubs.telemetry_frame(HOUSEKEEPING_APID, satellite.housekeeping.pack(i, values)) for i in range(1000)]
+    decom = Decommutator(satellite.name, load_frame_definitions())
+    points = benchmark(decom.decode, frames)
+    assert(len(points) == 6000)
@@ -0,0 +1,14 @@
+from gateway.statuses import CommandStatus
+from conftest import make_command
+
+
+def test_bench_set_command_status(benchmark, gateway, api):
+    benchmark(gateway.set_command_status, 1, CommandStatus.PROCESSING, payload="Processing")
+    assert(api.command_updates > 0)
+
+
+def test_bench_command_dispatch(benchmark, gateway, api):
+    # "error" goes through the full encode -> satellite -> fail_command path without any timers
+    command = make_command("error")
+    benchmark(gateway.command_callback, command, api)
+    assert(api.command_updates > 0)
@@ -0,0 +1,34 @@
+import pytest
+import requests
+
+from gateway.http_client import HttpClient
+from loadtest.http_standin import HttpStandIn
+
+TRANSFERS = 50
+
+
+@pytest.fixture(scope="module")
+def standin():
+    # A few milliseconds per response, standing in for the round trip to Major Tom
+    server = HttpStandIn(latency=0.002).start()
+    yield server
+    server.stop()
+
+
+def test_bench_http_unpooled(benchmark, standin):
+    # What DemoSat used to do: a new connection per request, one request at a time
+    def transfer_all():
+        return [requests.get(standin.url + "/files/1024").status_code for _ in range(TRANSFERS)]
+
+    assert(benchmark(transfer_all) == [200] * TRANSFERS)
+
+
+def test_bench_http_pooled(benchmark, standin):
+    # The same access pattern, over one kept-alive connection
+    client = HttpClient()
+
+    def transfer_all():
+        return [client.get(standin.url + "/files/1024").status_code for _ in range(TRANSFERS)]
+
+    assert(benchmark(transfer_all) == [200] * TRANSFERS)
+    client.close()
@@ -0,0 +1,44 @@
+import logging
+import os
+
+import pytest
+from conftest import make_command
+
+from gateway.logs import TEXT_FORMAT, configure_logging
+
+
+@pytest.fixture
+def devnull():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    with open(os.devnull, "w") as stream:
+        yield stream
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+def log_synchronously(level, stream):
+    ''' What run.py did before gateway/logs.py: basicConfig, formatting and writing on the logging thread. '''
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    logging.basicConfig(level=level, format=TEXT_FORMAT, stream=stream)
+
+
+@pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG], ids=["info", "debug"])
+def test_bench_command_logging_synchronous(benchmark, gateway, api, devnull, level):
+    log_synchronously(level, devnull)
+    # "error" goes through the full encode -> satellite -> fail_command path, logging at each step
+    benchmark(gateway.command_callback, make_command("error"), api)
+
+
+@pytest.mark.parametrize("level", [logging.INFO, logging.DEBUG], ids=["info", "debug"])
+def test_bench_command_logging_queued(benchmark, gateway, api, devnull, level):
+    listener = configure_logging(level=level, stream=devnull)
+    try:
+        benchmark(gateway.command_callback, make_command("error"), api)
+    finally:
+        listener.stop()
@@ -0,0 +1,38 @@
+import json
+import time
+
+from gateway.metric_batch import MetricBatch, MetricChannels
+
+CHANNELS = [("Example FlatSat", f"subsystem{i % 10}", f"metric{i}") for i in range(100)]
+TICKS = 100  # 10,000 points
+
+
+def encode_dicts():
+    for tick in range(TICKS):
+        metrics = []
+        for i, (system, subsystem, metric) in enumerate(CHANNELS):
+            metrics.append({
+                "system": system,
+                "subsystem": subsystem,
+                "metric": metric,
+                "value": tick * 0.5 + i,
+                "timestamp": int(time.time() * 1000)
+            })
+        json.dumps({"type": "measurements", "measurements": metrics})
+
+
+def encode_batches(channels):
+    prefixes = [channels.prefix(*channel) for channel in CHANNELS]
+    for tick in range(TICKS):
+        batch = MetricBatch()
+        for i, prefix in enumerate(prefixes):
+            batch.add(prefix, tick * 0.5 + i)
+        batch.message()
+
+
+def test_bench_encode_metric_dicts(benchmark):
+    benchmark(encode_dicts)
+
+
+def test_bench_encode_metric_batches(benchmark):
+    benchmark(encode_batches, MetricChannels())
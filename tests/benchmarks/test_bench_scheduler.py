@@ -0,0 +1,31 @@
+import threading
+
+from gateway.scheduler import Scheduler
+
+CALLS = 500
+
+
+def run_timers():
+    done = threading.Semaphore(0)
+    for _ in range(CALLS):
+        threading.Timer(0, done.release).start()
+    for _ in range(CALLS):
+        done.acquire()
+
+
+def run_scheduler(scheduler):
+    done = threading.Semaphore(0)
+    for _ in range(CALLS):
+        scheduler.call_later(0, done.release)
+    for _ in range(CALLS):
+        done.acquire()
+
+
+def test_bench_delayed_calls_with_timers(benchmark):
+    benchmark(run_timers)
+
+
+def test_bench_delayed_calls_with_scheduler(benchmark):
+    scheduler = Scheduler()
+    benchmark(run_scheduler, scheduler)
+    scheduler.stop()
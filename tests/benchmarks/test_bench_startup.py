@@ -0,0 +1,27 @@
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def start(*args):
+    subprocess.run([sys.executable] + list(args), cwd=ROOT, check=True, stdout=subprocess.DEVNULL)
+
+
+def test_bench_startup_help(benchmark):
+    # Argument parsing alone must not pull in either gateway
+    benchmark.pedantic(start, args=("run.py", "-h"), rounds=5, iterations=1)
+
+
+def test_bench_startup_sync_setup(benchmark):
+    code = ("import argparse, run; run.setup_sync(argparse.Namespace("
+            "majortomhost='localhost', gatewaytoken='x', basicauth=None, http=True, trace_file=None, file_catalog=None, lane_rates=None, record=None, archive=None, satellite=None, link=None, uplink_window=8, uplink_timeout=2.0))")
+    benchmark.pedantic(start, args=("-c", code), rounds=5, iterations=1)
+
+
+def test_bench_startup_async_setup(benchmark, tmp_path):
+    code = ("import argparse, run; run.setup_async(argparse.Namespace("
+            "majortomhost='localhost', gatewaytoken='x', basicauth=None, http=True, file_catalog=None, "
+            f"downlink_cache={str(tmp_path / 'downlink_cache')!r}, downlink_cache_quota=1024, lane_rates=None, record=None, archive=None))")
+    benchmark.pedantic(start, args=("-c", code), rounds=5, iterations=1)
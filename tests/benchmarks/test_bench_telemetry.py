@@ -0,0 +1,14 @@
+from demo.demo_telemetry import DemoTelemetry
+from satellite.telemetry import FakeTelemetry
+
+
+def test_bench_fake_telemetry_tick(benchmark):
+    telemetry = FakeTelemetry(name="Example FlatSat")
+    metrics, errors = benchmark(telemetry.generate_telemetry, mode="NOMINAL")
+    assert(len(metrics) == 6 and errors == [])
+
+
+def test_bench_demo_telemetry_batch(benchmark):
+    telemetry = DemoTelemetry(name="Space Oddity")
+    batch = benchmark(telemetry.build_batch)
+    assert(len(batch) == 6)
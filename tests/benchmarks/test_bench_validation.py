@@ -0,0 +1,27 @@
+import json
+from gateway.validation import CommandValidator
+from satellite.satellite import COMMAND_DEFINITIONS_PATH
+from conftest import make_command
+
+with open(COMMAND_DEFINITIONS_PATH) as f:
+    DEFINITIONS = json.load(f)["definitions"]
+
+
+def test_bench_validate_command(benchmark):
+    validator = CommandValidator(DEFINITIONS)
+    command = make_command("telemetry", fields={"mode": "NOMINAL", "duration": 300})
+    assert(benchmark(validator.validate, command) is None)
+
+
+def test_bench_validate_with_default(benchmark):
+    validator = CommandValidator(DEFINITIONS)
+
+    def validate_fresh():
+        return validator.validate(make_command("telemetry", fields={"mode": "ERROR"}))
+
+    assert(benchmark(validate_fresh) is None)
+
+
+def test_bench_compile_definitions(benchmark):
+    validator = benchmark(CommandValidator, DEFINITIONS)
+    assert("telemetry" in validator.checks)
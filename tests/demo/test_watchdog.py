@@ -0,0 +1,52 @@
+import asyncio
+import time
+from demo.watchdog import LoopWatchdog
+
+
+class FakeGateway:
+    def __init__(self):
+        self.events = []
+        self.metrics = []
+
+    async def transmit_events(self, events):
+        self.events.extend(events)
+
+    async def transmit_metrics(self, metrics):
+        self.metrics.extend(metrics)
+
+
+def blocking_callback():
+    time.sleep(0.4)
+
+
+async def run_watchdog(gateway, blocker):
+    watchdog = LoopWatchdog(system="Space Oddity", gateway=gateway, interval=0.02, threshold=0.15, metric_interval=0.2)
+    watchdog.start()
+    await asyncio.sleep(0.1)
+    if blocker:
+        blocker()
+    await asyncio.sleep(0.3)
+    watchdog.stop()
+    return watchdog
+
+
+def test_stall_is_reported_with_stack():
+    gateway = FakeGateway()
+    watchdog = asyncio.run(run_watchdog(gateway, blocking_callback))
+
+    assert(watchdog.stalls == 1)
+    assert(len(gateway.events) == 1)
+    event = gateway.events[0]
+    assert(event["type"] == "Event Loop Stall")
+    assert(event["debug"]["blocked_ms"] >= 150)
+    assert("blocking_callback" in event["debug"]["stack"])
+    assert(any(m["metric"] == "event_loop_lag_ms" and m["value"] >= 150 for m in gateway.metrics))
+
+
+def test_idle_loop_reports_lag_without_stalls():
+    gateway = FakeGateway()
+    watchdog = asyncio.run(run_watchdog(gateway, None))
+
+    assert(watchdog.stalls == 0)
+    assert(gateway.events == [])
+    assert(any(m["metric"] == "event_loop_stalls" and m["value"] == 0 for m in gateway.metrics))
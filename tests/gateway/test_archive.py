@@ -0,0 +1,113 @@
+import asyncio
+import os
+import time
+
+import pytest
+
+from gateway.archive import ColumnarFormat, ParquetFormat, TelemetryArchive, day_of
+from gateway.metric_batch import MetricBatch, MetricChannels
+
+# 2026-10-19 and 2026-10-20, UTC
+MONDAY = 1792368000000
+TUESDAY = MONDAY + 86400000
+
+
+class FakeAPI:
+    def __init__(self):
+        self.sent = []
+
+    async def transmit(self, payload):
+        self.sent.append(payload)
+
+
+def measurements(system, timestamp, count=1):
+    return {"type": "measurements", "measurements": [
+        {"system": system, "subsystem": "battery", "metric": "voltage", "value": 3.5 + i, "timestamp": timestamp + i}
+        for i in range(count)]}
+
+
+def test_metrics_and_command_states_are_archived_by_day_and_system(tmp_path):
+    archive = TelemetryArchive(str(tmp_path), system="Sat", format=ColumnarFormat())
+    api = FakeAPI()
+    archive.install(api)
+
+    async def send():
+        await api.transmit(measurements("Sat", MONDAY, count=3))
+        await api.transmit(measurements("Other", MONDAY))
+        await api.transmit(measurements("Sat", TUESDAY))
+        channels = MetricChannels()
+        batch = MetricBatch(timestamp=MONDAY + 10)
+        batch.add(channels.prefix("Sat", "obc", "temperature"), 21)
+        await api.transmit(batch.message())
+        await api.transmit({"type": "command_update", "command": {"id": 7, "state": "completed"}})
+        await api.transmit({"type": "event", "event": {}})
+
+    asyncio.run(send())
+    archive.close()
+
+    assert(len(api.sent) == 6)
+    monday = archive.read("metrics", day_of(MONDAY), "Sat")
+    assert(monday["timestamp"] == [MONDAY, MONDAY + 1, MONDAY + 2, MONDAY + 10])
+    assert(monday["metric"] == ["voltage", "voltage", "voltage", "temperature"])
+    assert(monday["value"] == [3.5, 4.5, 5.5, 21.0])
+    assert(archive.read("metrics", day_of(TUESDAY), "Sat")["value"] == [3.5])
+    assert(archive.read("metrics", day_of(MONDAY), "Other")["subsystem"] == ["battery"])
+    commands = archive.read("commands", day_of(int(time.time() * 1000)), "Sat")
+    assert(commands["command_id"] == [7] and commands["state"] == ["completed"])
+
+
+def test_row_groups_are_written_in_the_background_and_compacted(tmp_path):
+    archive = TelemetryArchive(str(tmp_path), row_group_size=10, flush_interval=0.05, compact_after=3, format=ColumnarFormat())
+    for i in range(5):
+        archive.archive(measurements("Sat", MONDAY + i * 10, count=10))
+        deadline = time.time() + 2
+        while archive.stats["rows"] < (i + 1) * 10 and time.time() < deadline:
+            time.sleep(0.01)
+    archive.close()
+
+    directory = os.path.join(str(tmp_path), "metrics", f"day={day_of(MONDAY)}", "system=Sat")
+    # The first three parts are merged into one, which isn't merged again
+    assert(archive.stats["files"] == 5 and archive.stats["compactions"] == 1)
+    assert(len(os.listdir(directory)) == 3)
+    assert(archive.read("metrics", day_of(MONDAY), "Sat")["timestamp"] == [MONDAY + i for i in range(50)])
+
+
+def test_large_files_are_not_compacted(tmp_path):
+    archive = TelemetryArchive(str(tmp_path), compact_after=2, compact_size=500, format=ColumnarFormat())
+    for count in (100, 1, 1, 1):
+        archive.archive(measurements("Sat", MONDAY, count=count))
+        archive.flush()
+    archive.close()
+
+    # The large first file, then one compacted file, then the newest small one
+    directory = os.path.join(str(tmp_path), "metrics", f"day={day_of(MONDAY)}", "system=Sat")
+    assert(archive.stats["compactions"] == 1 and len(os.listdir(directory)) == 3)
+    assert(len(archive.read("metrics", day_of(MONDAY), "Sat")["value"]) == 103)
+
+
+def test_runs_do_not_overwrite_each_others_files(tmp_path):
+    for run in range(3):
+        archive = TelemetryArchive(str(tmp_path), format=ColumnarFormat())
+        archive.archive(measurements("Sat", MONDAY + run))
+        archive.close()
+    assert(archive.read("metrics", day_of(MONDAY), "Sat")["timestamp"] == [MONDAY, MONDAY + 1, MONDAY + 2])
+
+
+
+def test_parquet_round_trip(tmp_path):
+    pytest.importorskip("pyarrow")
+    archive = TelemetryArchive(str(tmp_path), system="Sat", format=ParquetFormat())
+    archive.archive(measurements("Sat", MONDAY, count=3))
+    archive.archive({"type": "command_update", "command": {"id": 7, "state": "completed"}})
+    archive.close()
+
+    directory = os.path.join(str(tmp_path), "metrics", f"day={day_of(MONDAY)}", "system=Sat")
+    assert([os.path.splitext(name)[1] for name in os.listdir(directory)] == [".parquet"])
+    assert(archive.read("metrics", day_of(MONDAY), "Sat") == {
+        "timestamp": [MONDAY, MONDAY + 1, MONDAY + 2],
+        "subsystem": ["battery"] * 3,
+        "metric": ["voltage"] * 3,
+        "value": [3.5, 4.5, 5.5],
+    })
+    commands = archive.read("commands", day_of(int(time.time() * 1000)), "Sat")
+    assert(commands["command_id"] == [7] and commands["state"] == ["completed"])
@@ -0,0 +1,97 @@
+import time
+from unittest import mock
+
+import pytest
+from majortom_gateway.command import Command
+
+from gateway import stubs
+from gateway.blob_batcher import BlobBatcher
+from gateway.gateway import Gateway
+
+PASS = {"norad_id": "00000", "pass_id": "pass-1"}
+
+
+def test_frames_round_trip():
+    frames = [b"", b"one", b"\x00" * 1000]
+    assert(stubs.unpack_frames(stubs.pack_frames(frames)) == frames)
+    # Blobs from before batching are a single frame
+    assert(stubs.unpack_frames(b'{"id": 1}') == [b'{"id": 1}'])
+    with pytest.raises(ValueError):
+        stubs.unpack_frames(stubs.pack_frames([b"truncated"])[:-1])
+
+
+def test_batches_flush_on_count_and_size():
+    sent = []
+    batcher = BlobBatcher(send=lambda blob, context: sent.append((stubs.unpack_frames(blob), context)),
+                          max_frames=3, max_bytes=100, max_delay=None)
+    for i in range(4):
+        batcher.add(bytes([i]), PASS)
+    assert(sent == [([b"\x00", b"\x01", b"\x02"], PASS)])
+    assert(batcher.pending() == 1)
+
+    # A frame that doesn't fit flushes the batch before it
+    batcher.add(b"x" * 86, PASS)
+    assert(sent[-1][0] == [b"\x03"])
+    batcher.flush()
+    assert(sent[-1][0] == [b"x" * 86])
+    assert(batcher.pending() == 0)
+    assert((batcher.blobs_sent, batcher.frames_sent) == (3, 5))
+
+    # A frame that fills a blob by itself goes straight out
+    batcher.add(b"y" * 90, PASS)
+    assert(sent[-1][0] == [b"y" * 90])
+
+
+def test_batches_are_per_pass_and_flush_on_deadline():
+    sent = []
+    batcher = BlobBatcher(send=lambda blob, context: sent.append((stubs.unpack_frames(blob), context)), max_delay=0.05)
+    batcher.add(b"a", PASS)
+    batcher.add(b"b", {"norad_id": "00000", "pass_id": "pass-2"})
+    batcher.add(b"c", PASS)
+    assert(sent == [])
+    time.sleep(0.2)
+    assert(sorted(sent, key=lambda s: s[1]["pass_id"]) == [
+        ([b"a", b"c"], PASS),
+        ([b"b"], {"norad_id": "00000", "pass_id": "pass-2"}),
+    ])
+
+
+def test_gateway_sends_one_blob_per_pass_and_splits_the_echo():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api, blob_batcher=None)
+    gateway.blob_batcher.max_delay = None
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        for i in range(10):
+            gateway.command_callback(Command({
+                "id": i, "type": "ping_through_leaf_network", "system": "Example FlatSat",
+                "fields": [{"name": "pass_id", "value": "pass-1"}]}), api)
+        gateway.blob_batcher.flush()
+        assert(api.transmit_blob.call_count == 1)
+
+        # The Leaf sandbox echoes the blob back
+        blob = api.transmit_blob.call_args.kwargs["blob"]
+        assert(api.transmit_blob.call_args.kwargs["context"] == PASS)
+        api.transmit_command_update.reset_mock()
+        gateway.received_blob_callback(blob, PASS)
+
+    completed = [c.kwargs["command_id"] for c in api.transmit_command_update.call_args_list if c.kwargs["state"] == "completed"]
+    assert(completed == list(range(10)))
+
+
+def test_commands_in_a_blob_that_fails_to_send_are_failed():
+    api = mock.MagicMock()
+    api.transmit_blob.side_effect = ConnectionError("websocket closed")
+    gateway = Gateway(api=api, blob_batcher=None)
+    gateway.blob_batcher.max_delay = 0.05
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        for i in range(3):
+            gateway.command_callback(Command({
+                "id": i, "type": "ping_through_leaf_network", "system": "Example FlatSat",
+                "fields": [{"name": "pass_id", "value": "pass-1"}]}), api)
+        # The deadline flush fails on a scheduler worker
+        time.sleep(0.3)
+
+    failed = [c.kwargs for c in api.transmit_command_update.call_args_list if c.kwargs["state"] == "failed"]
+    assert([update["command_id"] for update in failed] == [0, 1, 2])
+    assert(failed[0]["dict"]["errors"] == ["Sending to the groundstation network failed: websocket closed"])
+    assert((gateway.blob_batcher.blobs_failed, gateway.blob_batcher.pending()) == (1, 0))
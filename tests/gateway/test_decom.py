@@ -0,0 +1,61 @@
+from unittest import mock
+
+import pytest
+
+from gateway import stubs
+from gateway.decom import Decommutator, FrameLayout
+from gateway.gateway import Gateway
+from satellite.satellite import HOUSEKEEPING_APID, Satellite
+from satellite.telemetry import FakeTelemetry, load_frame_definitions
+
+LAYOUT = {
+    "apid": 7, "name": "thermal", "byte_order": "little", "fields": [
+        {"subsystem": "panels", "metric": "temperature", "type": "int16", "scale": 0.5, "offset": -40},
+        {"name": "timestamp", "type": "uint64"},
+        {"subsystem": "obc", "metric": "resets", "type": "uint8"},
+    ]}
+
+
+def test_layouts_round_trip():
+    layout = FrameLayout(LAYOUT)
+    assert(layout.struct.format == "<hQB")
+    body = layout.pack(1000, {("panels", "temperature"): 21.5, ("obc", "resets"): 3})
+    frames = [stubs.telemetry_frame(7, body), stubs.telemetry_frame(7, body)]
+
+    metrics = Decommutator("Sat", [LAYOUT]).decode(frames)
+    assert(metrics[:2] == [
+        {"system": "Sat", "subsystem": "panels", "metric": "temperature", "value": 21.5, "timestamp": 1000},
+        {"system": "Sat", "subsystem": "obc", "metric": "resets", "value": 3, "timestamp": 1000},
+    ])
+    assert(len(metrics) == 4)
+
+    with pytest.raises(ValueError):
+        FrameLayout(dict(LAYOUT, fields=LAYOUT["fields"][:1]))
+
+
+def test_malformed_frames_are_dropped():
+    decom = Decommutator("Sat", [LAYOUT])
+    good = stubs.telemetry_frame(7, FrameLayout(LAYOUT).pack(1, {("panels", "temperature"): 0, ("obc", "resets"): 0}))
+    frames = [good[:-1], stubs.telemetry_frame(8, b"\x00" * 11), b'{"id": 1}', good]
+    assert(len(decom.decode(frames)) == 2)
+
+
+def test_satellite_telemetry_reaches_major_tom_as_metrics():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    satellite = Satellite()
+    metrics, _ = FakeTelemetry(name=satellite.name).generate_telemetry()
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        satellite.downlink_telemetry(metrics, gateway)
+
+        # A groundstation network pass can bring down many frames in one blob
+        frame = stubs.telemetry_frame(HOUSEKEEPING_APID, satellite.housekeeping.pack(
+            5, {(m["subsystem"], m["metric"]): m["value"] for m in metrics}))
+        gateway.received_blob_callback(stubs.pack_frames([frame] * 3), {"norad_id": "00000"})
+
+    first, second = [c.kwargs["metrics"] for c in api.transmit_metrics.call_args_list]
+    assert(len(first) == len(metrics) and len(second) == 3 * len(metrics))
+    for sent, decoded in zip(metrics, first):
+        assert(decoded["metric"] == sent["metric"])
+        assert(decoded["value"] == pytest.approx(sent["value"], abs=0.01))
+    assert(len(load_frame_definitions()) == 1)
@@ -0,0 +1,47 @@
+import asyncio
+from gateway.definitions_cache import DefinitionsCache, digest, push_definitions
+
+DEFINITIONS = {"ping": {"display_name": "Ping", "fields": []}}
+
+
+class FakeAPI:
+    def __init__(self, host="app.majortom.cloud", gateway_token="token"):
+        self.host = host
+        self.gateway_token = gateway_token
+        self.websocket = object()
+        self.pushes = 0
+
+    async def update_command_definitions(self, system, definitions):
+        self.pushes += 1
+
+
+def test_digest_ignores_key_order():
+    assert(digest({"a": 1, "b": [1, 2]}) == digest({"b": [1, 2], "a": 1}))
+    assert(digest({"a": 1}) != digest({"a": 2}))
+
+
+def test_unchanged_definitions_are_skipped_across_restarts(tmp_path):
+    path = str(tmp_path / "cache.json")
+    api = FakeAPI()
+
+    assert(asyncio.run(push_definitions(api, "Example FlatSat", DEFINITIONS, DefinitionsCache(path))) is True)
+    # A restart reads the cache back from disk
+    assert(asyncio.run(push_definitions(api, "Example FlatSat", DEFINITIONS, DefinitionsCache(path))) is False)
+    assert(api.pushes == 1)
+
+    # Changed definitions, another system, another host, or --force-definitions all push again
+    changed = {"ping": {"display_name": "Ping!", "fields": []}}
+    assert(asyncio.run(push_definitions(api, "Example FlatSat", changed, DefinitionsCache(path))) is True)
+    assert(asyncio.run(push_definitions(api, "Space Oddity", changed, DefinitionsCache(path))) is True)
+    assert(asyncio.run(push_definitions(FakeAPI("localhost:3001"), "Space Oddity", changed, DefinitionsCache(path))) is True)
+    # Another gateway on the same host has its own definitions
+    assert(asyncio.run(push_definitions(FakeAPI(gateway_token="other"), "Space Oddity", changed, DefinitionsCache(path))) is True)
+    assert("other" not in open(path).read())
+    assert(asyncio.run(push_definitions(api, "Space Oddity", changed, DefinitionsCache(path), force=True)) is True)
+    assert(api.pushes == 4)
+
+
+def test_unreadable_cache_is_ignored(tmp_path):
+    path = tmp_path / "cache.json"
+    path.write_text("not json")
+    assert(DefinitionsCache(str(path)).digests == {})
@@ -0,0 +1,125 @@
+import hashlib
+import os
+import threading
+import time
+
+import pytest
+
+from gateway.downlink_cache import DownlinkCache
+
+CHUNK = 16
+DATA = bytes(range(256)) * 4  # 64 chunks
+
+
+def fetcher(data, calls, fail_after=None, resumable=True):
+    def fetch(offset):
+        calls.append(offset)
+        start = offset if resumable else 0
+
+        def chunks():
+            for i, position in enumerate(range(start, len(data), 10)):
+                if fail_after is not None and i == fail_after:
+                    raise ConnectionError("Link dropped")
+                yield data[position:position + 10]
+        return start, chunks()
+    return fetch
+
+
+def test_downlink_is_content_addressed_and_cached(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    calls = []
+    digest, path = cache.downlink("image-1", fetcher(DATA, calls), meta={"content_type": "image/png"})
+    assert(digest == hashlib.sha256(DATA).hexdigest())
+    with open(path, "rb") as f:
+        assert(f.read() == DATA)
+
+    # The same source again isn't re-fetched, even after a restart
+    restarted = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    assert(restarted.downlink("image-1", fetcher(DATA, calls)) == (digest, path))
+    assert(calls == [0])
+    assert(restarted.meta(digest) == {"content_type": "image/png"})
+
+    # The same content under a different source is stored once
+    assert(restarted.downlink("image-1-copy", fetcher(DATA, calls))[0] == digest)
+    assert(os.listdir(restarted.objects_dir) == [digest])
+
+
+def test_interrupted_downlink_resumes_from_verified_chunks(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    calls = []
+    with pytest.raises(ConnectionError):
+        cache.downlink("image-1", fetcher(DATA, calls, fail_after=10))  # 100 bytes, 6 whole chunks
+
+    digest, path = cache.downlink("image-1", fetcher(DATA, calls))
+    assert(calls == [0, 6 * CHUNK])
+    with open(path, "rb") as f:
+        assert(f.read() == DATA)
+    assert(os.listdir(cache.partial_dir) == [])
+
+
+def test_corrupt_partial_is_refetched_from_last_good_chunk(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    calls = []
+    with pytest.raises(ConnectionError):
+        cache.downlink("image-1", fetcher(DATA, calls, fail_after=10))
+    part = [os.path.join(cache.partial_dir, name) for name in os.listdir(cache.partial_dir) if name.endswith(".part")][0]
+    with open(part, "r+b") as f:
+        f.seek(2 * CHUNK + 1)
+        f.write(b"\xff")
+
+    digest, path = cache.downlink("image-1", fetcher(DATA, calls))
+    assert(calls == [0, 2 * CHUNK])
+    assert(digest == hashlib.sha256(DATA).hexdigest())
+
+
+def test_source_without_resume_starts_over(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    calls = []
+    with pytest.raises(ConnectionError):
+        cache.downlink("image-1", fetcher(DATA, calls, fail_after=10))
+    digest, path = cache.downlink("image-1", fetcher(DATA, calls, resumable=False))
+    with open(path, "rb") as f:
+        assert(f.read() == DATA)
+
+
+def test_uploads_are_remembered_per_system(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    digest, _ = cache.downlink("image-1", fetcher(DATA, []))
+    assert(not cache.is_uploaded(digest, "Space Oddity"))
+    cache.mark_uploaded(digest, "Space Oddity")
+    restarted = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    assert(restarted.is_uploaded(digest, "Space Oddity"))
+    assert(not restarted.is_uploaded(digest, "Major Tom"))
+
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    cache = DownlinkCache(str(tmp_path), quota=3 * (len(DATA) + 1), chunk_size=CHUNK)
+    digests = [cache.downlink(f"image-{i}", fetcher(DATA + bytes([i]), []))[0] for i in range(3)]
+    cache.downlink("image-0", fetcher(b"", []))  # Touch, so image-1 is now the oldest
+    cache.downlink("image-3", fetcher(DATA + bytes([3]), []))
+
+    assert(cache.total_size() <= cache.quota)
+    assert(cache.lookup("image-1") is None)
+    assert(not os.path.exists(cache.object_path(digests[1])))
+    assert(cache.lookup("image-0") == digests[0])
+
+
+def test_concurrent_downlinks_of_a_key_fetch_it_once(tmp_path):
+    cache = DownlinkCache(str(tmp_path), chunk_size=CHUNK)
+    calls = []
+    fetch = fetcher(DATA, calls)
+
+    def slow_fetch(offset):
+        time.sleep(0.05)
+        return fetch(offset)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.downlink("image-1", slow_fetch))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert(calls == [0])
+    assert(len(set(results)) == 1)
+    with open(results[0][1], "rb") as f:
+        assert(f.read() == DATA)
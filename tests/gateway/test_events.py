@@ -0,0 +1,86 @@
+import asyncio
+
+from gateway.events import EventPipeline
+
+
+class FakeAPI:
+    def __init__(self):
+        self.batches = []
+
+    async def transmit_events(self, events):
+        self.batches.append(events)
+
+
+def cancel_forced(command_id):
+    return {"system": "Sat", "type": "Command Cancellation Forced", "command_id": command_id,
+            "level": "warning", "message": "Command is not running."}
+
+
+def test_repeats_are_aggregated_into_one_event():
+    async def run():
+        api = FakeAPI()
+        EventPipeline(window=0.1, flush_interval=0.02).install(api)
+        for i in range(50):
+            await api.transmit_events(events=[cancel_forced(i)])
+        await asyncio.sleep(0.05)
+        first = list(api.batches)
+        await asyncio.sleep(0.15)
+        return first, api.batches
+
+    first, batches = asyncio.run(run())
+    assert(len(first) == 1 and first[0][0]["command_id"] == 0)
+    summary = batches[-1][0]
+    assert(summary["message"] == "Command is not running. (repeated 49 more times in 0.1s)")
+    assert(summary["debug"]["repeats"] == 49)
+    assert(summary["debug"]["command_ids"] == list(range(1, 50)))
+    assert(sum(len(batch) for batch in batches) == 2)
+
+
+
+def test_repeats_are_reported_when_a_window_closes_between_flushes():
+    async def run():
+        api = FakeAPI()
+        pipeline = EventPipeline(window=0.1, flush_interval=1.0)
+        pipeline.install(api)
+        warning = {"system": "Sat", "type": "Flapping", "level": "warning", "message": "m"}
+        for _ in range(30):
+            await api.transmit_events(events=[warning])
+        await asyncio.sleep(0.15)
+        # The window has closed, but no flush has run since
+        await api.transmit_events(events=[warning])
+        await pipeline.flush()
+        return [event["message"] for batch in api.batches for event in batch]
+
+    assert(asyncio.run(run()) == ["m", "m (repeated 29 more times in 0.1s)", "m"])
+
+def test_storms_are_rate_limited_per_system_and_level_and_batched():
+    async def run():
+        api = FakeAPI()
+        pipeline = EventPipeline(window=0.1, rate=1, burst=5, flush_interval=0.02)
+        pipeline.install(api)
+        for i in range(20):
+            await api.transmit_events(events=[{"system": "Sat", "type": "Flapping", "level": "warning", "message": f"value {i}"}])
+        await api.transmit_events(events=[{"system": "Sat", "type": "Other", "level": "nominal", "message": "fine"}])
+        await asyncio.sleep(0.05)
+        first = list(api.batches)
+        await asyncio.sleep(0.15)
+        return first, api.batches, pipeline
+
+    first, batches, pipeline = asyncio.run(run())
+    # One batch, with the burst of warnings and the nominal event
+    assert(len(first) == 1 and len(first[0]) == 6)
+    summary = batches[-1][-1]
+    assert(summary["type"] == "Events Suppressed" and summary["debug"] == {"Flapping": 15})
+    assert(pipeline.stats["suppressed"] == 15)
+
+
+def test_critical_events_are_immediate():
+    async def run():
+        api = FakeAPI()
+        EventPipeline(flush_interval=10).install(api)
+        for _ in range(3):
+            await api.transmit_events(events=[{"system": "Sat", "type": "CRITICAL ERROR", "level": "critical", "message": "!"}])
+        return api.batches
+
+    batches = asyncio.run(run())
+    assert([len(batch) for batch in batches] == [1, 1, 1])
@@ -0,0 +1,55 @@
+from gateway.file_catalog import FileCatalog
+
+
+def make_file(i):
+    return {"name": f"Payload-Image-{i:04d}.png", "size": 1000 + i, "timestamp": 1600000000000 + i, "metadata": {"type": "image"}}
+
+
+def test_only_new_files_are_pending():
+    catalog = FileCatalog(page_size=2)
+    for i in range(5):
+        assert(catalog.add(make_file(i)))
+    assert(not catalog.add(make_file(0)))
+
+    pages = catalog.pending_pages()
+    assert([len(page) for page in pages] == [2, 2, 1])
+    for page in pages:
+        catalog.mark_reported(page)
+    assert(catalog.pending_pages() == [])
+
+    catalog.add(make_file(5))
+    assert(catalog.pending_pages() == [[make_file(5)]])
+    assert(len(catalog) == 6)
+
+
+def test_catalog_survives_restart(tmp_path):
+    path = str(tmp_path / "catalog.jsonl")
+    catalog = FileCatalog(path=path)
+    for i in range(3):
+        catalog.add(make_file(i))
+    catalog.mark_reported([make_file(0), make_file(1)])
+    with open(path, "a") as f:
+        f.write('{"add": {"name": "trunc')  # Crash mid-write
+
+    restarted = FileCatalog(path=path)
+    assert(len(restarted) == 3)
+    assert(make_file(1) in restarted)
+    assert(restarted.pending_pages() == [[make_file(2)]])
+
+    # The log was compacted on load, and is still readable afterwards
+    with open(path) as f:
+        assert(len(f.readlines()) == 5)
+    assert(FileCatalog(path=path).pending_pages() == [[make_file(2)]])
+
+
+def test_systems_sharing_a_path_keep_their_own_files(tmp_path):
+    path = str(tmp_path / ".file_catalog.jsonl")
+    flatsat = FileCatalog(path=path, system="Example FlatSat")
+    flatsat.add(make_file(0))
+    oddity = FileCatalog(path=path, system="Space Oddity")
+    assert(len(oddity) == 0)
+    oddity.add(make_file(1))
+
+    assert(flatsat.path == str(tmp_path / ".file_catalog.Example%20FlatSat.jsonl"))
+    assert(FileCatalog(path=path, system="Example FlatSat").pending_pages() == [[make_file(0)]])
+    assert(FileCatalog(path=path, system="Space Oddity").pending_pages() == [[make_file(1)]])
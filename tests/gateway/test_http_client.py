@@ -0,0 +1,129 @@
+import asyncio
+import threading
+import time
+import types
+
+import pytest
+import requests
+
+from gateway import http_client
+from gateway.downlink_cache import DownlinkCache, http_fetcher
+from gateway.http_client import HttpClient
+from loadtest.http_standin import HttpStandIn
+
+
+@pytest.fixture
+def standin():
+    server = HttpStandIn().start()
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def client():
+    c = HttpClient(backoff=0.01)
+    yield c
+    c.close()
+
+
+def make_api(standin):
+    return types.SimpleNamespace(host=standin.address, http=True, headers={"X-Gateway-Token": "test"})
+
+
+def test_connections_are_reused(standin, client):
+    for _ in range(20):
+        assert(client.get(standin.url + "/files/10").content == bytes(range(10)))
+    assert(standin.connections == 1)
+
+
+def test_idempotent_requests_are_retried(standin, client):
+    standin.fail_next = 2
+    assert(client.get(standin.url + "/files/10").status_code == 200)
+    assert(standin.requests == 3)
+
+    # Retries give up eventually
+    standin.fail_next = 10
+    assert(client.get(standin.url + "/files/10").status_code == 503)
+
+
+def test_posts_are_not_retried(standin, client):
+    standin.fail_next = 1
+    assert(client.post(standin.url + "/gateway_api/v1.0/downlinked_files", json={}).status_code == 503)
+    assert(standin.requests == 1)
+
+
+def test_connection_errors_are_retried_then_raised(client):
+    with pytest.raises(requests.ConnectionError):
+        client.get("http://127.0.0.1:9/unreachable")
+
+
+def test_concurrency_is_limited_per_host(standin):
+    client = HttpClient(max_per_host=2)
+    active = [0]
+    peak = [0]
+    lock = threading.Lock()
+    original = client.session.request
+
+    def counting_request(*args, **kwargs):
+        with lock:
+            active[0] += 1
+            peak[0] = max(peak[0], active[0])
+        try:
+            return original(*args, **kwargs)
+        finally:
+            with lock:
+                active[0] -= 1
+
+    client.session.request = counting_request
+    standin.latency = 0.02
+
+    async def fetch_all():
+        await asyncio.gather(*[client.aget(standin.url + "/files/10") for _ in range(10)])
+    asyncio.run(fetch_all())
+    client.close()
+    assert(peak[0] == 2)
+
+
+def test_file_flows(standin, client, tmp_path):
+    api = make_api(standin)
+    assert(http_client.download_staged_file(client, api, "/gateway_api/v1.0/staged_files/plan.txt") ==
+           ("plan.txt", b"staged plan.txt"))
+
+    path = tmp_path / "image.png"
+    path.write_bytes(b"pixels")
+    standin.fail_next = 1  # The POST for the upload URL isn't retried...
+    with pytest.raises(RuntimeError):
+        http_client.upload_downlinked_file(client, api, "image.png", str(path), system="Space Oddity")
+
+    http_client.upload_downlinked_file(client, api, "image.png", str(path), system="Space Oddity", command_id=7)
+    assert(standin.uploads["image.png"] == b"pixels")
+    assert(standin.downlinked_files[0]["signed_id"] == "signed-image.png")
+    assert(standin.downlinked_files[0]["command_id"] == 7)
+
+
+def test_http_fetcher_resumes_with_range(standin, client, tmp_path):
+    fetch = http_fetcher(standin.url + "/files/100", client=client)
+    start, chunks = fetch(40)
+    assert(start == 40)
+    assert(b"".join(chunks) == bytes(range(40, 100)))
+
+    digest, path = DownlinkCache(str(tmp_path)).downlink("files/100", fetch, meta=fetch.meta)
+    assert(open(path, "rb").read() == bytes(range(100)))
+    assert(fetch.meta == {"content_type": "application/octet-stream"})
+
+
+def test_streamed_responses_hold_their_host_slot_until_closed(standin):
+    client = HttpClient(max_per_host=1)
+    first = client.get(standin.url + "/files/10", stream=True)
+    waiting = client.executor.submit(client.get, standin.url + "/files/10")
+    time.sleep(0.1)
+    assert(not waiting.done())
+    with first:
+        assert(first.raw.read() == bytes(range(10)))
+    assert(waiting.result(1).status_code == 200)
+
+    # Reading a downlink to the end closes its response
+    fetch = http_fetcher(standin.url + "/files/10", client=client)
+    assert(b"".join(fetch(0)[1]) == bytes(range(10)))
+    assert(client.executor.submit(client.get, standin.url + "/files/10").result(1).status_code == 200)
+    client.close()
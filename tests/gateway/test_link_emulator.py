@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+from gateway.link_emulator import LinkEmulator, PassWindows, parse_link
+from gateway.scheduler import Scheduler
+
+
+class EchoSatellite:
+    ''' Answers every command straight away, with the frame it received. '''
+    name = "Echo"
+
+    def __init__(self):
+        self.received = []
+
+    def process_command(self, bytes, gateway):
+        self.received.append((time.monotonic(), bytes))
+        gateway.satellite_response(bytes, "pong")
+        gateway.set_command_status(1, "completed")
+
+
+class RecordingGateway:
+    def __init__(self):
+        self.calls = []
+        self.done = threading.Event()
+
+    def satellite_response(self, encrypted, response):
+        self.calls.append((time.monotonic(), "satellite_response", encrypted))
+
+    def set_command_status(self, command_id, status):
+        self.calls.append((time.monotonic(), "set_command_status", status))
+        self.done.set()
+
+
+def test_parse_link():
+    options = parse_link("bandwidth=9600,delay=0.25,loss=0.01,pass=600/120,seed=3")
+    assert({k: v for k, v in options.items() if k != "passes"} == {"bandwidth": 9600, "delay": 0.25, "loss": 0.01, "seed": 3})
+    assert((options["passes"].period, options["passes"].duration) == (600, 120))
+    with pytest.raises(ValueError):
+        parse_link("speed=fast")
+
+
+def test_bandwidth_and_delay_hold_frames_back():
+    scheduler = Scheduler()
+    satellite = EchoSatellite()
+    gateway = RecordingGateway()
+    # 100 byte frames take 10ms each at 80 kbit/s
+    link = LinkEmulator(satellite, bandwidth=80000, delay=0.02, scheduler=scheduler)
+    start = time.monotonic()
+    threads = [threading.Thread(target=link.process_command, args=(b"x" * 100, gateway)) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    arrivals = sorted(t - start for t, _ in satellite.received)
+    assert(arrivals[0] >= 0.03)
+    assert(arrivals[-1] >= 0.07)
+
+    assert(gateway.done.wait(1))
+    time.sleep(0.1)
+    responses = [t for t, kind, _ in gateway.calls if kind == "satellite_response"]
+    assert(len(responses) == 5)
+    assert(min(responses) - start >= 0.06)
+    assert(link.name == "Echo")
+    scheduler.stop()
+
+
+def test_loss_corruption_and_passes():
+    satellite = EchoSatellite()
+    gateway = RecordingGateway()
+    lossy = LinkEmulator(satellite, loss=1.0)
+    lossy.process_command(b"lost", gateway)
+    assert(satellite.received == [])
+    assert(lossy.stats["lost"] == 1)
+
+    # Corrupted frames fail their checksum and never reach the satellite
+    corrupting = LinkEmulator(satellite, corruption=1.0, seed=1)
+    for _ in range(20):
+        corrupting.process_command(b"\x00" * 8, gateway)
+    assert(satellite.received == [])
+    assert(corrupting.stats["corrupted"] == 20)
+
+    clean = LinkEmulator(satellite, seed=1)
+    clean.process_command(b"\x00" * 8, gateway)
+    assert(satellite.received[-1][1] == b"\x00" * 8)
+
+    # Half an hour into a 10 minute pass every hour and a half, the satellite is out of view
+    out_of_view = LinkEmulator(satellite, passes=PassWindows(5400, 600, start=time.monotonic() - 1800))
+    out_of_view.process_command(b"unheard", gateway)
+    assert(out_of_view.stats["out_of_pass"] == 1)
+    assert(len(satellite.received) == 1)
+
+
+def test_jitter_does_not_reorder_a_direction():
+    scheduler = Scheduler()
+    satellite = EchoSatellite()
+    gateway = RecordingGateway()
+    # Jitter far larger than the gaps between frames
+    link = LinkEmulator(satellite, delay=0.01, jitter=0.05, scheduler=scheduler, seed=2)
+    for number in range(20):
+        link.process_command(bytes([number]), gateway)
+    deadline = time.monotonic() + 2
+    while len(gateway.calls) < 40 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    scheduler.stop()
+
+    # Each response is followed by its command's status, and the responses arrive in order
+    kinds = [kind for _, kind, _ in gateway.calls]
+    assert(kinds == ["satellite_response", "set_command_status"] * 20)
+    frames = [frame for _, kind, frame in gateway.calls if kind == "satellite_response"]
+    assert(frames == [bytes([number]) for number in range(20)])
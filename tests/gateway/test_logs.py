@@ -0,0 +1,100 @@
+import io
+import json
+import logging
+import threading
+import time
+
+import pytest
+
+from gateway.logs import SamplingFilter, configure_logging
+
+
+@pytest.fixture
+def root_logger():
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    yield root
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    for handler in handlers:
+        root.addHandler(handler)
+    root.setLevel(level)
+
+
+class Formatted:
+    ''' Remembers which threads turned it into a string, and can change after it is logged. '''
+
+    def __init__(self):
+        self.threads = []
+        self.value = "formatted"
+
+    def __str__(self):
+        self.threads.append(threading.current_thread().name)
+        return self.value
+
+
+def test_only_records_that_are_logged_are_formatted(root_logger):
+    stream = io.StringIO()
+    listener = configure_logging(level=logging.INFO, sample_rate=1, sample_burst=1, stream=stream)
+    logger = logging.getLogger("test.lazy")
+    skipped, logged, sampled = Formatted(), Formatted(), Formatted()
+    logger.debug("Below the level: %s", skipped)
+    logger.info("Logged: %s", logged)
+    logger.info("Logged: %s", sampled)
+    # The message is merged as the record is queued, so later changes don't show
+    logged.value = "changed"
+    listener.stop()
+    listener.stop()
+
+    assert(skipped.threads == [] and sampled.threads == [])
+    assert(logged.threads == [threading.current_thread().name])
+    assert(stream.getvalue().endswith(" - test.lazy - INFO - Logged: formatted\n"))
+
+
+def test_json_output(root_logger):
+    stream = io.StringIO()
+    listener = configure_logging(level=logging.INFO, json_output=True, sample_rate=0, stream=stream)
+    logger = logging.getLogger("test.json")
+    logger.info("Command %s sent", 7, extra={"command_id": 7})
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logger.exception("Failed")
+    listener.stop()
+
+    sent, failed = [json.loads(line) for line in stream.getvalue().splitlines()]
+    assert((sent["level"], sent["logger"], sent["message"], sent["command_id"]) == ("INFO", "test.json", "Command 7 sent", 7))
+    assert(failed["level"] == "ERROR" and "ValueError: bad" in failed["exception"])
+
+
+def test_sampling_per_logger_and_message():
+    sampling = SamplingFilter(rate=100, burst=5, rates={"test.quiet": 0})
+
+    def record(name, msg, level=logging.INFO):
+        return logging.LogRecord(name, level, __file__, 0, msg, (), None)
+
+    passed = [sampling.filter(record("test.busy", "Status %s")) for _ in range(50)]
+    assert(passed.count(True) == 5)
+    # Other messages, warnings and unsampled loggers have their own allowance
+    assert(sampling.filter(record("test.busy", "Other %s")))
+    assert(all(sampling.filter(record("test.busy", "Status %s", logging.WARNING)) for _ in range(10)))
+    assert(all(sampling.filter(record("test.quiet.child", "Status %s")) for _ in range(10)))
+
+    time.sleep(0.02)
+    next_record = record("test.busy", "Status %s")
+    assert(sampling.filter(next_record))
+    assert(next_record.suppressed == 45)
+
+
+def test_sampling_tracks_a_bounded_number_of_templates():
+    sampling = SamplingFilter(rate=100, burst=1, max_templates=10)
+
+    def record(msg):
+        return logging.LogRecord("test.busy", logging.INFO, __file__, 0, msg, (), None)
+
+    # Messages formatted before they're logged make a new template each time
+    for number in range(1000):
+        sampling.filter(record(f"Status {number}"))
+        sampling.filter(record(f"Status {number}"))
+    assert(len(sampling.buckets) == 10 and len(sampling.suppressed) <= 10)
+    assert(("test.busy", "Status 999") in sampling.buckets and ("test.busy", "Status 0") not in sampling.buckets)
@@ -0,0 +1,71 @@
+import asyncio
+import json
+
+from gateway.metric_batch import MetricBatch, MetricChannels, transmit_batch
+from gateway.outbound import OutboundScheduler
+
+
+class FakeWebsocket:
+    def __init__(self):
+        self.sent = []
+
+    async def send(self, text):
+        self.sent.append(text)
+
+
+class FakeAPI:
+    def __init__(self, websocket=None):
+        self.websocket = websocket
+        self.transmitted = []
+
+    async def transmit(self, payload):
+        self.transmitted.append(payload)
+
+    async def transmit_metrics(self, metrics):
+        await self.transmit({"type": "measurements", "measurements": metrics})
+
+
+def test_batch_encodes_the_same_json_as_dicts():
+    channels = MetricChannels()
+    assert(channels.prefix("Sat", "battery", "voltage") is channels.prefix("Sat", "battery", "voltage"))
+
+    batch = MetricBatch(timestamp=1000)
+    batch.add(channels.prefix("Sat", "battery", "voltage"), 3.9)
+    batch.add(channels.prefix('Sat "2"', "obc", "uptime"), 12, timestamp=1001)
+    batch.add(channels.prefix("Sat", "obc", "mode"), "safe")
+    batch.add(channels.prefix("Sat", "obc", "ok"), True)
+    expected = [
+        {"system": "Sat", "subsystem": "battery", "metric": "voltage", "value": 3.9, "timestamp": 1000},
+        {"system": 'Sat "2"', "subsystem": "obc", "metric": "uptime", "value": 12, "timestamp": 1001},
+        {"system": "Sat", "subsystem": "obc", "metric": "mode", "value": "safe", "timestamp": 1000},
+        {"system": "Sat", "subsystem": "obc", "metric": "ok", "value": True, "timestamp": 1000},
+    ]
+    assert(batch.metrics() == expected)
+    assert(json.loads(batch.message().text) == {"type": "measurements", "measurements": expected})
+
+
+def test_outbound_sends_encoded_text_as_it_is():
+    async def run(api):
+        OutboundScheduler().install(api)
+        batch = MetricBatch(timestamp=1)
+        batch.add(MetricChannels().prefix("Sat", "battery", "voltage"), 4.0)
+        await transmit_batch(api, batch)
+
+    connected = FakeAPI(FakeWebsocket())
+    asyncio.run(run(connected))
+    assert(connected.websocket.sent == [
+        '{"type":"measurements","measurements":[{"system":"Sat","subsystem":"battery","metric":"voltage","value":4.0,"timestamp":1}]}'])
+    assert(connected.transmitted == [])
+
+    # While disconnected, GatewayAPI queues dicts
+    disconnected = FakeAPI()
+    asyncio.run(run(disconnected))
+    assert(disconnected.transmitted[0]["measurements"][0]["value"] == 4.0)
+
+    # Without the outbound lanes, the batch goes through transmit_metrics
+    plain = FakeAPI()
+    batch = MetricBatch(timestamp=1)
+    batch.add(MetricChannels().prefix("Sat", "battery", "voltage"), 4.0)
+    asyncio.run(transmit_batch(plain, batch))
+    assert(plain.transmitted == [{"type": "measurements", "measurements": batch.metrics()}])
+
@@ -0,0 +1,185 @@
+import asyncio
+
+import pytest
+
+from gateway.outbound import AdaptiveTokenBucket, OutboundScheduler, lane_for, parse_rates, retry_after_of
+
+
+class SlowLink:
+    ''' Stands in for GatewayAPI, taking a little while to send each message. '''
+
+    def __init__(self, delay=0.001, connected=True):
+        self.delay = delay
+        self.sent = []
+        self.websocket = object() if connected else None
+
+    async def transmit(self, payload):
+        await asyncio.sleep(self.delay)
+        self.sent.append(payload)
+
+
+def metrics(i):
+    return {"type": "measurements", "measurements": [{"metric": "m", "value": i}]}
+
+
+def status(i):
+    return {"type": "command_update", "command": {"id": i, "state": "failed"}}
+
+
+def test_lanes_by_message_type():
+    assert(lane_for(status(1)) == "command")
+    assert(lane_for({"type": "transmit_blob"}) == "command")
+    assert(lane_for({"type": "events"}) == "events")
+    assert(lane_for(metrics(1)) == "metrics")
+    assert(lane_for({"type": "file_list"}) == "bulk")
+    assert(retry_after_of({"rate_limit": {"retry_after": "2.5"}}) == 2.5)
+    assert(retry_after_of({"rate_limit": "Too many messages"}) == 5.0)
+
+
+def test_parse_rates():
+    assert(parse_rates("metrics=50, bulk=2.5") == {"metrics": 50, "bulk": 2.5})
+    for text in ("telemetry=5", "metrics", "metrics=fast", "bulk=-1"):
+        with pytest.raises(ValueError):
+            parse_rates(text)
+
+
+def test_command_state_overtakes_telemetry_backlog():
+    async def run():
+        api = SlowLink()
+        outbound = OutboundScheduler()
+        outbound.install(api)
+        backlog = [asyncio.ensure_future(api.transmit(metrics(i))) for i in range(50)]
+        await asyncio.sleep(0.005)
+        await api.transmit(status(1))
+        position = len(api.sent) - 1
+        await asyncio.gather(*backlog)
+        return api, position
+
+    api, position = asyncio.run(run())
+    assert(len(api.sent) == 51)
+    assert(position < 10)
+    # Each lane keeps its own order
+    assert([p["measurements"][0]["value"] for p in api.sent if p["type"] == "measurements"] == list(range(50)))
+
+
+def test_weighted_fair_share():
+    async def run():
+        api = SlowLink(delay=0)
+        outbound = OutboundScheduler(weights={"metrics": 3, "bulk": 1})
+        outbound.install(api)
+        await asyncio.gather(*[api.transmit(p) for i in range(40) for p in (metrics(i), {"type": "file_list"})])
+        return api
+
+    first = asyncio.run(run()).sent[:40]
+    share = sum(1 for p in first if p["type"] == "measurements") / len(first)
+    assert(0.7 <= share <= 0.8)
+
+
+def test_lane_rate_limit():
+    async def run():
+        api = SlowLink(delay=0)
+        outbound = OutboundScheduler(rates={"bulk": 50})
+        outbound.install(api)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        await asyncio.gather(*[api.transmit({"type": "file_list"}) for _ in range(60)])
+        return loop.time() - start
+
+    # A burst of 50, then 10 more at 50/s
+    assert(0.15 <= asyncio.run(run()) < 1.0)
+
+
+def test_rate_limit_sheds_lowest_priority_first():
+    async def run():
+        api = SlowLink()
+        outbound = OutboundScheduler()
+        outbound.install(api)
+        await api.transmit(status(0))
+
+        await outbound.rate_limit_callback({"type": "rate_limit", "rate_limit": {"retry_after": 0.2}})
+        assert(outbound.shed_lanes() == ("bulk",))
+        bulk = asyncio.ensure_future(api.transmit({"type": "file_list"}))
+        assert(await api.transmit(metrics(1)) is True)
+
+        await outbound.rate_limit_callback({"type": "rate_limit", "rate_limit": {"retry_after": 0.2}})
+        assert(outbound.shed_lanes() == ("bulk", "metrics"))
+        assert(await outbound.submit(metrics(2)) is False)
+        await api.transmit(status(1))
+        assert(not bulk.done())
+
+        # Held traffic goes out once the backoff is over
+        await bulk
+        assert(outbound.shed_lanes() == ())
+        return api, outbound
+
+    api, outbound = asyncio.run(run())
+    assert([p["type"] for p in api.sent] == ["command_update", "measurements", "command_update", "file_list"])
+    assert(outbound.dropped["metrics"] == 1)
+
+
+def test_adaptive_rate_is_cut_and_recovers():
+    bucket = AdaptiveTokenBucket(rate=100, minimum=10, maximum=200, increase=20)
+    bucket.throttle()
+    assert(bucket.rate == 50)
+    for _ in range(5):
+        bucket.throttle()
+    assert(bucket.rate == 10)
+
+    # Grows by `increase` per second spent sending, capped per gap so idling doesn't count
+    for i in range(21):
+        bucket.take(now=i * 0.1)
+    assert(abs(bucket.rate - 50) < 1e-6)
+    bucket.take(now=60)
+    assert(abs(bucket.rate - 70) < 1e-6)
+
+
+def test_rate_limit_slows_every_shared_lane():
+    async def run():
+        api = SlowLink(delay=0)
+        outbound = OutboundScheduler(adaptive=AdaptiveTokenBucket(rate=80, minimum=1, increase=0))
+        outbound.install(api)
+        await outbound.rate_limit_callback({"type": "rate_limit", "rate_limit": {"retry_after": 0}})
+        assert(outbound.adaptive.rate == 40)
+        loop = asyncio.get_event_loop()
+        start = loop.time()
+        # Bulk isn't shared, so only the command and event messages count against the 40/s
+        await asyncio.gather(*[api.transmit(p) for _ in range(30) for p in (status(1), {"type": "events"})],
+                             *[api.transmit({"type": "file_list"}) for _ in range(100)])
+        return loop.time() - start
+
+    # 40 go out at once (the burst), the other 20 at 40/s
+    assert(0.4 <= asyncio.run(run()) < 1.5)
+
+
+def test_outbound_rate_is_reported():
+    async def run():
+        api = SlowLink(delay=0)
+        outbound = OutboundScheduler(system="Space Oddity", metric_interval=0.05)
+        outbound.install(api)
+        await api.transmit(status(1))
+        await asyncio.sleep(0.12)
+        return api
+
+    reports = [p for p in asyncio.run(run()).sent if p["type"] == "measurements"]
+    assert(len(reports) >= 2)
+    assert(reports[0]["measurements"][0]["metric"] == "outbound_rate")
+    assert(reports[0]["measurements"][0]["value"] == 1000)
+
+
+def test_outbound_rate_reports_skip_disconnects_and_the_adaptive_rate():
+    async def run(connected):
+        api = SlowLink(delay=0, connected=connected)
+        outbound = OutboundScheduler(system="Space Oddity", metric_interval=0.02, adaptive=AdaptiveTokenBucket(rate=1, minimum=1))
+        outbound.install(api)
+        await api.transmit(status(1))
+        await asyncio.sleep(0.2)
+        return api, outbound
+
+    api, _ = asyncio.run(run(connected=False))
+    assert([p["type"] for p in api.sent] == ["command_update"])
+
+    # At 1 message a second only the status would go out, if the reports counted against the rate
+    api, outbound = asyncio.run(run(connected=True))
+    reports = [p for p in api.sent if p["type"] == "measurements"]
+    assert(len(reports) >= 5)
+    assert(outbound.adaptive.rate == 1)
@@ -0,0 +1,71 @@
+import threading
+import time
+from unittest import mock
+import requests
+from gateway.gateway import Gateway
+from gateway.profiler import SamplingProfiler
+from majortom_gateway.command import Command
+
+
+def busy_worker(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+def test_profiler_collapses_stacks(tmp_path):
+    stop = threading.Event()
+    worker = threading.Thread(target=busy_worker, args=(stop,), name="busy")
+    worker.start()
+    profiler = SamplingProfiler(interval=0.001)
+    try:
+        profiler.profile(0.2)
+    finally:
+        stop.set()
+        worker.join()
+
+    assert(profiler.samples > 0)
+    lines = profiler.collapsed().splitlines()
+    assert(any(line.startswith("busy;") and "busy_worker (test_profiler.py:" in line for line in lines))
+    for line in lines:
+        stack, count = line.rsplit(" ", 1)
+        assert(int(count) > 0)
+        assert("sampling-profiler" not in stack)
+
+    path = profiler.write(str(tmp_path / "out.collapsed"))
+    with open(path) as f:
+        assert(f.read() == profiler.collapsed())
+
+
+def test_profile_command_uploads_collapsed_stacks():
+    api = mock.MagicMock()
+    uploaded = {}
+
+    def upload(client, api, filename, filepath, **kwargs):
+        with open(filepath) as f:
+            uploaded[filename] = f.read()
+
+    gateway = Gateway(api=api)
+    command = Command({"id": 7, "type": "profile", "system": "Example FlatSat",
+                       "fields": [{"name": "duration", "value": 0.1}]})
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f), \
+            mock.patch("gateway.http_client.upload_downlinked_file", side_effect=upload):
+        gateway.command_callback(command, api)
+
+    assert(list(uploaded) == ["gateway-profile-7.collapsed"])
+    assert(uploaded["gateway-profile-7.collapsed"] != "")
+    assert(api.transmit_command_update.call_args.kwargs["state"] == "completed")
+
+
+def test_profile_command_fails_when_the_upload_gives_up():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    command = Command({"id": 8, "type": "profile", "system": "Example FlatSat",
+                       "fields": [{"name": "duration", "value": 0.05}]})
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f), \
+            mock.patch("gateway.http_client.upload_downlinked_file",
+                       side_effect=requests.ConnectionError("Major Tom unreachable")):
+        gateway.command_callback(command, api)
+
+    update = api.transmit_command_update.call_args.kwargs
+    assert(update["state"] == "failed")
+    assert(update["dict"]["errors"] == ["Profile failed to upload", "Major Tom unreachable"])
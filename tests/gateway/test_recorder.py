@@ -0,0 +1,47 @@
+import asyncio
+
+from majortom_gateway.command import Command
+
+from gateway.recorder import SessionRecorder, load_session
+
+
+def test_recorded_messages_match_what_major_tom_sent(tmp_path):
+    path = str(tmp_path / "session.jsonl")
+    recorder = SessionRecorder(path)
+    calls = []
+
+    def command_callback(command, api):
+        calls.append(("command", command.id))
+
+    async def cancel_callback(command_id, api):
+        calls.append(("cancel", command_id))
+
+    callbacks = recorder.wrap_callbacks(
+        command_callback=command_callback,
+        cancel_callback=cancel_callback,
+        received_blob_callback=lambda blob, context, api: calls.append(("blob", blob)),
+        transit_callback=None,
+        error_callback=print)
+    assert(callbacks["error_callback"] is print)
+    assert(callbacks["transit_callback"] is None)
+    assert(asyncio.iscoroutinefunction(callbacks["cancel_callback"]))
+
+    command = {"id": 3, "type": "ping", "system": "Example FlatSat", "fields": []}
+    callbacks["command_callback"](Command(command), None)
+    asyncio.run(callbacks["cancel_callback"](3, None))
+    callbacks["received_blob_callback"](b"\x00\x01", {"norad_id": 1}, None)
+    recorder.close()
+    recorder.close()
+    # Callbacks that run after the recorder is closed aren't recorded
+    callbacks["command_callback"](Command(command), None)
+    assert(calls == [("command", 3), ("cancel", 3), ("blob", b"\x00\x01"), ("command", 3)])
+
+    with open(path, "a") as f:
+        f.write('[1600000000.0,{"type":"comm')  # Crash mid-write
+    session = load_session(path)
+    assert([message for _, message in session] == [
+        {"type": "command", "command": command},
+        {"type": "cancel", "command": {"id": 3}},
+        {"type": "received_blob", "blob": "AAE=", "context": {"norad_id": 1}},
+    ])
+    assert(session[0][0] <= session[1][0] <= session[2][0])
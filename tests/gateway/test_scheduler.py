@@ -0,0 +1,70 @@
+import threading
+import time
+from unittest import mock
+
+from gateway import stubs
+from gateway.scheduler import Scheduler
+from majortom_gateway.command import Command
+from satellite.satellite import Satellite
+
+
+def test_calls_run_in_due_order():
+    scheduler = Scheduler()
+    ran = []
+    done = threading.Event()
+    scheduler.call_later(0.06, lambda: (ran.append("last"), done.set()))
+    scheduler.call_later(0.02, ran.append, "first")
+    scheduler.call_later(0.02, ran.append, "second")
+    cancelled = scheduler.call_later(0.04, ran.append, "cancelled")
+    cancelled.cancel()
+    assert(scheduler.pending() == 3)
+
+    assert(done.wait(1))
+    assert(ran == ["first", "second", "last"])
+    scheduler.stop()
+
+
+def test_a_failing_call_does_not_stop_the_thread():
+    scheduler = Scheduler()
+    done = threading.Event()
+    scheduler.call_later(0, lambda: 1 / 0)
+    scheduler.call_later(0.01, done.set)
+    assert(done.wait(1))
+    scheduler.stop()
+    assert(not scheduler._thread.is_alive())
+
+
+def test_ping_burst_uses_a_fixed_set_of_threads():
+    scheduler = Scheduler()
+    satellite = Satellite(scheduler=scheduler)
+    gateway = mock.Mock()
+    responded = threading.Semaphore(0)
+    gateway.satellite_response.side_effect = lambda encrypted, response: responded.release()
+    ping = stubs.encrypt(stubs.packetize(stubs.translate_command_to_binary(
+        Command({"id": 1, "type": "ping", "system": satellite.name, "fields": []}))))
+
+    threads = threading.active_count()
+    peak = threads
+    for _ in range(10000):
+        satellite.process_command(ping, gateway)
+        peak = max(peak, threading.active_count())
+    # Responses wait for their second before any worker starts
+    assert(peak <= threads + 1)
+
+    deadline = time.monotonic() + 10
+    for _ in range(10000):
+        assert(responded.acquire(timeout=max(0, deadline - time.monotonic())))
+    # The scheduler's thread, and its workers for responses, which may wait on the websocket
+    assert(threading.active_count() <= threads + 1 + scheduler.workers)
+    scheduler.stop()
+
+
+def test_a_blocking_call_does_not_hold_up_the_others():
+    scheduler = Scheduler(workers=2)
+    release, done = threading.Event(), threading.Event()
+    scheduler.call_later_blocking(0, release.wait, 5)
+    scheduler.call_later(0.01, done.set)
+    # The slow call waits on a worker, not the scheduler thread
+    assert(done.wait(1))
+    release.set()
+    scheduler.stop()
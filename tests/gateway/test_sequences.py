@@ -0,0 +1,86 @@
+import json
+import threading
+import time
+from unittest import mock
+
+import pytest
+from majortom_gateway.command import Command
+
+from gateway.gateway import Gateway
+from gateway.sequences import parse_steps
+
+
+def sequence(steps, id=9):
+    return Command({"id": id, "type": "run_sequence", "system": "Example FlatSat",
+                    "fields": [{"name": "steps", "value": json.dumps(steps)}]})
+
+
+def updates(api):
+    return [c.kwargs for c in api.transmit_command_update.call_args_list]
+
+
+def test_steps_are_pipelined_in_one_round_trip():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    start = time.monotonic()
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        gateway.command_callback(sequence([{"type": "ping"}] * 50), api)
+    # Every ping takes a second to answer, but they're all in flight together
+    assert(time.monotonic() - start < 5)
+
+    sent = updates(api)
+    # Only the sequence itself is reported to Major Tom, not its steps
+    assert({update["command_id"] for update in sent} == {9})
+    assert(sent[0]["state"] == "executing_on_system")
+    assert(sent[-1]["state"] == "completed" and sent[-1]["dict"]["payload"] == "Completed 50 steps")
+    assert(sent[-2]["dict"]["progress_2_current"] == 50 and sent[-2]["dict"]["progress_1_current"] == 50)
+    assert(gateway.sequences.runs == {} and gateway.sequences.steps == {})
+
+
+def test_completed_condition_stops_the_sequence_after_a_failure():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    steps = [
+        {"type": "telemetry", "fields": {"mode": "SIDEWAYS", "duration": 1}},
+        {"type": "error"},
+        {"type": "ping", "condition": "completed"},
+    ]
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        gateway.command_callback(sequence(steps), api)
+
+    final = updates(api)[-1]
+    assert(final["state"] == "failed")
+    assert(final["dict"]["errors"] == [
+        "Step 1 (telemetry): mode is invalid. Must be one of: NOMINAL, ERROR. Value: SIDEWAYS",
+        "Step 2 (error): Command purposely failed.",
+        "Step 3 (ping) was not sent",
+    ])
+
+
+def test_cancelling_stops_sending_steps():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        running = threading.Thread(
+            target=gateway.command_callback, args=(sequence([{"type": "ping", "delay": 10}]), api))
+        running.start()
+        time.sleep(0.1)
+        gateway.cancel_callback(9, api)
+        running.join(1)
+
+    assert(not running.is_alive())
+    states = [update["state"] for update in updates(api)]
+    assert(states[0] == "executing_on_system" and states[-1] == "cancelled")
+    assert(states.count("cancelled") == 1 and "completed" not in states)
+
+
+def test_invalid_steps_are_rejected():
+    for steps, error in [
+            ("[{", "steps is not valid JSON"),
+            ("[]", "steps must be a non-empty list"),
+            ([{"type": "ping", "delay": -1}], "Step 1 delay must be a number of seconds"),
+            ([{"type": "ping"}, {"type": "ping", "condition": "sometimes"}], "Step 2 condition must be one of: always, completed"),
+            ([{"type": "run_sequence"}], "Step 1 can't be another sequence"),
+            ([{"type": "ping"}, {"type": "connect"}], r"Step 2 \(connect\) is run by the gateway")]:
+        with pytest.raises(ValueError, match=error):
+            parse_steps(steps)
@@ -0,0 +1,111 @@
+import hashlib
+import mmap
+import os
+import tracemalloc
+import types
+from unittest import mock
+
+from gateway import http_client, stubs
+from gateway.gateway import Gateway
+from gateway.spool import PayloadSpool
+from loadtest.http_standin import HttpStandIn
+
+MB = 1024 * 1024
+
+
+def test_segments_are_zero_copy_views(tmp_path):
+    spool = PayloadSpool(path=str(tmp_path / "payload.spool"), chunk_size=4)
+    first = spool.append(b"0123456789", meta={"norad_id": "00000"})
+    second = spool.append(iter([b"abc", b"def"]))
+    assert((first.offset, first.size, second.offset, second.size) == (0, 10, 10, 6))
+
+    view = second.view()
+    assert(isinstance(view.obj, mmap.mmap))
+    assert(view == b"abcdef")
+    assert(first.view(2, 5) == b"234")
+
+    with first.open() as f:
+        assert([bytes(f.read(4)) for _ in range(4)] == [b"0123", b"4567", b"89", b""])
+        f.seek(-3, os.SEEK_END)
+        assert(f.read() == b"789")
+    spool.close()
+    assert(not os.path.exists(spool.path))
+
+
+def test_spool_starts_over_once_everything_is_discarded(tmp_path):
+    spool = PayloadSpool(path=str(tmp_path / "payload.spool"))
+    first = spool.append(b"first")
+    second = spool.append(b"second")
+    held = first.view()
+    spool.discard(first)
+    assert(spool.size() == 11)
+    spool.discard(second)
+    assert(spool.size() == 0)
+    # A view taken before the reset still reads the old data
+    assert(held == b"first")
+    assert(spool.append(b"third").offset == 0)
+
+
+def test_large_products_use_bounded_memory(tmp_path):
+    spool = PayloadSpool(path=str(tmp_path / "payload.spool"))
+    chunk = os.urandom(MB)
+
+    tracemalloc.start()
+    try:
+        segment = spool.append(chunk for _ in range(64))
+        digest = hashlib.sha256()
+        with segment.open() as f:
+            for data in iter(lambda: f.read(MB), b""):
+                digest.update(data)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    assert(segment.size == 64 * MB)
+    assert(digest.digest() == hashlib.sha256(chunk * 64).digest())
+    assert(peak < 4 * MB)
+
+
+def test_segments_upload_without_copying_to_disk(tmp_path):
+    server = HttpStandIn().start()
+    client = http_client.HttpClient()
+    try:
+        spool = PayloadSpool(path=str(tmp_path / "payload.spool"))
+        spool.append(b"not this one")
+        segment = spool.append(b"science" * 1000)
+        api = types.SimpleNamespace(host=server.address, http=True, headers={})
+        http_client.upload_downlinked_file(client, api, "product.bin", segment, system="Example FlatSat")
+        assert(server.uploads["product.bin"] == b"science" * 1000)
+    finally:
+        client.close()
+        server.stop()
+
+
+def test_gateway_spools_payload_frames():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    payload = stubs.PAYLOAD_MARKER + b"\x00" * 5000
+    received = []
+    with mock.patch("gateway.stubs.send_to_data_pipeline",
+                    side_effect=lambda segment: received.append((bytes(segment.view()), segment.meta))):
+        gateway.received_blob_callback(stubs.pack_frames([payload]), {"norad_id": "00000"})
+
+    assert(received == [(payload, {"norad_id": "00000"})])
+    api.transmit_command_update.assert_not_called()
+    path = gateway.spool.path
+    gateway.close()
+    assert(not os.path.exists(path))
+
+
+def test_spooled_payloads_are_discarded_once_consumed():
+    gateway = Gateway(api=mock.MagicMock())
+    payload = stubs.PAYLOAD_MARKER + b"\x00" * 100000
+    sizes = []
+    with mock.patch("gateway.stubs.send_to_data_pipeline"):
+        for _ in range(50):
+            gateway.received_blob_callback(stubs.pack_frames([payload]), {"norad_id": "00000"})
+            sizes.append(gateway.spool.size())
+    # The spool doesn't grow by a payload per blob
+    assert(max(sizes) < 2 * len(payload))
+    assert(gateway.spool.segments == {})
+    gateway.close()
@@ -0,0 +1,72 @@
+import json
+from unittest import mock
+from gateway import stubs
+from gateway.gateway import Gateway
+from gateway.statuses import CommandStatus
+from gateway.tracing import Tracer, load_spans, percentile, summarize
+from majortom_gateway.command import Command
+
+
+def make_command(id=1, type="ping"):
+    return Command({"id": id, "type": type, "system": "Example FlatSat", "fields": []})
+
+
+def test_trace_id_rides_inside_frame():
+    encoded = stubs.translate_command_to_binary(make_command(), trace_id="abc123")
+    decoded = stubs.translate_binary_to_command(encoded)
+
+    assert(stubs.trace_id_of(decoded) == "abc123")
+    # Re-encoding a decoded command (as the satellite does) keeps the trace id
+    assert(stubs.trace_id_of(stubs.translate_binary_to_command(stubs.translate_command_to_binary(decoded))) == "abc123")
+
+
+def test_untraced_frame_is_unchanged():
+    command = make_command()
+    assert(json.loads(stubs.translate_command_to_binary(command)) == command.json_command)
+    assert(stubs.trace_id_of(command) is None)
+
+
+def test_disabled_tracer_records_nothing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tracer = Tracer()
+    assert(tracer.start_trace(1) is None)
+    with mock.patch("gateway.tracing.time") as clock:
+        # Even with a trace id, spans and records are no-ops
+        with tracer.span("abc123", "stage"):
+            pass
+        tracer.record("abc123", "stage", 0.0, 1.0)
+        tracer.end_trace(1)
+    assert(not clock.mock_calls)
+    assert(tracer.trace_for(1) is None and tracer._commands == {})
+    tracer.close()
+    assert(list(tmp_path.iterdir()) == [])
+
+
+def test_command_spans_are_written(tmp_path):
+    path = str(tmp_path / "spans.jsonl")
+    gateway = Gateway(api=mock.MagicMock(), tracer=Tracer(path))
+    # Respond immediately instead of waiting on the simulated downlink
+    with mock.patch.object(gateway.satellite, "respond_later",
+                           lambda delay, gw, encrypted, response, trace_id=None: gw.satellite_response(encrypted, response)):
+        with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+            gateway.command_callback(make_command(), api=gateway.api)
+    gateway.tracer.close()
+
+    stages = load_spans(path)
+    for stage in ("gateway.encode", "gateway.uplink", "satellite.decode", "gateway.decode_response",
+                  "gateway.set_command_status", "end_to_end"):
+        assert(stage in stages)
+    assert(len(stages["end_to_end"]) == 1)
+
+    with open(path) as f:
+        traces = {json.loads(line)["trace"] for line in f}
+    assert(len(traces) == 1)
+
+
+def test_percentiles():
+    values = sorted(range(1, 101))
+    assert(percentile(values, 50) == 50)
+    assert(percentile(values, 99) == 99)
+    assert(percentile(values, 100) == 100)
+    rows = summarize({"stage": [0.3, 0.1, 0.2]})
+    assert(rows[0][0] == "stage" and rows[0][1] == 3 and rows[0][3] == 0.3)
@@ -0,0 +1,82 @@
+import threading
+import time
+from unittest import mock
+
+from majortom_gateway.command import Command
+
+from gateway import stubs
+from gateway.gateway import Gateway
+from gateway.scheduler import Scheduler
+from gateway.uplink import UplinkWindow
+
+
+def test_window_limits_frames_in_flight():
+    sent = []
+    uplink = UplinkWindow(send=sent.append, window=2, timeout=10, scheduler=Scheduler())
+    assert(uplink.submit(b"a", 1) == 0)
+    assert(uplink.submit(b"b", 2) == 1)
+
+    third = threading.Thread(target=uplink.submit, args=(b"c", 3))
+    third.start()
+    time.sleep(0.05)
+    assert(len(sent) == 2)
+    uplink.ack(0)
+    third.join(1)
+    assert([stubs.unsequence_frame(frame) for frame in sent] == [
+        (uplink.session, 0, b"a"), (uplink.session, 1, b"b"), (uplink.session, 2, b"c")])
+    assert(uplink.outstanding() == 2)
+
+
+def test_unacknowledged_frames_are_resent_then_given_up():
+    sent, acked, gave_up = [], [], threading.Event()
+    uplink = UplinkWindow(
+        send=sent.append, window=4, timeout=0.03, max_attempts=3, scheduler=Scheduler(),
+        on_ack=acked.append, on_give_up=lambda command_id, attempts: gave_up.set())
+    uplink.submit(b"heard", 1)
+    uplink.submit(b"unheard", 2)
+    uplink.ack(0)
+    uplink.ack(0)
+    assert(acked == [1])
+
+    assert(gave_up.wait(1))
+    # Only the unacknowledged frame is sent again
+    assert([stubs.unsequence_frame(frame)[2] for frame in sent] == [b"heard"] + [b"unheard"] * 3)
+    assert((uplink.retransmits, uplink.outstanding()) == (2, 0))
+
+
+def test_satellite_acks_each_frame_and_runs_it_once():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api)
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        gateway.command_callback(Command({"id": 1, "type": "error", "system": "Example FlatSat", "fields": []}), api)
+        # A retransmitted copy is acknowledged again, but not run again
+        frame = stubs.sequence_frame(gateway.uplink.session, 0, b"not decoded")
+        gateway.satellite.process_command(frame, gateway)
+
+    states = [c.kwargs["state"] for c in api.transmit_command_update.call_args_list]
+    assert(states == ["preparing_on_gateway", "transmitted_to_system", "acked_by_system", "failed"])
+    assert(gateway.uplink.outstanding() == 0)
+
+
+def test_a_satellite_that_outlives_its_gateway_runs_the_next_gateways_commands():
+    first_api, second_api = mock.MagicMock(), mock.MagicMock()
+    first = Gateway(api=first_api)
+    second = Gateway(api=second_api, satellite=first.satellite)
+    with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+        for gateway, api in ((first, first_api), (second, second_api)):
+            gateway.command_callback(Command({"id": 1, "type": "error", "system": "Example FlatSat", "fields": []}), api)
+
+    # Both windows number their first frame 0, but in different sessions
+    assert(first.uplink.session != second.uplink.session)
+    for api in (first_api, second_api):
+        assert(api.transmit_command_update.call_args.kwargs["state"] == "failed")
+
+
+def test_acks_for_another_session_are_ignored():
+    acked = []
+    uplink = UplinkWindow(send=lambda frame: None, timeout=10, scheduler=Scheduler(), on_ack=acked.append)
+    uplink.submit(b"a", 1)
+    uplink.ack(0, session=uplink.session ^ 1)
+    assert(acked == [] and uplink.outstanding() == 1)
+    uplink.ack(0, session=uplink.session)
+    assert(acked == [1] and uplink.outstanding() == 0)
@@ -0,0 +1,64 @@
+import json
+from unittest import mock
+from gateway import stubs
+from gateway.gateway import Gateway
+from gateway.validation import CommandValidator
+from majortom_gateway.command import Command
+from satellite.satellite import COMMAND_DEFINITIONS_PATH
+
+with open(COMMAND_DEFINITIONS_PATH) as f:
+    DEFINITIONS = json.load(f)["definitions"]
+
+
+def make_command(type, **fields):
+    return Command({"id": 1, "type": type, "system": "Example FlatSat",
+                    "fields": [{"name": name, "value": value} for name, value in fields.items()]})
+
+
+def test_valid_command_passes():
+    validator = CommandValidator(DEFINITIONS)
+    assert(validator.validate(make_command("telemetry", mode="NOMINAL", duration=10)) is None)
+
+
+def test_type_and_enum_errors():
+    validator = CommandValidator(DEFINITIONS)
+    errors = validator.validate(make_command("telemetry", mode="LOUD", duration="10"))
+    assert(len(errors) == 2)
+    assert(errors[0].startswith("mode is invalid"))
+    assert(errors[1].startswith("duration type is invalid"))
+    # Booleans are not integers
+    assert(validator.validate(make_command("telemetry", mode="ERROR", duration=True)) is not None)
+
+
+def test_numeric_range():
+    validator = CommandValidator({"point": {"fields": [{"name": "angle", "type": "number", "range": [0, 90]}]}})
+    assert(validator.validate(make_command("point", angle=45.5)) is None)
+    assert(validator.validate(make_command("point", angle=91))[0].startswith("angle is out of range"))
+
+
+def test_defaults_are_filled_and_survive_encoding():
+    validator = CommandValidator(DEFINITIONS)
+    command = make_command("telemetry", mode="NOMINAL")
+    assert(validator.validate(command) is None)
+    assert(command.fields["duration"] == 300)
+    decoded = stubs.translate_binary_to_command(stubs.translate_command_to_binary(command))
+    assert(decoded.fields["duration"] == 300)
+
+
+def test_missing_required_field():
+    validator = CommandValidator(DEFINITIONS)
+    assert(validator.validate(make_command("telemetry", duration=5)) == ["mode is required."])
+
+
+def test_unknown_commands_are_not_validated():
+    assert(CommandValidator(DEFINITIONS).validate(make_command("launch", anything=1)) is None)
+
+
+def test_gateway_rejects_before_satellite():
+    api = mock.MagicMock()
+    gateway = Gateway(api=api, definitions=DEFINITIONS)
+    with mock.patch.object(gateway.satellite, "process_command") as process_command:
+        with mock.patch("gateway.gateway.async_to_sync", lambda f: f):
+            gateway.command_callback(make_command("telemetry", mode="NOMINAL", duration="soon"), api)
+    process_command.assert_not_called()
+    assert(api.transmit_command_update.call_args.kwargs["state"] == "failed")
@@ -0,0 +1,33 @@
+import asyncio
+import pytest
+from loadtest.harness import parse_mix, run_load
+
+# These are regression gates rather than precise measurements: the floors are set well below what
+# a laptop achieves so that only a real slowdown (or a hang) trips them.
+
+
+def test_parse_mix():
+    assert(parse_mix("ping=8,cancel=2") == {"ping": 8.0, "cancel": 2.0})
+    assert(parse_mix("ping") == {"ping": 1.0})
+    with pytest.raises(ValueError):
+        parse_mix("launch=1")
+
+
+def test_sync_gateway_keeps_up_with_pings():
+    report = asyncio.run(run_load(mode="sync", mix={"ping": 9, "cancel": 1}, rate=20, duration=2, drain=5, seed=1))
+
+    assert(report.sent > 0)
+    assert(report.unfinished == 0)
+    assert(report.throughput >= 10)
+    # The fake satellite waits one second before answering a ping
+    assert(report.percentile(99, "ping") < 3.0)
+
+
+def test_async_gateway_keeps_up_with_pings():
+    report = asyncio.run(run_load(mode="async", mix={"ping": 9, "cancel": 1}, rate=50, duration=2, drain=5, seed=1))
+
+    assert(report.sent > 0)
+    assert(report.unfinished == 0)
+    assert(report.throughput >= 25)
+    assert(report.percentile(99, "ping") < 0.5)
+    assert(report.message_counts["command_update"] >= report.sent)
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+from loadtest.replay import parse_speed, replay
+
+
+def recorded_session(system):
+    session = []
+    # Recorded ids start at 1, as the warm-up ping's does
+    for i in range(20):
+        session.append((1600000000.0 + i * 0.5, {"type": "command", "command": {
+            "id": 1 + i, "type": "ping", "system": system, "fields": []}}))
+    session.append((1600000010.0, {"type": "cancel", "command": {"id": 999}}))
+    return session
+
+
+def test_parse_speed():
+    assert(parse_speed("max") is None)
+    assert(parse_speed("2.5") == 2.5)
+    with pytest.raises(ValueError):
+        parse_speed("0")
+
+
+def test_replay_at_max_speed():
+    report = asyncio.run(replay(recorded_session("Example FlatSat"), mode="sync", speed=None, drain=10))
+    assert(report.sent == 20)
+    assert(report.cancels_sent == 1)
+    assert(report.unfinished == 0)
+    # Ten seconds of recording, replayed without waiting
+    assert(report.duration < 1.0)
+
+
+def test_replay_at_recorded_pace_scaled():
+    report = asyncio.run(replay(recorded_session("Example FlatSat"), mode="async", speed=20, drain=10,
+                                system="Space Oddity"))
+    assert(report.sent == 20)
+    assert(report.unfinished == 0)
+    assert(0.45 <= report.duration < 2.0)
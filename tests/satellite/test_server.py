@@ -0,0 +1,94 @@
+import asyncio
+import subprocess
+import sys
+import threading
+import time
+from unittest import mock
+
+import pytest
+from majortom_gateway.command import Command
+
+from gateway import stubs
+from gateway.gateway import Gateway
+from gateway.satellite_link import RemoteSatellite
+from satellite.link import CALL, COMMAND, FrameDecoder, encode_frame, parse_address
+
+
+class RecordingAPI:
+    def __init__(self):
+        self.updates = []
+
+    async def transmit_command_update(self, command_id, state, dict={}):
+        self.updates.append((command_id, state, dict))
+
+
+def test_frames_survive_any_chunking():
+    frames = [
+        encode_frame(COMMAND, body=b"\x00" * 300),
+        encode_frame(CALL, {"method": "fail_command", "args": [1], "kwargs": {"errors": ["no"]}}),
+    ]
+    stream = b"".join(frames)
+    decoder = FrameDecoder()
+    decoded = []
+    for i in range(0, len(stream), 7):
+        decoded += decoder.feed(stream[i:i + 7])
+    assert(decoded == [
+        (COMMAND, None, b"\x00" * 300),
+        (CALL, {"method": "fail_command", "args": [1], "kwargs": {"errors": ["no"]}}, b""),
+    ])
+    assert(parse_address("unix:/tmp/sat.sock") == ("unix", "/tmp/sat.sock"))
+    assert(parse_address("localhost:7000") == ("tcp", ("localhost", 7000)))
+    with pytest.raises(ValueError):
+        parse_address("localhost")
+
+
+@pytest.fixture
+def satellite_process(tmp_path):
+    address = f"unix:{tmp_path / 'flatsat.sock'}"
+    process = subprocess.Popen([sys.executable, "-m", "satellite.server", address, "-l", "error"])
+    yield address
+    process.terminate()
+    process.wait()
+
+
+def test_gateway_commands_a_satellite_in_another_process(satellite_process):
+    loop = asyncio.new_event_loop()
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+    api = RecordingAPI()
+    satellite = RemoteSatellite(satellite_process, loop, retry_delay=0.05)
+    gateway = Gateway(api=api, loop=loop, satellite=satellite)
+    connection = asyncio.run_coroutine_threadsafe(satellite.connect(), loop)
+    try:
+        deadline = time.monotonic() + 10
+        while satellite.transport is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+        for i in range(50):
+            gateway.command_callback(Command({"id": i, "type": "ping", "system": satellite.name, "fields": []}), api)
+        gateway.command_callback(Command({"id": 50, "type": "error", "system": satellite.name, "fields": []}), api)
+
+        def finished():
+            return {command_id for command_id, state, _ in api.updates if state in ("completed", "failed")}
+        while len(finished()) < 51 and time.monotonic() < deadline:
+            time.sleep(0.05)
+    finally:
+        satellite.close()
+        connection.result(timeout=5)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+
+    final = {command_id: (state, args) for command_id, state, args in api.updates if state in ("completed", "failed")}
+    assert(all(final[i] == ("completed", {"status": "completed", "payload": "pong"}) for i in range(50)))
+    assert(final[50] == ("failed", {"status": "failed", "errors": ["Command purposely failed."]}))
+
+
+def test_commands_fail_while_the_link_is_down():
+    satellite = RemoteSatellite("unix:/nonexistent.sock", loop=None)
+    gateway = mock.Mock()
+    encrypted = stubs.encrypt(stubs.packetize(stubs.translate_command_to_binary(
+        Command({"id": 7, "type": "ping", "system": satellite.name, "fields": []}))))
+    # Commands come from the uplink window with a sequence number
+    satellite.process_command(stubs.sequence_frame(5, 0, encrypted), gateway)
+    gateway.uplink_dropped.assert_called_once_with(5, 0)
+    gateway.fail_command.assert_called_once_with(7, errors=["No link to the satellite at unix:/nonexistent.sock"])